@@ -9,6 +9,7 @@ Para ejecutar: python app.py
 
 import sys
 import logging
+import multiprocessing
 from pathlib import Path
 
 # Rutas: en ejecutable PyInstaller los módulos viven en sys._MEIPASS, no en ./src
@@ -20,16 +21,6 @@ else:
     _root = Path(__file__).resolve().parent
     sys.path.insert(0, str(_root / "src"))
 
-from PyQt6.QtWidgets import QApplication, QMessageBox
-from PyQt6.QtCore import Qt
-
-from config.logging_config import setup_logging
-from core.version import get_version_string
-from ui.main_window import MainWindow
-
-# Configurar logging
-logger = setup_logging()
-
 
 def main():
     """
@@ -37,6 +28,18 @@ def main():
 
     Inicia la aplicación PyQt6 con la ventana principal de tabs
     """
+    # Qt, la interfaz y el logging se cargan aquí y no al importar el módulo:
+    # con spawn (Windows, ejecutable PyInstaller) cada proceso del pool vuelve
+    # a ejecutar este archivo como __mp_main__ y no debe abrir su propio log
+    from PyQt6.QtWidgets import QApplication, QMessageBox
+
+    from config.logging_config import setup_logging
+    from core.version import get_version_string
+    from ui.main_window import MainWindow
+
+    # Configurar logging
+    logger = setup_logging()
+
     logger.info("=" * 80)
     logger.info(f"Iniciando {get_version_string()}")
     logger.info("=" * 80)
@@ -94,4 +97,6 @@ def main():
 
 
 if __name__ == "__main__":
+    # Necesario para los pools de procesos en el ejecutable PyInstaller (Windows)
+    multiprocessing.freeze_support()
     main()
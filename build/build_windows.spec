@@ -51,6 +51,7 @@ a = Analysis(
         'openpyxl',
         'openpyxl.cell._writer',
         'openpyxl.styles',
+        'lxml.etree',
         'PyQt6.QtCore',
         'PyQt6.QtWidgets',
         'PyQt6.QtGui',
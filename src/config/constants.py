@@ -63,6 +63,34 @@ REGGIS_HEADERS = [
     'Total Con IVA'
 ]
 
+# Claves de las líneas extraídas, en el mismo orden que REGGIS_HEADERS
+REGGIS_CAMPOS = (
+    'numero_factura',
+    'nombre_producto',
+    'codigo_subyacente',
+    'unidad_medida',
+    'cantidad',
+    'precio_unitario',
+    'fecha_factura',
+    'fecha_pago',
+    'nit_comprador',
+    'nombre_comprador',
+    'nit_vendedor',
+    'nombre_vendedor',
+    'principal',
+    'municipio',
+    'iva',
+    'descripcion',
+    'activa_factura',
+    'activa_bodega',
+    'incentivo',
+    'cantidad_original',
+    'moneda',
+    'total_sin_iva',
+    'total_iva',
+    'total_con_iva',
+)
+
 # Constantes específicas para LACTALIS COMPRAS
 LACTALIS_CONFIG = {
     # NIT de Lactalis (comprador) - CONFIGURAR CON EL NIT REAL
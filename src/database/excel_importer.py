@@ -5,11 +5,119 @@ Valida los encabezados y formatos antes de importar
 
 import openpyxl
 import logging
-from typing import List, Dict, Tuple
+import re
+import unicodedata
+import zipfile
+import xml.etree.ElementTree as ET
+from functools import lru_cache
+from typing import List, Dict, Tuple, Optional
 from pathlib import Path
 
 logger = logging.getLogger(__name__)
 
+# Rutas internas de un XLSX estándar (hoja única generada por Excel)
+_XLSX_HOJA = 'xl/worksheets/sheet1.xml'
+_XLSX_STRINGS = 'xl/sharedStrings.xml'
+_XLSX_NS = '{http://schemas.openxmlformats.org/spreadsheetml/2006/main}'
+_COLUMNA_RE = re.compile(r'([A-Z]+)')
+
+# Tipos de celda que se leen tal cual como texto; con otros (número, booleano,
+# fecha, error) la conversión se deja a openpyxl
+_TIPOS_TEXTO = frozenset(('s', 'inlineStr', 'str'))
+
+# Separadores ignorados al comparar encabezados ('Cod. Padre' == 'cod_padre')
+_SEPARADORES = str.maketrans('', '', ' ._-\t')
+
+
+@lru_cache(maxsize=128)
+def _canonizar_encabezado(texto: str) -> str:
+    """Normaliza un encabezado: minúsculas, sin tildes y sin separadores"""
+    descompuesto = unicodedata.normalize('NFKD', texto.strip().lower())
+    sin_tildes = ''.join(c for c in descompuesto if not unicodedata.combining(c))
+    return sin_tildes.translate(_SEPARADORES)
+
+
+def _indice_columna(referencia: str) -> int:
+    """Convierte una referencia de celda (ej. 'C1') en índice de columna base 0"""
+    letras = _COLUMNA_RE.match(referencia).group(1)
+    indice = 0
+    for letra in letras:
+        indice = indice * 26 + (ord(letra) - 64)
+    return indice - 1
+
+
+def _leer_shared_strings(z: zipfile.ZipFile, hasta: int) -> List[str]:
+    """Lee la tabla de cadenas compartidas solo hasta el índice requerido"""
+    cadenas = []
+    if hasta < 0:
+        return cadenas
+    with z.open(_XLSX_STRINGS) as f:
+        for _, elem in ET.iterparse(f, events=('end',)):
+            if elem.tag == _XLSX_NS + 'si':
+                cadenas.append(''.join(t.text or '' for t in elem.iter(_XLSX_NS + 't')))
+                elem.clear()
+                if len(cadenas) > hasta:
+                    break
+    return cadenas
+
+
+def _leer_primera_fila_rapido(archivo_path: str) -> Optional[List]:
+    """
+    Lee la primera fila de un XLSX directamente del ZIP, sin cargar el libro
+
+    Solo se recorre el XML de la hoja hasta el primer <row> y la tabla de
+    cadenas compartidas hasta el último índice usado en esa fila.
+
+    Returns:
+        Lista de valores de la primera fila, o None si la estructura del
+        archivo no es la esperada, la fila 1 está vacía o tiene celdas que
+        no son de texto (el llamador debe usar openpyxl)
+    """
+    try:
+        with zipfile.ZipFile(archivo_path) as z:
+            nombres = z.namelist()
+            hojas = [n for n in nombres if n.startswith('xl/worksheets/sheet')]
+            # Con varias hojas la activa puede no ser sheet1: usar openpyxl
+            if hojas != [_XLSX_HOJA]:
+                return None
+
+            celdas = []
+            with z.open(_XLSX_HOJA) as f:
+                for _, elem in ET.iterparse(f, events=('end',)):
+                    if elem.tag == _XLSX_NS + 'row':
+                        # El primer <row> puede no ser la fila 1 si esta está vacía
+                        if elem.get('r', '1') != '1':
+                            return None
+                        for c in elem.iter(_XLSX_NS + 'c'):
+                            tipo = c.get('t', 'n')
+                            if tipo == 'inlineStr':
+                                valor = ''.join(t.text or '' for t in c.iter(_XLSX_NS + 't'))
+                            else:
+                                valor = c.findtext(_XLSX_NS + 'v')
+                            if valor is not None and tipo not in _TIPOS_TEXTO:
+                                return None
+                            celdas.append((c.get('r'), tipo, valor))
+                        break
+
+            indices_sst = [int(v) for _, tipo, v in celdas if tipo == 's' and v is not None]
+            sst = []
+            if _XLSX_STRINGS in nombres:
+                sst = _leer_shared_strings(z, max(indices_sst, default=-1))
+    except (zipfile.BadZipFile, ET.ParseError, KeyError, ValueError, IndexError):
+        return None
+
+    fila = []
+    for posicion, (referencia, tipo, valor) in enumerate(celdas):
+        indice = _indice_columna(referencia) if referencia else posicion
+        while len(fila) < indice:
+            fila.append(None)
+        if tipo == 's' and valor is not None:
+            if int(valor) >= len(sst):
+                return None
+            valor = sst[int(valor)]
+        fila.append(valor)
+    return fila
+
 
 class ExcelImporterError(Exception):
     """Excepción para errores de importación de Excel"""
@@ -29,33 +137,67 @@ class ExcelImporter:
     MATERIALES_HEADERS = ['CODIGO', 'DESCRIPCION', 'SOCIEDAD']
     CLIENTES_HEADERS = ['Cód.Padre', 'Nombre Código Padre', 'NIT', 'Se Registra']
 
-    # Mapeo de variantes de encabezados (normalización)
+    # Mapeo de variantes de encabezados, con claves en forma canónica
+    # (ver _canonizar_encabezado: sin tildes, espacios, puntos ni guiones)
     MATERIALES_HEADERS_VARIANTS = {
         'codigo': 'CODIGO',
-        'código': 'CODIGO',
         'code': 'CODIGO',
         'descripcion': 'DESCRIPCION',
-        'descripción': 'DESCRIPCION',
         'description': 'DESCRIPCION',
         'sociedad': 'SOCIEDAD',
         'company': 'SOCIEDAD'
     }
 
     CLIENTES_HEADERS_VARIANTS = {
-        'cod.padre': 'Cód.Padre',
-        'cod padre': 'Cód.Padre',
-        'codigo padre': 'Cód.Padre',
-        'código padre': 'Cód.Padre',
-        'nombre codigo padre': 'Nombre Código Padre',
-        'nombre código padre': 'Nombre Código Padre',
+        'codpadre': 'Cód.Padre',
+        'codigopadre': 'Cód.Padre',
+        'nombrecodigopadre': 'Nombre Código Padre',
         'nombre': 'Nombre Código Padre',
         'nit': 'NIT',
-        'se registra': 'Se Registra',
-        'se_registra': 'Se Registra',
+        'seregistra': 'Se Registra',
         'registrar': 'Se Registra',
         'registro': 'Se Registra'
     }
 
+    @staticmethod
+    def _normalizar_encabezados(headers_originales: List[str],
+                                variantes: Dict[str, str]) -> Tuple[List[str], Dict[str, str]]:
+        """
+        Mapea los encabezados del archivo a sus nombres estándar
+
+        Returns:
+            Tupla (headers_normalizados, columnas_mapeadas)
+        """
+        columnas_mapeadas = {}
+        headers_normalizados = []
+        for col in headers_originales:
+            col_normalizado = variantes.get(_canonizar_encabezado(col))
+            if col_normalizado is not None:
+                columnas_mapeadas[col] = col_normalizado
+                headers_normalizados.append(col_normalizado)
+            else:
+                headers_normalizados.append(col)
+        return headers_normalizados, columnas_mapeadas
+
+    @staticmethod
+    def _leer_encabezados(archivo_path: str) -> Optional[tuple]:
+        """
+        Lee la fila de encabezados para validación
+
+        Intenta la lectura directa del XLSX y recurre a openpyxl si el
+        archivo no tiene la estructura estándar.
+        """
+        fila = _leer_primera_fila_rapido(archivo_path)
+        if fila is not None:
+            return tuple(fila)
+
+        wb = openpyxl.load_workbook(archivo_path, read_only=True)
+        try:
+            ws = wb.active
+            return next(ws.iter_rows(min_row=1, max_row=1, values_only=True), None)
+        finally:
+            wb.close()
+
     @staticmethod
     def importar_materiales_desde_excel(archivo_path: str) -> List[Dict]:
         """
@@ -90,16 +232,9 @@ class ExcelImporter:
             logger.debug(f"Encabezados encontrados: {headers_originales}")
 
             # Mapear encabezados con variantes
-            columnas_mapeadas = {}
-            headers_normalizados = []
-            for col in headers_originales:
-                col_lower = col.lower().strip()
-                if col_lower in ExcelImporter.MATERIALES_HEADERS_VARIANTS:
-                    col_normalizado = ExcelImporter.MATERIALES_HEADERS_VARIANTS[col_lower]
-                    columnas_mapeadas[col] = col_normalizado
-                    headers_normalizados.append(col_normalizado)
-                else:
-                    headers_normalizados.append(col)
+            headers_normalizados, columnas_mapeadas = ExcelImporter._normalizar_encabezados(
+                headers_originales, ExcelImporter.MATERIALES_HEADERS_VARIANTS
+            )
 
             if columnas_mapeadas:
                 logger.info(f"Columnas normalizadas: {columnas_mapeadas}")
@@ -125,8 +260,13 @@ class ExcelImporter:
                 'procesadora de leches': '890903711',
             }
 
+            # Reservar la lista según las dimensiones de la hoja. En modo
+            # read_only max_row puede faltar o quedarse corto: se usa append
+            capacidad = max((ws.max_row or 0) - 1, 0)
+            materiales = [None] * capacidad
+            total = 0
+
             # Leer datos (desde fila 2 en adelante)
-            materiales = []
             for row_num, row in enumerate(ws.iter_rows(min_row=2, values_only=True), start=2):
                 if not row or all(cell is None or str(cell).strip() == '' for cell in row):
                     continue  # Saltar filas vacías
@@ -156,8 +296,13 @@ class ExcelImporter:
 
                 # Filtrar filas vacías
                 if material['codigo'] or material['descripcion'] or material['sociedad']:
-                    materiales.append(material)
+                    if total < capacidad:
+                        materiales[total] = material
+                    else:
+                        materiales.append(material)
+                    total += 1
 
+            del materiales[total:]
             wb.close()
             logger.info(f"Materiales extraídos: {len(materiales)}")
             return materiales
@@ -202,16 +347,9 @@ class ExcelImporter:
             logger.debug(f"Encabezados encontrados: {headers_originales}")
 
             # Mapear encabezados con variantes
-            columnas_mapeadas = {}
-            headers_normalizados = []
-            for col in headers_originales:
-                col_lower = col.lower().strip()
-                if col_lower in ExcelImporter.CLIENTES_HEADERS_VARIANTS:
-                    col_normalizado = ExcelImporter.CLIENTES_HEADERS_VARIANTS[col_lower]
-                    columnas_mapeadas[col] = col_normalizado
-                    headers_normalizados.append(col_normalizado)
-                else:
-                    headers_normalizados.append(col)
+            headers_normalizados, columnas_mapeadas = ExcelImporter._normalizar_encabezados(
+                headers_originales, ExcelImporter.CLIENTES_HEADERS_VARIANTS
+            )
 
             if columnas_mapeadas:
                 logger.info(f"Columnas normalizadas: {columnas_mapeadas}")
@@ -230,8 +368,13 @@ class ExcelImporter:
             idx_nit = headers_normalizados.index('NIT')
             idx_se_registra = headers_normalizados.index('Se Registra')
 
+            # Reservar la lista según las dimensiones de la hoja. En modo
+            # read_only max_row puede faltar o quedarse corto: se usa append
+            capacidad = max((ws.max_row or 0) - 1, 0)
+            clientes = [None] * capacidad
+            total = 0
+
             # Leer datos (desde fila 2 en adelante)
-            clientes = []
             for row_num, row in enumerate(ws.iter_rows(min_row=2, values_only=True), start=2):
                 if not row or all(cell is None or str(cell).strip() == '' for cell in row):
                     continue  # Saltar filas vacías
@@ -251,8 +394,13 @@ class ExcelImporter:
 
                 # Filtrar filas vacías
                 if cliente['cod_padre'] or cliente['nombre_codigo_padre']:
-                    clientes.append(cliente)
+                    if total < capacidad:
+                        clientes[total] = cliente
+                    else:
+                        clientes.append(cliente)
+                    total += 1
 
+            del clientes[total:]
             wb.close()
             logger.info(f"Clientes extraídos: {len(clientes)}")
             return clientes
@@ -278,33 +426,20 @@ class ExcelImporter:
             if not Path(archivo_path).exists():
                 return False, f"Archivo no encontrado: {archivo_path}"
 
-            wb = openpyxl.load_workbook(archivo_path, read_only=True)
-            ws = wb.active
-
             # Leer solo encabezados
-            headers_row = next(ws.iter_rows(min_row=1, max_row=1, values_only=True))
+            headers_row = ExcelImporter._leer_encabezados(archivo_path)
             if not headers_row:
-                wb.close()
                 return False, "El archivo está vacío"
 
             headers_originales = [str(h).strip() if h else '' for h in headers_row]
 
             # Intentar mapear encabezados
-            columnas_mapeadas = {}
-            headers_normalizados = []
-            for col in headers_originales:
-                col_lower = col.lower().strip()
-                if col_lower in ExcelImporter.MATERIALES_HEADERS_VARIANTS:
-                    col_normalizado = ExcelImporter.MATERIALES_HEADERS_VARIANTS[col_lower]
-                    columnas_mapeadas[col] = col_normalizado
-                    headers_normalizados.append(col_normalizado)
-                else:
-                    headers_normalizados.append(col)
+            headers_normalizados, _ = ExcelImporter._normalizar_encabezados(
+                headers_originales, ExcelImporter.MATERIALES_HEADERS_VARIANTS
+            )
 
             headers_faltantes = [h for h in ExcelImporter.MATERIALES_HEADERS if h not in headers_normalizados]
 
-            wb.close()
-
             if headers_faltantes:
                 return False, f"Encabezados faltantes: {', '.join(headers_faltantes)}"
 
@@ -328,33 +463,20 @@ class ExcelImporter:
             if not Path(archivo_path).exists():
                 return False, f"Archivo no encontrado: {archivo_path}"
 
-            wb = openpyxl.load_workbook(archivo_path, read_only=True)
-            ws = wb.active
-
             # Leer solo encabezados
-            headers_row = next(ws.iter_rows(min_row=1, max_row=1, values_only=True))
+            headers_row = ExcelImporter._leer_encabezados(archivo_path)
             if not headers_row:
-                wb.close()
                 return False, "El archivo está vacío"
 
             headers_originales = [str(h).strip() if h else '' for h in headers_row]
 
             # Intentar mapear encabezados
-            columnas_mapeadas = {}
-            headers_normalizados = []
-            for col in headers_originales:
-                col_lower = col.lower().strip()
-                if col_lower in ExcelImporter.CLIENTES_HEADERS_VARIANTS:
-                    col_normalizado = ExcelImporter.CLIENTES_HEADERS_VARIANTS[col_lower]
-                    columnas_mapeadas[col] = col_normalizado
-                    headers_normalizados.append(col_normalizado)
-                else:
-                    headers_normalizados.append(col)
+            headers_normalizados, _ = ExcelImporter._normalizar_encabezados(
+                headers_originales, ExcelImporter.CLIENTES_HEADERS_VARIANTS
+            )
 
             headers_faltantes = [h for h in ExcelImporter.CLIENTES_HEADERS if h not in headers_normalizados]
 
-            wb.close()
-
             if headers_faltantes:
                 return False, f"Encabezados faltantes: {', '.join(headers_faltantes)}"
 
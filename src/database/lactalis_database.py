@@ -6,12 +6,40 @@ Gestiona materiales y clientes con validaciones automáticas
 import sqlite3
 import logging
 import os
-from typing import List, Dict, Tuple, Optional
+import threading
+from contextlib import contextmanager
+from functools import lru_cache
+from typing import List, Dict, Tuple, Optional, Iterable, Iterator, Set
 from pathlib import Path
 
 logger = logging.getLogger(__name__)
 
 
+# Rutas de BD cuyo esquema ya se creó/verificó en este proceso
+_BD_INICIALIZADAS: Set[str] = set()
+
+
+@lru_cache(maxsize=None)
+def _ruta_bd_por_defecto() -> str:
+    """
+    Ruta por defecto de la BD dentro del proyecto (./database/)
+
+    Se calcula y se crea el directorio una sola vez por proceso.
+    """
+    base_dir = Path(__file__).resolve().parents[2] / 'database'
+    if not base_dir.is_dir():
+        logger.info(f"Creando directorio de base de datos: {base_dir}")
+        base_dir.mkdir(parents=True, exist_ok=True)
+    return str(base_dir / 'lactalis_ventas.db')
+
+
+def _limpiar(valor) -> str:
+    """Texto sin espacios alrededor; evita str() cuando el valor ya es texto"""
+    if type(valor) is str:
+        return valor.strip()
+    return str(valor).strip()
+
+
 class LactalisDatabase:
     """
     Gestor de base de datos SQLite para Lactalis Ventas
@@ -21,6 +49,62 @@ class LactalisDatabase:
     2. clientes: cod_padre, nombre_codigo_padre, nit
     """
 
+    # Ajustes de rendimiento: WAL evita reescribir el archivo completo en cada
+    # commit y synchronous=NORMAL elimina un fsync por transacción en WAL
+    _PRAGMAS = """
+        PRAGMA journal_mode=WAL;
+        PRAGMA synchronous=NORMAL;
+        PRAGMA temp_store=MEMORY;
+        PRAGMA cache_size=-64000;
+        PRAGMA mmap_size=268435456;
+        PRAGMA busy_timeout=5000;
+    """
+
+    # Consultas de búsqueda frecuentes. Se mantienen como texto constante para
+    # que el caché de sentencias de sqlite3 reutilice la sentencia preparada
+    _SQL_VALIDAR_MATERIAL = (
+        "SELECT 1 FROM materiales WHERE codigo = ? AND sociedad = ? LIMIT 1"
+    )
+    _SQL_OBTENER_MATERIAL = (
+        "SELECT codigo, descripcion, sociedad, fecha_creacion "
+        "FROM materiales WHERE codigo = ? AND sociedad = ?"
+    )
+    _SQL_VALIDAR_CLIENTE = (
+        "SELECT 1 FROM clientes "
+        "WHERE nit = ? AND TRIM(UPPER(COALESCE(se_registra, 'NIT'))) = 'NIT' LIMIT 1"
+    )
+    _SQL_OBTENER_CLIENTE = (
+        "SELECT cod_padre, nombre_codigo_padre, nit, fecha_creacion "
+        "FROM clientes WHERE cod_padre = ?"
+    )
+
+    _DDL = """
+        CREATE TABLE IF NOT EXISTS materiales (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            codigo TEXT NOT NULL,
+            descripcion TEXT NOT NULL,
+            sociedad TEXT NOT NULL,
+            fecha_creacion TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            UNIQUE(codigo, sociedad)
+        );
+
+        CREATE TABLE IF NOT EXISTS clientes (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            cod_padre TEXT NOT NULL,
+            nombre_codigo_padre TEXT NOT NULL,
+            nit TEXT,
+            se_registra TEXT DEFAULT 'NIT',
+            fecha_creacion TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            UNIQUE(cod_padre)
+        );
+
+        -- Los índices implícitos de UNIQUE(codigo, sociedad) y UNIQUE(cod_padre)
+        -- ya cubren las búsquedas; los índices simples que existían en BDs
+        -- anteriores solo duplicaban trabajo en cada INSERT
+        DROP INDEX IF EXISTS idx_materiales_codigo;
+        DROP INDEX IF EXISTS idx_clientes_cod_padre;
+    """
+
     def __init__(self, db_path: Optional[str] = None):
         """
         Inicializa la conexión a la base de datos
@@ -30,21 +114,35 @@ class LactalisDatabase:
         """
         try:
             if db_path is None:
-                # Guardar la BD dentro del proyecto (./database/)
-                project_root = Path(__file__).resolve().parents[2]
-                base_dir = project_root / 'database'
-
-                logger.info(f"Creando directorio de base de datos: {base_dir}")
-                base_dir.mkdir(parents=True, exist_ok=True)
-                db_path = str(base_dir / 'lactalis_ventas.db')
+                db_path = _ruta_bd_por_defecto()
 
             self.db_path = db_path
             logger.info(f"Ruta de base de datos: {self.db_path}")
 
+            # Cachés de búsquedas frecuentes (se invalidan al importar datos)
+            self._validar_material_cache = lru_cache(maxsize=4096)(self._consultar_material_existe)
+            self._obtener_material_cache = lru_cache(maxsize=4096)(self._consultar_material)
+            self._validar_cliente_cache = lru_cache(maxsize=4096)(self._consultar_cliente_existe)
+            self._obtener_cliente_cache = lru_cache(maxsize=4096)(self._consultar_cliente)
+
+            # Conexiones de solo lectura por hilo para validar_*/obtener_*
+            self._local = threading.local()
+            self._conexiones_ro: List[sqlite3.Connection] = []
+            self._conexiones_ro_lock = threading.Lock()
+
             self.conn = None
+
+            # El esquema se verifica una sola vez por archivo en cada proceso
+            # (siempre si el archivo no existía o si la BD es en memoria)
+            clave_bd = self._clave_inicializacion()
+            esquema_listo = clave_bd in _BD_INICIALIZADAS and Path(clave_bd).exists()
+
             self._conectar()
-            self._crear_tablas()
-            self._asegurar_columna_se_registra()
+            if not esquema_listo:
+                self._crear_tablas()
+                self._asegurar_columna_se_registra()
+                if clave_bd:
+                    _BD_INICIALIZADAS.add(clave_bd)
 
             logger.info("Base de datos inicializada correctamente")
         except Exception as e:
@@ -54,56 +152,77 @@ class LactalisDatabase:
     def _conectar(self):
         """Conecta a la base de datos SQLite"""
         try:
-            self.conn = sqlite3.connect(self.db_path, check_same_thread=False)
+            # isolation_level=None: las transacciones se controlan con _transaccion()
+            self.conn = sqlite3.connect(
+                self.db_path, check_same_thread=False, isolation_level=None, cached_statements=256
+            )
             self.conn.row_factory = sqlite3.Row
+            self.conn.executescript(self._PRAGMAS)
             logger.info(f"Conectado a base de datos: {self.db_path}")
         except Exception as e:
             logger.error(f"Error conectando a base de datos: {str(e)}")
             raise
 
-    def _crear_tablas(self):
-        """Crea las tablas si no existen"""
-        try:
-            cursor = self.conn.cursor()
-
-            # Tabla de materiales
-            cursor.execute("""
-                CREATE TABLE IF NOT EXISTS materiales (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    codigo TEXT NOT NULL,
-                    descripcion TEXT NOT NULL,
-                    sociedad TEXT NOT NULL,
-                    fecha_creacion TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    UNIQUE(codigo, sociedad)
-                )
-            """)
-
-            # Índice para búsqueda rápida de materiales
-            cursor.execute("""
-                CREATE INDEX IF NOT EXISTS idx_materiales_codigo
-                ON materiales(codigo)
-            """)
+    def _clave_inicializacion(self) -> Optional[str]:
+        """Ruta absoluta usada para recordar que el esquema ya existe (None en memoria)"""
+        if self.db_path == ':memory:':
+            return None
+        return str(Path(self.db_path).resolve())
 
-            # Tabla de clientes
-            cursor.execute("""
-                CREATE TABLE IF NOT EXISTS clientes (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    cod_padre TEXT NOT NULL,
-                    nombre_codigo_padre TEXT NOT NULL,
-                    nit TEXT,
-                    se_registra TEXT DEFAULT 'NIT',
-                    fecha_creacion TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    UNIQUE(cod_padre)
-                )
-            """)
+    def _conn_ro(self) -> sqlite3.Connection:
+        """
+        Retorna la conexión de solo lectura del hilo actual (la crea la primera vez)
 
-            # Índice para búsqueda rápida de clientes
-            cursor.execute("""
-                CREATE INDEX IF NOT EXISTS idx_clientes_cod_padre
-                ON clientes(cod_padre)
+        Con WAL los lectores no bloquean al escritor, así que las búsquedas de
+        varios hilos no se serializan sobre self.conn, que queda para importar_*.
+        """
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            return conn
+
+        if self.db_path == ':memory:':
+            # Una BD en memoria no se puede abrir desde otra conexión
+            conn = self.conn
+        else:
+            uri = f"{Path(self.db_path).resolve().as_uri()}?mode=ro"
+            conn = sqlite3.connect(
+                uri, uri=True, check_same_thread=False, isolation_level=None, cached_statements=256
+            )
+            conn.row_factory = sqlite3.Row
+            conn.executescript("""
+                PRAGMA temp_store=MEMORY;
+                PRAGMA mmap_size=268435456;
+                PRAGMA busy_timeout=5000;
             """)
+            with self._conexiones_ro_lock:
+                self._conexiones_ro.append(conn)
+
+        self._local.conn = conn
+        return conn
+
+    def _limpiar_caches(self):
+        """Invalida las cachés de validar_*/obtener_* tras modificar los datos"""
+        self._validar_material_cache.cache_clear()
+        self._obtener_material_cache.cache_clear()
+        self._validar_cliente_cache.cache_clear()
+        self._obtener_cliente_cache.cache_clear()
+
+    @contextmanager
+    def _transaccion(self, conn: Optional[sqlite3.Connection] = None):
+        """Ejecuta el bloque dentro de una transacción explícita BEGIN/COMMIT"""
+        conn = conn or self.conn
+        conn.execute("BEGIN")
+        try:
+            yield conn
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
 
-            self.conn.commit()
+    def _crear_tablas(self):
+        """Crea las tablas si no existen (todo el DDL en un solo executescript)"""
+        try:
+            self.conn.executescript(self._DDL)
             logger.info("Tablas creadas/verificadas exitosamente")
 
         except Exception as e:
@@ -140,49 +259,56 @@ class LactalisDatabase:
         """
         nuevos = 0
         existentes = 0
-        errores = 0
+        conteo = {'validas': 0, 'errores': 0}
 
-        cursor = self.conn.cursor()
+        # Un solo lote: la restricción UNIQUE(codigo, sociedad) descarta los existentes.
+        # Las filas se validan a medida que executemany las consume (sin lista intermedia)
+        try:
+            with self._transaccion():
+                cursor = self.conn.executemany("""
+                    INSERT OR IGNORE INTO materiales (codigo, descripcion, sociedad)
+                    VALUES (?, ?, ?)
+                """, self._filas_materiales(materiales, conteo))
+            nuevos = cursor.rowcount
+            existentes = conteo['validas'] - nuevos
+        except Exception as e:
+            logger.error(f"Error insertando lote de materiales: {str(e)}")
+            # El lote se revirtió completo: ningún material quedó importado
+            nuevos = existentes = 0
+            conteo['errores'] = len(materiales)
 
-        for material in materiales:
-            try:
-                codigo = str(material.get('codigo', '')).strip()
-                descripcion = str(material.get('descripcion', '')).strip()
-                sociedad = str(material.get('sociedad', '')).strip()
-
-                # Validar campos requeridos
-                if not codigo or not descripcion or not sociedad:
-                    logger.warning(f"Material incompleto: {material}")
-                    errores += 1
-                    continue
-
-                # Verificar si ya existe
-                cursor.execute("""
-                    SELECT id FROM materiales
-                    WHERE codigo = ? AND sociedad = ?
-                """, (codigo, sociedad))
-
-                if cursor.fetchone():
-                    existentes += 1
-                    logger.debug(f"Material ya existe: {codigo} - {sociedad}")
-                else:
-                    # Insertar nuevo material
-                    cursor.execute("""
-                        INSERT INTO materiales (codigo, descripcion, sociedad)
-                        VALUES (?, ?, ?)
-                    """, (codigo, descripcion, sociedad))
-                    nuevos += 1
-                    logger.debug(f"Material insertado: {codigo} - {descripcion}")
-
-            except Exception as e:
-                logger.error(f"Error importando material {material}: {str(e)}")
-                errores += 1
-
-        self.conn.commit()
+        errores = conteo['errores']
+        self._limpiar_caches()
         logger.info(f"Importación materiales: {nuevos} nuevos, {existentes} existentes, {errores} errores")
 
         return nuevos, existentes, errores
 
+    @staticmethod
+    def _filas_materiales(materiales: Iterable[Dict], conteo: Dict[str, int]) -> Iterator[Tuple[str, str, str]]:
+        """
+        Genera las filas (codigo, descripcion, sociedad) válidas para insertar
+
+        Args:
+            materiales: Diccionarios con keys: codigo, descripcion, sociedad
+            conteo: Acumula 'validas' y 'errores' mientras se consume el generador
+
+        Sin try/except por fila: un registro que no sea diccionario aborta el
+        lote completo, que se revierte y se reporta en importar_*.
+        """
+        for material in materiales:
+            codigo = _limpiar(material.get('codigo', ''))
+            descripcion = _limpiar(material.get('descripcion', ''))
+            sociedad = _limpiar(material.get('sociedad', ''))
+
+            # Validar campos requeridos
+            if not codigo or not descripcion or not sociedad:
+                logger.warning(f"Material incompleto: {material}")
+                conteo['errores'] += 1
+                continue
+
+            conteo['validas'] += 1
+            yield codigo, descripcion, sociedad
+
     def validar_material(self, codigo: str, sociedad: str) -> bool:
         """
         Valida si un material existe en la base de datos
@@ -195,17 +321,16 @@ class LactalisDatabase:
             True si existe, False si no existe
         """
         try:
-            cursor = self.conn.cursor()
-            cursor.execute("""
-                SELECT id FROM materiales
-                WHERE codigo = ? AND sociedad = ?
-            """, (codigo.strip(), sociedad.strip()))
-
-            return cursor.fetchone() is not None
+            return self._validar_material_cache(codigo.strip(), sociedad.strip())
         except Exception as e:
             logger.error(f"Error validando material: {str(e)}")
             return False
 
+    def _consultar_material_existe(self, codigo: str, sociedad: str) -> bool:
+        """Consulta sin caché de validar_material"""
+        cursor = self._conn_ro().execute(self._SQL_VALIDAR_MATERIAL, (codigo, sociedad))
+        return cursor.fetchone() is not None
+
     def obtener_material(self, codigo: str, sociedad: str) -> Optional[Dict]:
         """
         Obtiene los datos de un material
@@ -218,26 +343,84 @@ class LactalisDatabase:
             Diccionario con datos del material o None si no existe
         """
         try:
-            cursor = self.conn.cursor()
-            cursor.execute("""
-                SELECT codigo, descripcion, sociedad, fecha_creacion
-                FROM materiales
-                WHERE codigo = ? AND sociedad = ?
-            """, (codigo.strip(), sociedad.strip()))
-
-            row = cursor.fetchone()
-            if row:
-                return {
-                    'codigo': row['codigo'],
-                    'descripcion': row['descripcion'],
-                    'sociedad': row['sociedad'],
-                    'fecha_creacion': row['fecha_creacion']
-                }
-            return None
+            material = self._obtener_material_cache(codigo.strip(), sociedad.strip())
+            # Copia para que el llamador no altere la entrada en caché
+            return dict(material) if material else None
         except Exception as e:
             logger.error(f"Error obteniendo material: {str(e)}")
             return None
 
+    def _consultar_material(self, codigo: str, sociedad: str) -> Optional[Dict]:
+        """Consulta sin caché de obtener_material"""
+        cursor = self._conn_ro().execute(self._SQL_OBTENER_MATERIAL, (codigo, sociedad))
+
+        row = cursor.fetchone()
+        if row:
+            return {
+                'codigo': row['codigo'],
+                'descripcion': row['descripcion'],
+                'sociedad': row['sociedad'],
+                'fecha_creacion': row['fecha_creacion']
+            }
+        return None
+
+    def validar_materiales_lote(self, pares: Iterable[Tuple[str, str]]) -> Set[Tuple[str, str]]:
+        """
+        Valida muchos materiales con una sola consulta
+
+        Los pares se cargan en una tabla temporal y se cruzan con materiales.
+
+        Args:
+            pares: Iterable de tuplas (codigo, sociedad)
+
+        Returns:
+            Conjunto de tuplas (codigo, sociedad), sin espacios, que existen en la BD
+        """
+        try:
+            return {
+                (row['codigo'], row['sociedad'])
+                for row in self._consultar_materiales_lote(pares, "c.codigo, c.sociedad")
+            }
+        except Exception as e:
+            logger.error(f"Error validando lote de materiales: {str(e)}")
+            return set()
+
+    def obtener_materiales_lote(self, pares: Iterable[Tuple[str, str]]) -> Dict[Tuple[str, str], Dict]:
+        """
+        Obtiene los datos de muchos materiales con una sola consulta
+
+        Args:
+            pares: Iterable de tuplas (codigo, sociedad)
+
+        Returns:
+            Diccionario {(codigo, sociedad): datos del material} con los que existen
+        """
+        try:
+            filas = self._consultar_materiales_lote(
+                pares, "m.codigo, m.descripcion, m.sociedad, m.fecha_creacion"
+            )
+            return {(row['codigo'], row['sociedad']): dict(row) for row in filas}
+        except Exception as e:
+            logger.error(f"Error obteniendo lote de materiales: {str(e)}")
+            return {}
+
+    def _consultar_materiales_lote(self, pares: Iterable[Tuple[str, str]], columnas: str) -> List[sqlite3.Row]:
+        """Carga los pares en temp.consulta_materiales y los cruza con materiales"""
+        with self._transaccion(self._conn_ro()) as conn:
+            conn.execute(
+                "CREATE TEMP TABLE IF NOT EXISTS consulta_materiales (codigo TEXT, sociedad TEXT)"
+            )
+            conn.execute("DELETE FROM temp.consulta_materiales")
+            conn.executemany(
+                "INSERT INTO temp.consulta_materiales (codigo, sociedad) VALUES (?, ?)",
+                ((_limpiar(codigo), _limpiar(sociedad)) for codigo, sociedad in pares)
+            )
+            return conn.execute(f"""
+                SELECT DISTINCT {columnas}
+                FROM temp.consulta_materiales c
+                JOIN materiales m ON m.codigo = c.codigo AND m.sociedad = c.sociedad
+            """).fetchall()
+
     def contar_materiales(self) -> int:
         """Cuenta el total de materiales en la base de datos"""
         try:
@@ -268,7 +451,11 @@ class LactalisDatabase:
                 LIMIT ? OFFSET ?
             """, (limit, offset))
 
-            return [dict(row) for row in cursor.fetchall()]
+            # Acceso posicional: evita la iteración de claves de dict(row)
+            return [
+                {'codigo': r[0], 'descripcion': r[1], 'sociedad': r[2], 'fecha_creacion': r[3]}
+                for r in cursor
+            ]
         except Exception as e:
             logger.error(f"Error listando materiales: {str(e)}")
             return []
@@ -286,7 +473,7 @@ class LactalisDatabase:
                 SELECT descripcion
                 FROM materiales
             """)
-            return [row['descripcion'] for row in cursor.fetchall()]
+            return [r[0] for r in cursor]
         except Exception as e:
             logger.error(f"Error listando descripciones de materiales: {str(e)}")
             return []
@@ -304,7 +491,7 @@ class LactalisDatabase:
                 SELECT descripcion, sociedad
                 FROM materiales
             """)
-            return [dict(row) for row in cursor.fetchall()]
+            return [{'descripcion': r[0], 'sociedad': r[1]} for r in cursor]
         except Exception as e:
             logger.error(f"Error listando materiales con sociedad: {str(e)}")
             return []
@@ -337,67 +524,75 @@ class LactalisDatabase:
         """
         nuevos = 0
         existentes = 0
-        errores = 0
+        conteo = {'validas': 0, 'errores': 0}
 
-        cursor = self.conn.cursor()
+        # Un solo lote: los clientes existentes (mismo cod_padre) se actualizan.
+        # rowcount no distingue inserciones de actualizaciones, se usa el conteo.
+        try:
+            with self._transaccion():
+                total_antes = self.conn.execute("SELECT COUNT(*) FROM clientes").fetchone()[0]
+                self.conn.executemany("""
+                    INSERT INTO clientes (cod_padre, nombre_codigo_padre, nit, se_registra)
+                    VALUES (?, ?, ?, ?)
+                    ON CONFLICT(cod_padre) DO UPDATE SET
+                        nombre_codigo_padre = excluded.nombre_codigo_padre,
+                        nit = excluded.nit,
+                        se_registra = excluded.se_registra
+                """, self._filas_clientes(clientes, conteo))
+                total_despues = self.conn.execute("SELECT COUNT(*) FROM clientes").fetchone()[0]
+            nuevos = total_despues - total_antes
+            existentes = conteo['validas'] - nuevos
+        except Exception as e:
+            logger.error(f"Error insertando lote de clientes: {str(e)}")
+            # El lote se revirtió completo: ningún cliente quedó importado
+            nuevos = existentes = 0
+            conteo['errores'] = len(clientes)
 
-        for cliente in clientes:
-            try:
-                cod_padre = str(cliente.get('cod_padre', '')).strip()
-                nombre = str(cliente.get('nombre_codigo_padre', '')).strip()
-                nit = str(cliente.get('nit', '')).strip()
-                se_registra_raw = str(cliente.get('se_registra', '')).strip()
-
-                # Validar campos requeridos
-                if not cod_padre or not nombre:
-                    logger.warning(f"Cliente incompleto: {cliente}")
-                    errores += 1
-                    continue
-
-                se_registra = self._normalizar_se_registra(se_registra_raw)
-
-                # Si no hay valor en Se Registra, aplicar regla heredada por NIT
-                if not se_registra_raw:
-                    if nit.lower() in ['no nit', 'nonit', 'sin nit']:
-                        se_registra = 'NO NIT'
-                    else:
-                        se_registra = 'NIT'
-
-                # Validar que si tiene NIT, sea válido (no vacío)
-                nit_final = nit if nit and nit.lower() != 'nit' else None
-
-                # Verificar si ya existe
-                cursor.execute("""
-                    SELECT id FROM clientes
-                    WHERE cod_padre = ?
-                """, (cod_padre,))
-
-                if cursor.fetchone():
-                    existentes += 1
-                    cursor.execute("""
-                        UPDATE clientes
-                        SET nombre_codigo_padre = ?, nit = ?, se_registra = ?
-                        WHERE cod_padre = ?
-                    """, (nombre, nit_final, se_registra, cod_padre))
-                    logger.debug(f"Cliente actualizado: {cod_padre}")
-                else:
-                    # Insertar nuevo cliente
-                    cursor.execute("""
-                        INSERT INTO clientes (cod_padre, nombre_codigo_padre, nit, se_registra)
-                        VALUES (?, ?, ?, ?)
-                    """, (cod_padre, nombre, nit_final, se_registra))
-                    nuevos += 1
-                    logger.debug(f"Cliente insertado: {cod_padre} - {nombre}")
-
-            except Exception as e:
-                logger.error(f"Error importando cliente {cliente}: {str(e)}")
-                errores += 1
-
-        self.conn.commit()
+        errores = conteo['errores']
+        self._limpiar_caches()
         logger.info(f"Importación clientes: {nuevos} nuevos, {existentes} existentes, {errores} errores")
 
         return nuevos, existentes, errores
 
+    def _filas_clientes(self, clientes: Iterable[Dict],
+                        conteo: Dict[str, int]) -> Iterator[Tuple[str, str, Optional[str], str]]:
+        """
+        Genera las filas (cod_padre, nombre, nit, se_registra) válidas para insertar
+
+        Args:
+            clientes: Diccionarios con keys: cod_padre, nombre_codigo_padre, nit, se_registra
+            conteo: Acumula 'validas' y 'errores' mientras se consume el generador
+
+        Sin try/except por fila: un registro que no sea diccionario aborta el
+        lote completo, que se revierte y se reporta en importar_*.
+        """
+        for cliente in clientes:
+            cod_padre = _limpiar(cliente.get('cod_padre', ''))
+            nombre = _limpiar(cliente.get('nombre_codigo_padre', ''))
+            nit = _limpiar(cliente.get('nit', ''))
+            se_registra_raw = _limpiar(cliente.get('se_registra', ''))
+
+            # Validar campos requeridos
+            if not cod_padre or not nombre:
+                logger.warning(f"Cliente incompleto: {cliente}")
+                conteo['errores'] += 1
+                continue
+
+            se_registra = self._normalizar_se_registra(se_registra_raw)
+
+            # Si no hay valor en Se Registra, aplicar regla heredada por NIT
+            if not se_registra_raw:
+                if nit.lower() in ('no nit', 'nonit', 'sin nit'):
+                    se_registra = 'NO NIT'
+                else:
+                    se_registra = 'NIT'
+
+            # Validar que si tiene NIT, sea válido (no vacío)
+            nit_final = nit if nit and nit.lower() != 'nit' else None
+
+            conteo['validas'] += 1
+            yield cod_padre, nombre, nit_final, se_registra
+
     def validar_cliente(self, nit: str) -> bool:
         """
         Valida si un cliente existe en la base de datos por NIT
@@ -409,17 +604,45 @@ class LactalisDatabase:
             True si existe, False si no existe
         """
         try:
-            cursor = self.conn.cursor()
-            cursor.execute("""
-                SELECT id FROM clientes
-                WHERE nit = ? AND TRIM(UPPER(COALESCE(se_registra, 'NIT'))) = 'NIT'
-            """, (nit.strip(),))
-
-            return cursor.fetchone() is not None
+            return self._validar_cliente_cache(nit.strip())
         except Exception as e:
             logger.error(f"Error validando cliente: {str(e)}")
             return False
 
+    def _consultar_cliente_existe(self, nit: str) -> bool:
+        """Consulta sin caché de validar_cliente"""
+        cursor = self._conn_ro().execute(self._SQL_VALIDAR_CLIENTE, (nit,))
+        return cursor.fetchone() is not None
+
+    def validar_clientes_lote(self, nits: Iterable[str]) -> Set[str]:
+        """
+        Valida muchos clientes por NIT con una sola consulta
+
+        Args:
+            nits: Iterable de NITs
+
+        Returns:
+            Conjunto de NITs (sin espacios) que existen en la BD y se registran
+        """
+        try:
+            with self._transaccion(self._conn_ro()) as conn:
+                conn.execute("CREATE TEMP TABLE IF NOT EXISTS consulta_nits (nit TEXT)")
+                conn.execute("DELETE FROM temp.consulta_nits")
+                conn.executemany(
+                    "INSERT INTO temp.consulta_nits (nit) VALUES (?)",
+                    ((_limpiar(nit),) for nit in nits)
+                )
+                filas = conn.execute("""
+                    SELECT DISTINCT c.nit
+                    FROM temp.consulta_nits c
+                    JOIN clientes cl ON cl.nit = c.nit
+                    WHERE TRIM(UPPER(COALESCE(cl.se_registra, 'NIT'))) = 'NIT'
+                """).fetchall()
+            return {row['nit'] for row in filas}
+        except Exception as e:
+            logger.error(f"Error validando lote de clientes: {str(e)}")
+            return set()
+
     def obtener_cliente(self, cod_padre: str) -> Optional[Dict]:
         """
         Obtiene los datos de un cliente
@@ -431,26 +654,27 @@ class LactalisDatabase:
             Diccionario con datos del cliente o None si no existe
         """
         try:
-            cursor = self.conn.cursor()
-            cursor.execute("""
-                SELECT cod_padre, nombre_codigo_padre, nit, fecha_creacion
-                FROM clientes
-                WHERE cod_padre = ?
-            """, (cod_padre.strip(),))
-
-            row = cursor.fetchone()
-            if row:
-                return {
-                    'cod_padre': row['cod_padre'],
-                    'nombre_codigo_padre': row['nombre_codigo_padre'],
-                    'nit': row['nit'],
-                    'fecha_creacion': row['fecha_creacion']
-                }
-            return None
+            cliente = self._obtener_cliente_cache(cod_padre.strip())
+            # Copia para que el llamador no altere la entrada en caché
+            return dict(cliente) if cliente else None
         except Exception as e:
             logger.error(f"Error obteniendo cliente: {str(e)}")
             return None
 
+    def _consultar_cliente(self, cod_padre: str) -> Optional[Dict]:
+        """Consulta sin caché de obtener_cliente"""
+        cursor = self._conn_ro().execute(self._SQL_OBTENER_CLIENTE, (cod_padre,))
+
+        row = cursor.fetchone()
+        if row:
+            return {
+                'cod_padre': row['cod_padre'],
+                'nombre_codigo_padre': row['nombre_codigo_padre'],
+                'nit': row['nit'],
+                'fecha_creacion': row['fecha_creacion']
+            }
+        return None
+
     def contar_clientes(self) -> int:
         """Cuenta el total de clientes en la base de datos"""
         try:
@@ -481,7 +705,11 @@ class LactalisDatabase:
                 LIMIT ? OFFSET ?
             """, (limit, offset))
 
-            return [dict(row) for row in cursor.fetchall()]
+            # Acceso posicional: evita la iteración de claves de dict(row)
+            return [
+                {'cod_padre': r[0], 'nombre_codigo_padre': r[1], 'nit': r[2], 'fecha_creacion': r[3]}
+                for r in cursor
+            ]
         except Exception as e:
             logger.error(f"Error listando clientes: {str(e)}")
             return []
@@ -490,7 +718,18 @@ class LactalisDatabase:
 
     def cerrar(self):
         """Cierra la conexión a la base de datos"""
+        with self._conexiones_ro_lock:
+            for conn in self._conexiones_ro:
+                conn.close()
+            self._conexiones_ro.clear()
+        self._local = threading.local()
+
         if self.conn:
+            try:
+                # Volcar el WAL al archivo principal y dejarlo vacío
+                self.conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+            except sqlite3.Error as e:
+                logger.warning(f"No se pudo hacer checkpoint del WAL: {str(e)}")
             self.conn.close()
             logger.info("Conexión a base de datos cerrada")
 
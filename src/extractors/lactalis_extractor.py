@@ -3,15 +3,88 @@ Extractor de datos de facturas electrónicas XML para LACTALIS COMPRAS
 Lee archivos XML directamente desde ZIPs sin necesidad de extraer
 """
 
-import xml.etree.ElementTree as ET
 import logging
-from typing import List, Dict, Optional
-from decimal import Decimal, InvalidOperation
+import sys
+from typing import List, Dict, Optional, Union
 
-from config.constants import NAMESPACES, CURRENCY_CODE_MAP, UNIT_MAP, LACTALIS_CONFIG
+from config.constants import NAMESPACES, CURRENCY_CODE_MAP, LACTALIS_CONFIG
+from utils.xml_ubl import (
+    ET, LXML_DISPONIBLE, compilar, compilar_primero, eventos_xml, parsear_xml
+)
 
 logger = logging.getLogger(__name__)
 
+# Etiquetas en notación Clark para el recorrido único del documento.
+# Se internan una vez: las búsquedas en el índice y las comparaciones con
+# las etiquetas del parser no vuelven a concatenar ni a calcular el hash.
+_CAC = '{%s}' % NAMESPACES['cac']
+_CBC = '{%s}' % NAMESPACES['cbc']
+
+_TAG_INVOICE_LINE = sys.intern(_CAC + 'InvoiceLine')
+_TAG_PARTY_TAX_SCHEME = sys.intern(_CAC + 'PartyTaxScheme')
+_TAG_EXTERNAL_REFERENCE = sys.intern(_CAC + 'ExternalReference')
+_TAG_DESCRIPTION = sys.intern(_CBC + 'Description')
+_TAG_ID = sys.intern(_CBC + 'ID')
+_TAG_ISSUE_DATE = sys.intern(_CBC + 'IssueDate')
+_TAG_DUE_DATE = sys.intern(_CBC + 'DueDate')
+_TAG_PAYMENT_DUE_DATE = sys.intern(_CBC + 'PaymentDueDate')
+_TAG_MONEDA = sys.intern(_CBC + 'DocumentCurrencyCode')
+
+# Formato de los cinco montos de una línea en una sola llamada: 5 decimales,
+# separados por NUL (no aparece en un número) para dividirlos después
+_FORMATO_MONTOS_LINEA = '\x00'.join(['{:.5f}'] * 5).format
+
+
+def _formatear_montos_linea(*montos: float) -> List[str]:
+    """Formatea los montos de una línea con coma decimal (estándar colombiano)"""
+    return _FORMATO_MONTOS_LINEA(*montos).replace('.', ',').split('\x00')
+
+
+# Búsqueda de moneda con el método ya enlazado
+_MONEDA_GET = CURRENCY_CODE_MAP.get
+
+# Tabla de traducción coma decimal -> punto (se construye una sola vez)
+_COMA_A_PUNTO = str.maketrans(',', '.')
+
+
+# Rutas relativas a cac:AccountingCustomerParty / cac:AccountingSupplierParty
+_XP_PARTY_COMPANY_ID = compilar_primero('cac:Party/cac:PartyTaxScheme/cbc:CompanyID')
+_XP_PARTY_IDENTIFICATION_ID = compilar_primero('cac:Party/cac:PartyIdentification/cbc:ID')
+_XP_PARTY_REGISTRATION_NAME = compilar_primero('cac:Party/cac:PartyLegalEntity/cbc:RegistrationName')
+_XP_PARTY_NAME = compilar_primero('cac:Party/cac:PartyName/cbc:Name')
+_XP_PARTY_CIUDAD_FISICA = compilar_primero('cac:Party/cac:PhysicalLocation/cac:Address/cbc:CityName')
+_XP_PARTY_CIUDAD_POSTAL = compilar_primero('cac:Party/cac:PostalAddress/cbc:CityName')
+
+# Rutas relativas a cac:PartyTaxScheme
+_XP_COMPANY_ID = compilar_primero('cbc:CompanyID')
+_XP_REGISTRATION_NAME = compilar_primero('cbc:RegistrationName')
+
+# Rutas relativas a cac:InvoiceLine
+_RUTA_CANTIDAD = './/cbc:InvoicedQuantity'
+_RUTA_PRECIO = './/cac:Price/cbc:PriceAmount'
+_RUTA_TOTAL_SIN_IVA = './/cbc:LineExtensionAmount'
+_RUTA_IVA_TAX_TOTAL = './/cac:TaxTotal/cac:TaxSubtotal/cac:TaxCategory/cbc:Percent'
+
+_XP_CANTIDAD = compilar_primero(_RUTA_CANTIDAD)
+_XP_CANTIDAD_SIN_NS = compilar('.//*[local-name()="InvoicedQuantity"]', './/{*}InvoicedQuantity')
+_XP_PRECIO = compilar_primero(_RUTA_PRECIO)
+_XP_TOTAL_SIN_IVA = compilar_primero(_RUTA_TOTAL_SIN_IVA)
+_XP_IVA_TAX_TOTAL = compilar_primero(_RUTA_IVA_TAX_TOTAL)
+_XP_IVA_ALLOWANCE = compilar_primero('.//cac:AllowanceCharge/cac:TaxCategory/cbc:Percent')
+
+_TAG_CANTIDAD = sys.intern(_CBC + 'InvoicedQuantity')
+_TAG_PRECIO = sys.intern(_CBC + 'PriceAmount')
+_TAG_TOTAL_SIN_IVA = sys.intern(_CBC + 'LineExtensionAmount')
+_TAG_PORCENTAJE = sys.intern(_CBC + 'Percent')
+
+# Con lxml, los cuatro campos de la línea salen de una sola evaluación: libxml2
+# ordena el conjunto de nodos de la unión una vez (orden de documento) en lugar
+# de recorrer la línea cuatro veces. Las rutas no comparten etiqueta final, así
+# que el primer nodo de cada etiqueta es el mismo que daría cada ruta por separado.
+_XP_CAMPOS_LINEA = compilar(
+    ' | '.join((_RUTA_CANTIDAD, _RUTA_PRECIO, _RUTA_TOTAL_SIN_IVA, _RUTA_IVA_TAX_TOTAL))
+) if LXML_DISPONIBLE else None
+
 
 class FacturaExtractorLactalis:
     """
@@ -21,22 +94,29 @@ class FacturaExtractorLactalis:
     y la transforma al formato REGGIS estándar
     """
 
-    def __init__(self, xml_content: str, archivo_nombre: str = ""):
+    def __init__(self, xml_content: Union[str, bytes], archivo_nombre: str = ""):
         """
         Inicializa el extractor con contenido XML
 
         Args:
-            xml_content: Contenido del archivo XML como string
+            xml_content: Contenido del archivo XML como string o como bytes
             archivo_nombre: Nombre del archivo para logging
         """
         self.xml_content = xml_content
         self.archivo_nombre = archivo_nombre
         self.root = None
 
+        # Índices llenados por _indexar_documento() en un solo recorrido
+        self._primeros = {}
+        self._primeros_sin_ns = {}
+        self._invoice_lines = []
+        self._invoice_lines_sin_ns = []
+        self._party_tax_schemes = []
+
         try:
-            self.root = ET.fromstring(xml_content)
+            self.root = parsear_xml(xml_content)
         except ET.ParseError as e:
-            logger.error(f"Error parseando XML {archivo_nombre}: {str(e)}")
+            logger.error("Error parseando XML %s: %s", archivo_nombre, e)
             raise
 
     def extraer_datos(self) -> List[Dict]:
@@ -47,12 +127,39 @@ class FacturaExtractorLactalis:
             Lista de diccionarios con datos de cada línea de la factura
         """
         if self.root is None:
-            logger.warning(f"{self.archivo_nombre}: root es None")
+            logger.warning("%s: root es None", self.archivo_nombre)
             return []
 
         try:
-            # Debug: Log del tag raíz
-            logger.debug(f"{self.archivo_nombre}: Tag raiz = {self.root.tag}")
+            # Debug: Log del tag raíz (formato diferido: no se arma el texto si DEBUG está apagado)
+            logger.debug("%s: Tag raiz = %s", self.archivo_nombre, self.root.tag)
+
+            # Un solo recorrido del árbol alimenta todas las búsquedas siguientes.
+            # Sin la etiqueta InvoiceLine en el texto (AttachedDocument,
+            # ApplicationResponse...) no hay líneas y se omite el recorrido.
+            marca_lineas = b'InvoiceLine' if isinstance(self.xml_content, bytes) else 'InvoiceLine'
+            if marca_lineas in self.xml_content:
+                self._indexar_documento()
+
+            # Extraer líneas de productos - intentar con y sin namespace.
+            # Se buscan antes que el encabezado para no consultarlo en vano.
+            invoice_lines = self._invoice_lines
+
+            # Si no encuentra con namespace, intentar sin namespace
+            if not invoice_lines:
+                logger.warning("%s: No se encontraron InvoiceLines con namespace, intentando sin namespace", self.archivo_nombre)
+                # Cualquier elemento cuyo nombre local sea InvoiceLine
+                invoice_lines = self._invoice_lines_sin_ns
+
+            logger.debug("%s: Se encontraron %d lineas de factura", self.archivo_nombre, len(invoice_lines))
+
+            if not invoice_lines:
+                logger.warning(
+                    "%s: No se encontraron lineas de productos. "
+                    "Esto puede ser un AttachedDocument o un tipo de documento diferente.",
+                    self.archivo_nombre
+                )
+                return []
 
             # Extraer datos generales de la factura
             numero_factura = self._extraer_numero_factura()
@@ -61,8 +168,8 @@ class FacturaExtractorLactalis:
             moneda = self._extraer_moneda()
 
             logger.debug(
-                f"{self.archivo_nombre}: Factura={numero_factura}, "
-                f"Fecha={fecha_factura}, Moneda={moneda}"
+                "%s: Factura=%s, Fecha=%s, Moneda=%s",
+                self.archivo_nombre, numero_factura, fecha_factura, moneda
             )
 
             # Datos del comprador: se extraen del XML para distinguir
@@ -78,71 +185,107 @@ class FacturaExtractorLactalis:
             nombre_vendedor = self._extraer_nombre_vendedor()
 
             logger.debug(
-                f"{self.archivo_nombre}: Comprador={nombre_comprador} ({nit_comprador}), "
-                f"Vendedor={nombre_vendedor} ({nit_vendedor if nit_vendedor else 'SIN NIT'})"
+                "%s: Comprador=%s (%s), Vendedor=%s (%s)",
+                self.archivo_nombre, nombre_comprador, nit_comprador,
+                nombre_vendedor, nit_vendedor or 'SIN NIT'
             )
 
-            # Extraer líneas de productos - intentar con y sin namespace
-            invoice_lines = self.root.findall('.//cac:InvoiceLine', NAMESPACES)
-
-            # Si no encuentra con namespace, intentar sin namespace
-            if not invoice_lines:
-                logger.warning(f"{self.archivo_nombre}: No se encontraron InvoiceLines con namespace, intentando sin namespace")
-                # Buscar cualquier elemento que termine en InvoiceLine
-                invoice_lines = self.root.findall('.//*[local-name()="InvoiceLine"]')
-
-            logger.debug(f"{self.archivo_nombre}: Se encontraron {len(invoice_lines)} lineas de factura")
-
-            if not invoice_lines:
-                logger.warning(
-                    f"{self.archivo_nombre}: No se encontraron lineas de productos. "
-                    f"Esto puede ser un AttachedDocument o un tipo de documento diferente."
-                )
-                return []
+            # Campos comunes a todas las líneas: se arman una vez por factura,
+            # incluidos los VALORES FIJOS DE LACTALIS (según especificaciones del cliente)
+            config = LACTALIS_CONFIG
+            encabezado = {
+                'numero_factura': numero_factura,
+                'nombre_producto': config['nombre_producto'],  # FIJO: "LECHE CRUDA"
+                'codigo_subyacente': config['codigo_subyacente'],  # FIJO: "SPN-1"
+                'unidad_medida': config['unidad_medida'],  # FIJO: "Lt"
+                'fecha_factura': fecha_factura,
+                'fecha_pago': fecha_pago,
+                'nit_comprador': nit_comprador,
+                'nombre_comprador': nombre_comprador,
+                'nit_vendedor': nit_vendedor,  # Puede estar vacío en algunos XMLs
+                'nombre_vendedor': nombre_vendedor,
+                'principal': config['principal'],  # FIJO: "C"
+                'municipio': municipio,
+                'descripcion': config['descripcion'],  # FIJO: vacío
+                'activa_factura': config['activa_factura'],  # FIJO: "1"
+                'activa_bodega': config['activa_bodega'],  # FIJO: "1"
+                'incentivo': '',
+                'moneda': moneda,
+            }
 
             lineas = []
             for idx, line in enumerate(invoice_lines, 1):
-                linea_data = self._extraer_linea_producto(
-                    line,
-                    numero_factura,
-                    fecha_factura,
-                    fecha_pago,
-                    nit_comprador,
-                    nombre_comprador,
-                    nit_vendedor,
-                    nombre_vendedor,
-                    municipio,
-                    moneda
-                )
+                linea_data = self._extraer_linea_producto(line, encabezado)
 
                 if linea_data:
                     lineas.append(linea_data)
                 else:
-                    logger.warning(f"{self.archivo_nombre}: Linea {idx} no se pudo extraer")
+                    logger.warning("%s: Linea %d no se pudo extraer", self.archivo_nombre, idx)
 
-            logger.info(f"Extraidas {len(lineas)} lineas de {self.archivo_nombre}")
+            logger.info("Extraidas %d lineas de %s", len(lineas), self.archivo_nombre)
             return lineas
 
         except Exception as e:
-            logger.error(f"Error extrayendo datos de {self.archivo_nombre}: {str(e)}", exc_info=True)
+            logger.error("Error extrayendo datos de %s: %s", self.archivo_nombre, e, exc_info=True)
             return []
 
+    def _indexar_documento(self):
+        """
+        Recorre el árbol una sola vez y guarda los elementos que usan los
+        extractores: el primero de cada etiqueta (en orden de documento, igual
+        que find('.//...')), las InvoiceLine y los PartyTaxScheme.
+        """
+        primeros = self._primeros
+        primeros_sin_ns = self._primeros_sin_ns
+        invoice_lines = self._invoice_lines
+        invoice_lines_sin_ns = self._invoice_lines_sin_ns
+        party_tax_schemes = self._party_tax_schemes
+
+        for elem in self.root.iter():
+            tag = elem.tag
+            if not isinstance(tag, str):
+                continue  # Comentarios / instrucciones de procesamiento
+
+            if tag not in primeros:
+                primeros[tag] = elem
+
+            nombre_local = tag.rpartition('}')[2]
+            if nombre_local not in primeros_sin_ns:
+                primeros_sin_ns[nombre_local] = elem
+
+            if tag == _TAG_INVOICE_LINE:
+                invoice_lines.append(elem)
+            elif nombre_local == 'InvoiceLine':
+                invoice_lines_sin_ns.append(elem)
+            elif tag == _TAG_PARTY_TAX_SCHEME:
+                party_tax_schemes.append(elem)
+
+    @staticmethod
+    def _texto(elemento) -> str:
+        """Texto sin espacios de un elemento, o vacío si no existe"""
+        return elemento.text.strip() if elemento is not None and elemento.text else ""
+
+    def _buscar_en_party(self, party_tag: str, xpath):
+        """Evalúa una XPath relativa dentro del primer Accounting*Party del documento"""
+        party = self._primeros.get(_CAC + party_tag)
+        if party is None:
+            return None
+        return xpath(party)
+
     def _extraer_numero_factura(self) -> str:
         """Extrae el número de factura"""
-        numero = self.root.find('.//cbc:ID', NAMESPACES)
-        return numero.text.strip() if numero is not None and numero.text else ""
+        return self._texto(self._primeros.get(_TAG_ID))
 
     def _extraer_fecha_factura(self) -> str:
         """Extrae la fecha de emisión de la factura"""
-        fecha = self.root.find('.//cbc:IssueDate', NAMESPACES)
-        return fecha.text.strip() if fecha is not None and fecha.text else ""
+        return self._texto(self._primeros.get(_TAG_ISSUE_DATE))
 
     def _extraer_fecha_vencimiento(self) -> str:
         """Extrae la fecha de vencimiento/pago"""
         # Intentar PaymentDueDate primero
-        fecha = self.root.find('.//cbc:DueDate', NAMESPACES)
+        fecha = self._primeros.get(_TAG_DUE_DATE)
         if fecha is None:
-            fecha = self.root.find('.//cbc:PaymentDueDate', NAMESPACES)
+            fecha = self._primeros.get(_TAG_PAYMENT_DUE_DATE)
 
         if fecha is not None and fecha.text:
             return fecha.text.strip()
@@ -152,228 +295,273 @@ class FacturaExtractorLactalis:
 
     def _extraer_moneda(self) -> str:
         """Extrae el código de moneda y lo convierte al formato REGGIS"""
-        moneda_element = self.root.find('.//cbc:DocumentCurrencyCode', NAMESPACES)
+        moneda_element = self._primeros.get(_TAG_MONEDA)
         if moneda_element is not None and moneda_element.text:
-            codigo_moneda = moneda_element.text.strip().upper()
-            return CURRENCY_CODE_MAP.get(codigo_moneda, '1')  # Default COP = 1
+            codigo_moneda = moneda_element.text.strip()
+            # Los códigos ISO 4217 ya vienen en mayúsculas; upper() solo si no coincide
+            moneda = _MONEDA_GET(codigo_moneda)
+            if moneda is None:
+                moneda = _MONEDA_GET(codigo_moneda.upper(), '1')  # Default COP = 1
+            return moneda
         return '1'
 
     def _extraer_nit_comprador(self) -> str:
         """Extrae el NIT del comprador (Lactalis)"""
-        nit = self.root.find('.//cac:AccountingCustomerParty/cac:Party/cac:PartyTaxScheme/cbc:CompanyID', NAMESPACES)
+        nit = self._buscar_en_party('AccountingCustomerParty', _XP_PARTY_COMPANY_ID)
         if nit is not None and nit.text:
             return nit.text.strip()
 
         # Alternativa
-        nit = self.root.find('.//cac:AccountingCustomerParty/cac:Party/cac:PartyIdentification/cbc:ID', NAMESPACES)
-        return nit.text.strip() if nit is not None and nit.text else ""
+        nit = self._buscar_en_party('AccountingCustomerParty', _XP_PARTY_IDENTIFICATION_ID)
+        return self._texto(nit)
 
     def _extraer_nombre_comprador(self) -> str:
         """Extrae el nombre del comprador (Lactalis)"""
-        nombre = self.root.find('.//cac:AccountingCustomerParty/cac:Party/cac:PartyLegalEntity/cbc:RegistrationName', NAMESPACES)
+        nombre = self._buscar_en_party('AccountingCustomerParty', _XP_PARTY_REGISTRATION_NAME)
         if nombre is None:
-            nombre = self.root.find('.//cac:AccountingCustomerParty/cac:Party/cac:PartyName/cbc:Name', NAMESPACES)
-        return nombre.text.strip() if nombre is not None and nombre.text else ""
+            nombre = self._buscar_en_party('AccountingCustomerParty', _XP_PARTY_NAME)
+        return self._texto(nombre)
 
     def _extraer_municipio(self) -> str:
         """Extrae el municipio priorizando comprador y luego proveedor."""
         rutas = [
-            './/cac:AccountingCustomerParty/cac:Party/cac:PhysicalLocation/cac:Address/cbc:CityName',
-            './/cac:AccountingCustomerParty/cac:Party/cac:PostalAddress/cbc:CityName',
-            './/cac:AccountingSupplierParty/cac:Party/cac:PhysicalLocation/cac:Address/cbc:CityName',
-            './/cac:AccountingSupplierParty/cac:Party/cac:PostalAddress/cbc:CityName',
+            ('AccountingCustomerParty', _XP_PARTY_CIUDAD_FISICA),
+            ('AccountingCustomerParty', _XP_PARTY_CIUDAD_POSTAL),
+            ('AccountingSupplierParty', _XP_PARTY_CIUDAD_FISICA),
+            ('AccountingSupplierParty', _XP_PARTY_CIUDAD_POSTAL),
         ]
 
-        for ruta in rutas:
-            municipio = self.root.find(ruta, NAMESPACES)
+        for party_tag, xpath in rutas:
+            municipio = self._buscar_en_party(party_tag, xpath)
             if municipio is not None and municipio.text:
                 return municipio.text.strip()
 
-        # Fallback sin namespace para XMLs menos consistentes.
+        # Fallback sin namespace para XMLs menos consistentes: el primer
+        # CityName con texto (no basta el primero del índice, que puede venir
+        # vacío). Solo se recorre el árbol si fallan las cuatro rutas.
         for elem in self.root.iter():
-            if elem.tag.endswith('CityName') and elem.text:
+            tag = elem.tag
+            if isinstance(tag, str) and tag.endswith('CityName') and elem.text:
                 return elem.text.strip()
 
         return ""
 
+    def _buscar_en_party_tax_schemes(self, xpath):
+        """Primer resultado de la XPath bajo cualquier PartyTaxScheme (orden de documento)"""
+        for party_tax_scheme in self._party_tax_schemes:
+            elemento = xpath(party_tax_scheme)
+            if elemento is not None:
+                return elemento
+        return None
+
     def _extraer_nit_vendedor(self) -> str:
         """Extrae el NIT del vendedor (proveedor) - busca en múltiples ubicaciones"""
         # 1. Ubicación estándar en AccountingSupplierParty
-        nit = self.root.find('.//cac:AccountingSupplierParty/cac:Party/cac:PartyTaxScheme/cbc:CompanyID', NAMESPACES)
+        nit = self._buscar_en_party('AccountingSupplierParty', _XP_PARTY_COMPANY_ID)
         if nit is not None and nit.text:
             return nit.text.strip()
 
         # 2. Alternativa en PartyIdentification
-        nit = self.root.find('.//cac:AccountingSupplierParty/cac:Party/cac:PartyIdentification/cbc:ID', NAMESPACES)
+        nit = self._buscar_en_party('AccountingSupplierParty', _XP_PARTY_IDENTIFICATION_ID)
         if nit is not None and nit.text:
             return nit.text.strip()
 
         # 3. Buscar en cualquier PartyTaxScheme (para XMLs DSP)
-        nit = self.root.find('.//cac:PartyTaxScheme/cbc:CompanyID', NAMESPACES)
+        nit = self._buscar_en_party_tax_schemes(_XP_COMPANY_ID)
         if nit is not None and nit.text:
             return nit.text.strip()
 
         # 4. Intentar sin namespace
-        nit = self.root.find('.//*[local-name()="CompanyID"]')
-        if nit is not None and nit.text:
-            return nit.text.strip()
-
-        return ""
+        return self._texto(self._primeros_sin_ns.get('CompanyID'))
 
     def _extraer_nombre_vendedor(self) -> str:
         """Extrae el nombre del vendedor (proveedor) - busca en múltiples ubicaciones"""
         # 1. Ubicación estándar en PartyLegalEntity
-        nombre = self.root.find('.//cac:AccountingSupplierParty/cac:Party/cac:PartyLegalEntity/cbc:RegistrationName', NAMESPACES)
+        nombre = self._buscar_en_party('AccountingSupplierParty', _XP_PARTY_REGISTRATION_NAME)
         if nombre is not None and nombre.text:
             return nombre.text.strip()
 
         # 2. Alternativa en PartyName
-        nombre = self.root.find('.//cac:AccountingSupplierParty/cac:Party/cac:PartyName/cbc:Name', NAMESPACES)
+        nombre = self._buscar_en_party('AccountingSupplierParty', _XP_PARTY_NAME)
         if nombre is not None and nombre.text:
             return nombre.text.strip()
 
         # 3. Buscar en cualquier PartyTaxScheme/RegistrationName (para XMLs DSP)
-        nombre = self.root.find('.//cac:PartyTaxScheme/cbc:RegistrationName', NAMESPACES)
+        nombre = self._buscar_en_party_tax_schemes(_XP_REGISTRATION_NAME)
         if nombre is not None and nombre.text:
             return nombre.text.strip()
 
         # 4. Intentar sin namespace
-        nombre = self.root.find('.//*[local-name()="RegistrationName"]')
-        if nombre is not None and nombre.text:
-            return nombre.text.strip()
+        return self._texto(self._primeros_sin_ns.get('RegistrationName'))
 
-        return ""
+    @staticmethod
+    def _campos_linea(line_element) -> Dict:
+        """
+        Ubica cantidad, precio, total sin IVA y porcentaje de IVA de una línea
 
-    def _extraer_linea_producto(self, line_element, numero_factura: str, fecha_factura: str,
-                                 fecha_pago: str, nit_comprador: str, nombre_comprador: str,
-                                 nit_vendedor: str, nombre_vendedor: str, municipio: str,
-                                 moneda: str) -> Optional[Dict]:
+        Returns:
+            Diccionario etiqueta -> primer elemento encontrado (orden de documento)
+        """
+        if _XP_CAMPOS_LINEA is not None:
+            campos = {}
+            for elemento in _XP_CAMPOS_LINEA(line_element):
+                if elemento.tag not in campos:
+                    campos[elemento.tag] = elemento
+            return campos
+
+        return {
+            _TAG_CANTIDAD: _XP_CANTIDAD(line_element),
+            _TAG_PRECIO: _XP_PRECIO(line_element),
+            _TAG_TOTAL_SIN_IVA: _XP_TOTAL_SIN_IVA(line_element),
+            _TAG_PORCENTAJE: _XP_IVA_TAX_TOTAL(line_element),
+        }
+
+    def _extraer_linea_producto(self, line_element, encabezado: Dict) -> Optional[Dict]:
         """
         Extrae los datos de una línea de producto
 
         Args:
             line_element: Elemento XML InvoiceLine
-            Resto: Datos generales de la factura
+            encabezado: Datos generales de la factura y valores fijos de Lactalis,
+                comunes a todas las líneas
 
         Returns:
             Diccionario con datos de la línea en formato REGGIS
         """
         try:
-            # VALORES FIJOS DE LACTALIS (según especificaciones del cliente)
-            nombre_producto_text = LACTALIS_CONFIG['nombre_producto']  # Siempre "LECHE CRUDA"
-            codigo_text = LACTALIS_CONFIG['codigo_subyacente']  # Siempre "SPN-1"
-            unidad_medida = LACTALIS_CONFIG['unidad_medida']  # Siempre "Lt"
+            campos = self._campos_linea(line_element)
 
             # Cantidad (sí se extrae del XML)
-            cantidad_element = line_element.find('.//cbc:InvoicedQuantity', NAMESPACES)
+            cantidad_element = campos.get(_TAG_CANTIDAD)
             if cantidad_element is None:
                 # Fallback sin namespace
-                cantidad_element = line_element.find('.//*[local-name()="InvoicedQuantity"]')
+                cantidades = _XP_CANTIDAD_SIN_NS(line_element)
+                cantidad_element = cantidades[0] if cantidades else None
 
             cantidad = self._parse_decimal(cantidad_element.text if cantidad_element is not None else "0")
-            cantidad_original = cantidad  # Guardar cantidad original
 
             # Precio unitario
-            precio_element = line_element.find('.//cac:Price/cbc:PriceAmount', NAMESPACES)
+            precio_element = campos.get(_TAG_PRECIO)
             precio_unitario = self._parse_decimal(precio_element.text if precio_element is not None else "0")
 
             # Totales
-            total_sin_iva_element = line_element.find('.//cbc:LineExtensionAmount', NAMESPACES)
+            total_sin_iva_element = campos.get(_TAG_TOTAL_SIN_IVA)
             total_sin_iva = self._parse_decimal(total_sin_iva_element.text if total_sin_iva_element is not None else "0")
 
             # IVA
-            iva_percent = self._extraer_iva_linea(line_element)
-            total_iva = total_sin_iva * (iva_percent / Decimal('100'))
+            iva_percent = self._extraer_iva_linea(line_element, campos.get(_TAG_PORCENTAJE))
+            total_iva = total_sin_iva * iva_percent / 100.0
             total_con_iva = total_sin_iva + total_iva
 
             # Formatear números al estándar colombiano (coma como separador decimal)
-            cantidad_fmt = self._formatear_numero(cantidad)
-            cantidad_original_fmt = self._formatear_numero(cantidad_original)
-            precio_unitario_fmt = self._formatear_numero(precio_unitario)
-            total_sin_iva_fmt = self._formatear_numero(total_sin_iva)
-            total_iva_fmt = self._formatear_numero(total_iva)
-            total_con_iva_fmt = self._formatear_numero(total_con_iva)
-
-            # Construir línea en formato REGGIS con valores fijos de Lactalis
-            linea_reggis = {
-                'numero_factura': numero_factura,
-                'nombre_producto': nombre_producto_text,  # FIJO: "LECHE CRUDA"
-                'codigo_subyacente': codigo_text,  # FIJO: "SPN-1"
-                'unidad_medida': unidad_medida,  # FIJO: "Lt"
+            # en una sola operación de formato para los cinco montos de la línea
+            cantidad_fmt, precio_unitario_fmt, total_sin_iva_fmt, total_iva_fmt, total_con_iva_fmt = (
+                _formatear_montos_linea(cantidad, precio_unitario, total_sin_iva, total_iva, total_con_iva)
+            )
+            cantidad_original_fmt = cantidad_fmt  # Lactalis no convierte unidades
+
+            # Construir línea en formato REGGIS: copia del encabezado con los valores
+            # fijos (copia en C, más barata que reconstruir las claves) + valores de la línea
+            linea_reggis = encabezado.copy()
+            linea_reggis.update({
                 'cantidad': cantidad_fmt,
                 'precio_unitario': precio_unitario_fmt,
-                'fecha_factura': fecha_factura,
-                'fecha_pago': fecha_pago,
-                'nit_comprador': nit_comprador,
-                'nombre_comprador': nombre_comprador,
-                'nit_vendedor': nit_vendedor,  # Puede estar vacío en algunos XMLs
-                'nombre_vendedor': nombre_vendedor,
-                'principal': LACTALIS_CONFIG['principal'],  # FIJO: "C"
-                'municipio': municipio,
                 'iva': str(int(iva_percent)),
-                'descripcion': LACTALIS_CONFIG['descripcion'],  # FIJO: vacío
-                'activa_factura': LACTALIS_CONFIG['activa_factura'],  # FIJO: "1"
-                'activa_bodega': LACTALIS_CONFIG['activa_bodega'],  # FIJO: "1"
-                'incentivo': '',
                 'cantidad_original': cantidad_original_fmt,
-                'moneda': moneda,
                 'total_sin_iva': total_sin_iva_fmt,
                 'total_iva': total_iva_fmt,
                 'total_con_iva': total_con_iva_fmt
-            }
+            })
 
             return linea_reggis
 
         except Exception as e:
-            logger.error(f"Error extrayendo línea de producto: {str(e)}", exc_info=True)
+            logger.error("Error extrayendo línea de producto: %s", e, exc_info=True)
             return None
 
-    def _extraer_iva_linea(self, line_element) -> Decimal:
-        """Extrae el porcentaje de IVA de una línea"""
+    def _extraer_iva_linea(self, line_element, iva_element=None) -> float:
+        """
+        Extrae el porcentaje de IVA de una línea
+
+        Args:
+            line_element: Elemento XML InvoiceLine
+            iva_element: cbc:Percent de TaxTotal ya ubicado por _campos_linea (opcional)
+        """
         # Buscar en TaxTotal
-        iva_element = line_element.find('.//cac:TaxTotal/cac:TaxSubtotal/cac:TaxCategory/cbc:Percent', NAMESPACES)
+        if iva_element is None:
+            iva_element = _XP_IVA_TAX_TOTAL(line_element)
         if iva_element is not None and iva_element.text:
             return self._parse_decimal(iva_element.text)
 
         # Alternativa: buscar en AllowanceCharge
-        iva_element = line_element.find('.//cac:AllowanceCharge/cac:TaxCategory/cbc:Percent', NAMESPACES)
+        iva_element = _XP_IVA_ALLOWANCE(line_element)
         if iva_element is not None and iva_element.text:
             return self._parse_decimal(iva_element.text)
 
         # Default: 19% (IVA común en Colombia)
-        return Decimal('19')
+        return 19.0
 
-    def _parse_decimal(self, value: str) -> Decimal:
+    def _parse_decimal(self, value: str) -> float:
         """
-        Parsea un string a Decimal de forma segura
+        Parsea un string a float de forma segura
+
+        Se usa float en lugar de Decimal: los montos traen pocos decimales y
+        solo se formatean a 5, muy por debajo de la precisión de un double.
 
         Args:
             value: String con número
 
         Returns:
-            Decimal
+            float
         """
         try:
-            # Limpiar el string
-            cleaned = value.strip().replace(',', '.')
-            return Decimal(cleaned)
-        except (InvalidOperation, ValueError, AttributeError):
-            return Decimal('0')
+            # float() ya ignora los espacios alrededor; translate cambia la coma en una pasada
+            return float(value.translate(_COMA_A_PUNTO))
+        except (ValueError, AttributeError):
+            return 0.0
 
-    def _formatear_numero(self, numero: Decimal, decimales: int = 5) -> str:
-        """
-        Formatea un número Decimal al formato colombiano (coma como separador decimal)
 
-        Args:
-            numero: Número a formatear
-            decimales: Número de decimales
+def extraer_factura_adjunta(xml_content: Union[str, bytes]) -> Optional[str]:
+    """
+    Retorna el XML de la factura embebida si el contenido es un AttachedDocument
 
-        Returns:
-            String con número formateado
-        """
-        # Redondear a N decimales
-        formato = f"{{:.{decimales}f}}"
-        numero_str = formato.format(numero)
+    Busca el primer cac:ExternalReference/cbc:Description con un parser
+    incremental: se detiene al encontrarlo, sin construir el resto del árbol
+    (la ApplicationResponse que suele venir después es casi tan grande como
+    la factura).
 
-        # Reemplazar punto por coma (estándar colombiano)
-        return numero_str.replace('.', ',')
+    Args:
+        xml_content: Contenido XML completo (str, o bytes leídos del archivo o
+            del ZIP: el encoding sale de la declaración XML)
+
+    Returns:
+        XML de la factura (ExternalReference/Description) o None si no lo es
+
+    Raises:
+        ET.ParseError: Si el contenido menciona ExternalReference y no es XML válido
+    """
+    # Descarte previo sin parsear: una factura directa no contiene la etiqueta
+    # (búsqueda de subcadena en C sobre el texto o los bytes)
+    marca = b'ExternalReference' if isinstance(xml_content, bytes) else 'ExternalReference'
+    if marca not in xml_content:
+        return None
+
+    if isinstance(xml_content, bytes):
+        try:
+            return _buscar_factura_adjunta(xml_content)
+        except ET.ParseError:
+            # Bytes que no son UTF-8 válido: se reintenta como antes de leer
+            # en binario, decodificando e ignorando los bytes inválidos
+            xml_content = xml_content.decode('utf-8', errors='ignore')
+    return _buscar_factura_adjunta(xml_content)
+
+
+def _buscar_factura_adjunta(xml_content: Union[str, bytes]) -> Optional[str]:
+    """Recorrido incremental de extraer_factura_adjunta"""
+    for _evento, elemento in eventos_xml(xml_content, tag=_TAG_EXTERNAL_REFERENCE):
+        if elemento.tag != _TAG_EXTERNAL_REFERENCE:
+            continue
+        descripcion = elemento.find(_TAG_DESCRIPTION)
+        if descripcion is not None:
+            return descripcion.text.strip() if descripcion.text else None
+    return None
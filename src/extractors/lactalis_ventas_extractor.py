@@ -6,11 +6,11 @@ Con validaciones estrictas de reglas de negocio
 ACTUALIZACIÓN: Detecta automáticamente el vendedor (Lactalis o Proleche) del XML
 """
 
-import xml.etree.ElementTree as ET
 import logging
 import re
 from typing import List, Dict, Optional, Tuple
-from decimal import Decimal, InvalidOperation
+
+from utils.xml_ubl import ET, LXML_DISPONIBLE, compilar, compilar_primero, compilar_texto, parsear_xml
 
 # Intentar importar desde el proyecto, si no, usar constantes inline
 try:
@@ -57,6 +57,145 @@ except ImportError:
 
 logger = logging.getLogger(__name__)
 
+# Tabla de traducción coma decimal -> punto (se construye una sola vez)
+_COMA_A_PUNTO = str.maketrans(',', '.')
+
+# Formato de los seis montos de una línea en una sola llamada: 5 decimales,
+# separados por NUL (no aparece en un número) para dividirlos después
+_FORMATO_MONTOS_LINEA = '\x00'.join(['{:.5f}'] * 6).format
+
+# Búsqueda de moneda con el método ya enlazado
+_MONEDA_GET = CURRENCY_CODE_MAP.get
+
+# unitCode del XML -> unidad REGGIS en mayúsculas, como la espera la conversión
+# BMC; los códigos fuera de UNIT_MAP se pasan a mayúsculas al vuelo
+_UNIDAD_BMC_GET = {codigo: unidad.upper() for codigo, unidad in UNIT_MAP.items()}.get
+
+# Valores fijos de LACTALIS_VENTAS_CONFIG que van en cada línea REGGIS
+_PRINCIPAL = LACTALIS_VENTAS_CONFIG['principal']
+_ACTIVA_FACTURA = LACTALIS_VENTAS_CONFIG['activa_factura']
+_ACTIVA_BODEGA = LACTALIS_VENTAS_CONFIG['activa_bodega']
+
+# Namespace cbc en notación Clark, resuelto una sola vez
+_CBC = '{%s}' % NAMESPACES['cbc']
+
+# Nombre local del elemento raíz, saltando BOM, declaración, comentarios y DOCTYPE
+_RAIZ = re.compile(
+    r'\ufeff?\s*(?:(?:<\?.*?\?>|<!--.*?-->|<!DOCTYPE[^>]*>)\s*)*<(?:[\w.-]+:)?([\w.-]+)',
+    re.S
+)
+
+# Bytes iniciales que se miran para reconocer la raíz sin parsear
+_TAMANO_VISTAZO_RAIZ = 4096
+
+# Apertura de la Description con la factura embebida en un AttachedDocument
+_INICIO_CDATA_ADJUNTO = re.compile(r'<cbc:Description>\s*<!\[CDATA\[')
+_FIN_CDATA_ADJUNTO = re.compile(r'\]\]>\s*</cbc:Description>')
+
+
+def _formatear_montos_linea(*montos: float) -> List[str]:
+    """Formatea los montos de una línea con coma decimal (estándar colombiano)"""
+    return _FORMATO_MONTOS_LINEA(*montos).replace('.', ',').split('\x00')
+
+
+def _nombre_raiz(xml_content: str) -> Optional[str]:
+    """
+    Devuelve el nombre local del elemento raíz mirando solo el inicio del texto
+
+    Returns:
+        'Invoice', 'AttachedDocument'... o None si no se reconoce
+    """
+    coincidencia = _RAIZ.match(xml_content, 0, _TAMANO_VISTAZO_RAIZ)
+    return coincidencia.group(1) if coincidencia else None
+
+
+def _cdata_adjunto(xml_content: str) -> Optional[str]:
+    """
+    Localiza sin parsear la factura embebida en un AttachedDocument
+
+    Solo se acepta el caso habitual de la DIAN: la primera cbc:Description del
+    documento es hija de un cac:ExternalReference y su único contenido es un
+    bloque CDATA. En cualquier otro caso devuelve None y el llamador hace el
+    parseo completo del AttachedDocument.
+
+    Returns:
+        Texto del CDATA sin espacios en los extremos, o None
+    """
+    inicio = xml_content.find('<cbc:Description')
+    if inicio == -1:
+        return None
+    apertura = _INICIO_CDATA_ADJUNTO.match(xml_content, inicio)
+    if apertura is None:
+        return None
+    # Debe estar dentro de un cac:ExternalReference todavía abierto
+    referencia = xml_content.rfind('<cac:ExternalReference', 0, inicio)
+    if referencia == -1 or xml_content.rfind('</cac:ExternalReference>', 0, inicio) > referencia:
+        return None
+    fin = xml_content.find(']]>', apertura.end())
+    if fin == -1 or _FIN_CDATA_ADJUNTO.match(xml_content, fin) is None:
+        return None
+    return xml_content[apertura.end():fin].strip() or None
+
+
+# Rutas del documento (relativas a la raíz)
+_XP_NUMERO_FACTURA = compilar_texto('.//cbc:ID')
+_XP_FECHA_FACTURA = compilar_texto('.//cbc:IssueDate')
+_XP_DUE_DATE = compilar_texto('.//cbc:DueDate')
+_XP_PAYMENT_DUE_DATE = compilar_texto('.//cbc:PaymentDueDate')
+_XP_MONEDA = compilar_texto('.//cbc:DocumentCurrencyCode')
+_XP_INVOICE_LINES = compilar('.//cac:InvoiceLine')
+_XP_INVOICE_LINES_SIN_NS = compilar('.//*[local-name()="InvoiceLine"]', './/{*}InvoiceLine')
+
+_XP_EXTERNAL_REFERENCE_DESC = compilar_primero('.//cac:ExternalReference/cbc:Description')
+_XP_ATTACHMENT_DESC = compilar_primero('.//cac:Attachment/cac:ExternalReference/cbc:Description')
+
+_XP_ACCOUNTING_COMPRADOR = compilar_primero('.//cac:AccountingCustomerParty')
+_XP_ACCOUNTING_VENDEDOR = compilar_primero('.//cac:AccountingSupplierParty')
+
+# Rutas relativas a cac:AccountingCustomerParty / cac:AccountingSupplierParty
+_XP_PARTY_COMPANY_ID = compilar_texto('cac:Party/cac:PartyTaxScheme/cbc:CompanyID')
+_XP_PARTY_IDENTIFICATION_ID = compilar_texto('cac:Party/cac:PartyIdentification/cbc:ID')
+_XP_PARTY_REGISTRATION_NAME = compilar_texto('cac:Party/cac:PartyLegalEntity/cbc:RegistrationName')
+_XP_PARTY_NAME = compilar_texto('cac:Party/cac:PartyName/cbc:Name')
+_XP_PARTY_CIUDAD = compilar_texto('cac:Party/cac:PhysicalLocation/cac:Address/cbc:CityName')
+
+# Marca de "subárbol aún no buscado" (None significa que no existe)
+_SIN_BUSCAR = object()
+
+# Rutas relativas a cac:InvoiceLine
+_RUTA_DESCRIPCION = './/cac:Item/cbc:Description'
+_RUTA_CODIGO = './/cac:Item/cac:SellersItemIdentification/cbc:ID'
+_RUTA_CANTIDAD = './/cbc:InvoicedQuantity'
+_RUTA_PRECIO = './/cac:Price/cbc:PriceAmount'
+_RUTA_TOTAL_SIN_IVA = './/cbc:LineExtensionAmount'
+
+_XP_DESCRIPCION = compilar_primero(_RUTA_DESCRIPCION)
+_XP_CODIGO = compilar_primero(_RUTA_CODIGO)
+_XP_CANTIDAD = compilar_primero(_RUTA_CANTIDAD)
+_XP_PRECIO = compilar_primero(_RUTA_PRECIO)
+_XP_TOTAL_SIN_IVA = compilar_primero(_RUTA_TOTAL_SIN_IVA)
+_XP_TAX_SUBTOTALES = compilar('.//cac:TaxTotal/cac:TaxSubtotal')
+_XP_IVA_ALLOWANCE = compilar_primero('.//cac:AllowanceCharge/cac:TaxCategory/cbc:Percent')
+_XP_IVA_CATEGORIA = compilar_primero('.//cac:TaxCategory/cbc:Percent')
+
+# Con lxml, los cinco campos de la línea salen de una sola evaluación en lugar
+# de recorrer la línea cinco veces. Las rutas no comparten etiqueta final, así
+# que el primer nodo de cada etiqueta (orden de documento) es el mismo que
+# daría cada ruta por separado.
+_XP_CAMPOS_LINEA = compilar(' | '.join((
+    _RUTA_DESCRIPCION, _RUTA_CODIGO, _RUTA_CANTIDAD, _RUTA_PRECIO, _RUTA_TOTAL_SIN_IVA
+))) if LXML_DISPONIBLE else None
+
+_TAGS_CAMPOS_LINEA = tuple(
+    _CBC + nombre
+    for nombre in ('Description', 'ID', 'InvoicedQuantity', 'PriceAmount', 'LineExtensionAmount')
+)
+
+# Rutas relativas a cac:TaxSubtotal
+_XP_SCHEME_ID = compilar_primero('.//cac:TaxScheme/cbc:ID')
+_XP_SCHEME_NAME = compilar_primero('.//cac:TaxScheme/cbc:Name')
+_XP_PORCENTAJE = compilar_primero('.//cac:TaxCategory/cbc:Percent')
+
 
 class ValidacionFacturaError(Exception):
     """Excepción para facturas que no cumplen reglas de negocio"""
@@ -92,11 +231,25 @@ class FacturaExtractorLactalisVentas:
         self.archivo_nombre = archivo_nombre
         self.root = None
         self.tipo_documento = None
+        # Resultado del recorrido sin namespace de AccountingSupplierParty (perezoso)
+        self._vendedor_sin_ns = None
+        # AccountingSupplierParty / AccountingCustomerParty (perezosos)
+        self._accounting_vendedor = _SIN_BUSCAR
+        self._accounting_comprador = _SIN_BUSCAR
+        # True si self.root ya es la factura interna de un AttachedDocument
+        self._factura_adjunta_parseada = False
 
         try:
-            # Intentar parsear el XML
-            self.root = ET.fromstring(xml_content)
-            self._detectar_tipo_documento()
+            # Un AttachedDocument se reconoce por la raíz y se parsea solo la
+            # factura embebida; si no se puede, se parsea el documento completo
+            if _nombre_raiz(xml_content) == 'AttachedDocument':
+                self.root = self._parsear_factura_adjunta(xml_content)
+            if self.root is None:
+                self.root = parsear_xml(xml_content)
+                self._detectar_tipo_documento()
+            else:
+                self.tipo_documento = 'AttachedDocument'
+                self._factura_adjunta_parseada = True
         except ET.ParseError as e:
             logger.error(f"Error parseando XML {archivo_nombre}: {str(e)}")
             # No hacer raise - dejar que tipo_documento sea None
@@ -116,6 +269,23 @@ class FacturaExtractorLactalisVentas:
         self.tipo_documento = root_tag
         logger.debug(f"{self.archivo_nombre}: Tipo de documento detectado: {self.tipo_documento}")
 
+    @staticmethod
+    def _parsear_factura_adjunta(xml_content: str):
+        """
+        Parsea directamente la factura del CDATA de un AttachedDocument
+
+        Returns:
+            Raíz de la factura interna, o None para recurrir al parseo completo
+        """
+        invoice_xml = _cdata_adjunto(xml_content)
+        if invoice_xml is None:
+            return None
+        try:
+            return parsear_xml(invoice_xml)
+        except Exception:
+            # El parseo completo reproduce el error con su mensaje habitual
+            return None
+
     def _extraer_invoice_de_attached_document(self) -> Optional[str]:
         """
         Extrae el XML de la factura desde un AttachedDocument
@@ -125,7 +295,7 @@ class FacturaExtractorLactalisVentas:
         """
         try:
             # Opción 1: Buscar en ExternalReference/Description (CDATA)
-            description = self.root.find('.//cac:ExternalReference/cbc:Description', NAMESPACES)
+            description = _XP_EXTERNAL_REFERENCE_DESC(self.root)
             if description is not None and description.text:
                 xml_text = description.text.strip()
                 if xml_text:
@@ -133,7 +303,7 @@ class FacturaExtractorLactalisVentas:
                     return xml_text
             
             # Opción 2: Buscar en Attachment/ExternalReference/Description
-            description = self.root.find('.//cac:Attachment/cac:ExternalReference/cbc:Description', NAMESPACES)
+            description = _XP_ATTACHMENT_DESC(self.root)
             if description is not None and description.text:
                 xml_text = description.text.strip()
                 if xml_text:
@@ -166,13 +336,16 @@ class FacturaExtractorLactalisVentas:
             ValidacionFacturaError: Si no cumple las reglas
         """
         # REGLA 1: Solo facturas (Invoice)
-        if self.tipo_documento == 'AttachedDocument':
+        if self.tipo_documento == 'AttachedDocument' and self._factura_adjunta_parseada:
+            # La factura interna ya se parseó al construir el extractor
+            self._detectar_tipo_documento()
+        elif self.tipo_documento == 'AttachedDocument':
             # Extraer y procesar el XML interno
             invoice_xml = self._extraer_invoice_de_attached_document()
             if invoice_xml:
                 # Re-procesar el XML interno
                 try:
-                    self.root = ET.fromstring(invoice_xml)
+                    self.root = parsear_xml(invoice_xml)
                     self._detectar_tipo_documento()
                 except Exception as e:
                     raise ValidacionFacturaError(f"Error procesando XML interno: {str(e)}")
@@ -246,11 +419,11 @@ class FacturaExtractorLactalisVentas:
             )
 
             # Extraer líneas de productos
-            invoice_lines = self.root.findall('.//cac:InvoiceLine', NAMESPACES)
+            invoice_lines = _XP_INVOICE_LINES(self.root)
 
             if not invoice_lines:
-                # Intentar sin namespace
-                invoice_lines = self.root.findall('.//*[local-name()="InvoiceLine"]')
+                # Intentar sin namespace: cualquier elemento cuyo nombre local sea InvoiceLine
+                invoice_lines = _XP_INVOICE_LINES_SIN_NS(self.root)
 
             logger.debug(f"{self.archivo_nombre}: Se encontraron {len(invoice_lines)} líneas de factura")
 
@@ -258,26 +431,47 @@ class FacturaExtractorLactalisVentas:
                 logger.warning(f"{self.archivo_nombre}: No se encontraron líneas de productos")
                 return []
 
+            # Campos comunes a todas las líneas, en el orden de columnas REGGIS: se
+            # arman una vez por factura; los propios de cada línea quedan vacíos
+            encabezado = {
+                'numero_factura': numero_factura,
+                'nombre_producto': '',
+                'codigo_subyacente': '',
+                'unidad_medida': '',
+                'cantidad': '',
+                'precio_unitario': '',
+                'fecha_factura': fecha_factura,
+                'fecha_pago': fecha_pago,
+                'nit_comprador': nit_comprador,
+                'nombre_comprador': nombre_comprador,
+                'nit_vendedor': nit_vendedor,  # Dinámico: Lactalis o Proleche
+                'nombre_vendedor': nombre_vendedor,  # Dinámico: Lactalis o Proleche
+                'principal': _PRINCIPAL,  # FIJO: "V"
+                'municipio': municipio,
+                'iva': '',
+                'descripcion': '',
+                'activa_factura': _ACTIVA_FACTURA,  # FIJO: "1"
+                'activa_bodega': _ACTIVA_BODEGA,  # FIJO: "1"
+                'incentivo': '',
+                'cantidad_original': '',
+                'moneda': moneda,
+                'total_sin_iva': '',
+                'total_iva': '',
+                'total_con_iva': ''
+            }
+
             lineas = []
             lineas_rechazadas = 0
+            # Métodos enlazados una vez, fuera del bucle de líneas
+            extraer_linea = self._extraer_linea_producto
+            agregar_linea = lineas.append
             
             for idx, line in enumerate(invoice_lines, 1):
                 try:
-                    linea_data = self._extraer_linea_producto(
-                        line,
-                        numero_factura,
-                        fecha_factura,
-                        fecha_pago,
-                        nit_vendedor,
-                        nombre_vendedor,
-                        nit_comprador,
-                        nombre_comprador,
-                        municipio,
-                        moneda
-                    )
+                    linea_data = extraer_linea(line, encabezado)
 
                     if linea_data:
-                        lineas.append(linea_data)
+                        agregar_linea(linea_data)
                     else:
                         lineas_rechazadas += 1
                         
@@ -285,7 +479,10 @@ class FacturaExtractorLactalisVentas:
                     logger.warning(f"{self.archivo_nombre}: Línea {idx} rechazada - {str(e)}")
                     lineas_rechazadas += 1
                 except Exception as e:
-                    logger.error(f"{self.archivo_nombre}: Error en línea {idx} - {str(e)}", exc_info=True)
+                    logger.error(
+                        "%s: Error en línea %d - %s", self.archivo_nombre, idx, e,
+                        exc_info=logger.isEnabledFor(logging.DEBUG)
+                    )
                     lineas_rechazadas += 1
 
             if lineas_rechazadas > 0:
@@ -299,55 +496,80 @@ class FacturaExtractorLactalisVentas:
             return lineas
 
         except Exception as e:
-            logger.error(f"Error extrayendo datos de {self.archivo_nombre}: {str(e)}", exc_info=True)
+            logger.error(
+                "Error extrayendo datos de %s: %s", self.archivo_nombre, e,
+                exc_info=logger.isEnabledFor(logging.DEBUG)
+            )
             return []
 
     def _extraer_numero_factura(self) -> str:
         """Extrae el número de factura"""
-        numero = self.root.find('.//cbc:ID', NAMESPACES)
-        return numero.text.strip() if numero is not None and numero.text else ""
+        return (_XP_NUMERO_FACTURA(self.root) or "").strip()
 
     def _extraer_fecha_factura(self) -> str:
         """Extrae la fecha de emisión de la factura"""
-        fecha = self.root.find('.//cbc:IssueDate', NAMESPACES)
-        return fecha.text.strip() if fecha is not None and fecha.text else ""
+        return (_XP_FECHA_FACTURA(self.root) or "").strip()
 
     def _extraer_fecha_vencimiento(self) -> str:
         """Extrae la fecha de vencimiento/pago"""
-        fecha = self.root.find('.//cbc:DueDate', NAMESPACES)
+        fecha = _XP_DUE_DATE(self.root)
         if fecha is None:
-            fecha = self.root.find('.//cbc:PaymentDueDate', NAMESPACES)
+            fecha = _XP_PAYMENT_DUE_DATE(self.root)
 
-        if fecha is not None and fecha.text:
-            return fecha.text.strip()
+        if fecha:
+            return fecha.strip()
 
         # Si no hay fecha de vencimiento, usar fecha de factura
         return self._extraer_fecha_factura()
 
     def _extraer_moneda(self) -> str:
         """Extrae el código de moneda y lo convierte al formato REGGIS"""
-        moneda_element = self.root.find('.//cbc:DocumentCurrencyCode', NAMESPACES)
-        if moneda_element is not None and moneda_element.text:
-            codigo_moneda = moneda_element.text.strip().upper()
-            return CURRENCY_CODE_MAP.get(codigo_moneda, '1')  # Default COP = 1
+        codigo_moneda = _XP_MONEDA(self.root)
+        if codigo_moneda:
+            codigo_moneda = codigo_moneda.strip()
+            # Los códigos ISO 4217 ya vienen en mayúsculas; upper() solo si no coincide
+            moneda = _MONEDA_GET(codigo_moneda)
+            if moneda is None:
+                moneda = _MONEDA_GET(codigo_moneda.upper(), '1')  # Default COP = 1
+            return moneda
         return '1'
 
+    def _texto_comprador(self, xpath) -> Optional[str]:
+        """
+        Texto de una ruta relativa a AccountingCustomerParty
+
+        El subárbol se ubica una sola vez por documento; cada campo del comprador
+        se busca dentro de él en lugar de recorrer el documento completo.
+        """
+        if self._accounting_comprador is _SIN_BUSCAR:
+            self._accounting_comprador = _XP_ACCOUNTING_COMPRADOR(self.root)
+        if self._accounting_comprador is None:
+            return None
+        return xpath(self._accounting_comprador)
+
+    def _texto_vendedor(self, xpath) -> Optional[str]:
+        """Texto de una ruta relativa a AccountingSupplierParty (ver _texto_comprador)"""
+        if self._accounting_vendedor is _SIN_BUSCAR:
+            self._accounting_vendedor = _XP_ACCOUNTING_VENDEDOR(self.root)
+        if self._accounting_vendedor is None:
+            return None
+        return xpath(self._accounting_vendedor)
+
     def _extraer_nit_comprador(self) -> str:
         """Extrae el NIT del comprador (cliente)"""
-        nit = self.root.find('.//cac:AccountingCustomerParty/cac:Party/cac:PartyTaxScheme/cbc:CompanyID', NAMESPACES)
-        if nit is not None and nit.text:
-            return nit.text.strip()
+        nit = self._texto_comprador(_XP_PARTY_COMPANY_ID)
+        if nit:
+            return nit.strip()
 
         # Alternativa
-        nit = self.root.find('.//cac:AccountingCustomerParty/cac:Party/cac:PartyIdentification/cbc:ID', NAMESPACES)
-        return nit.text.strip() if nit is not None and nit.text else ""
+        return (self._texto_comprador(_XP_PARTY_IDENTIFICATION_ID) or "").strip()
 
     def _extraer_nombre_comprador(self) -> str:
         """Extrae el nombre del comprador (cliente)"""
-        nombre = self.root.find('.//cac:AccountingCustomerParty/cac:Party/cac:PartyLegalEntity/cbc:RegistrationName', NAMESPACES)
+        nombre = self._texto_comprador(_XP_PARTY_REGISTRATION_NAME)
         if nombre is None:
-            nombre = self.root.find('.//cac:AccountingCustomerParty/cac:Party/cac:PartyName/cbc:Name', NAMESPACES)
-        return nombre.text.strip() if nombre is not None and nombre.text else ""
+            nombre = self._texto_comprador(_XP_PARTY_NAME)
+        return (nombre or "").strip()
 
     def _extraer_nit_vendedor(self) -> str:
         """
@@ -359,24 +581,17 @@ class FacturaExtractorLactalisVentas:
         - Proleche: 890903711
         """
         # Buscar en AccountingSupplierParty (vendedor)
-        nit = self.root.find('.//cac:AccountingSupplierParty/cac:Party/cac:PartyTaxScheme/cbc:CompanyID', NAMESPACES)
-        if nit is not None and nit.text:
-            return nit.text.strip()
+        nit = self._texto_vendedor(_XP_PARTY_COMPANY_ID)
+        if nit:
+            return nit.strip()
 
         # Alternativa en PartyIdentification
-        nit = self.root.find('.//cac:AccountingSupplierParty/cac:Party/cac:PartyIdentification/cbc:ID', NAMESPACES)
-        if nit is not None and nit.text:
-            return nit.text.strip()
+        nit = self._texto_vendedor(_XP_PARTY_IDENTIFICATION_ID)
+        if nit:
+            return nit.strip()
 
         # Buscar iterando sin namespace
-        for elem in self.root.iter():
-            if elem.tag.endswith('AccountingSupplierParty'):
-                for party_elem in elem.iter():
-                    if party_elem.tag.endswith('CompanyID'):
-                        if party_elem.text:
-                            return party_elem.text.strip()
-
-        return ""
+        return self._buscar_vendedor_sin_ns().get('CompanyID', "")
 
     def _extraer_nombre_vendedor(self) -> str:
         """
@@ -388,40 +603,62 @@ class FacturaExtractorLactalisVentas:
         - PROCESADORA DE LECHES S.A. - PROLECHE S.A.
         """
         # Buscar en PartyLegalEntity
-        nombre = self.root.find('.//cac:AccountingSupplierParty/cac:Party/cac:PartyLegalEntity/cbc:RegistrationName', NAMESPACES)
-        if nombre is not None and nombre.text:
-            return nombre.text.strip()
+        nombre = self._texto_vendedor(_XP_PARTY_REGISTRATION_NAME)
+        if nombre:
+            return nombre.strip()
 
         # Alternativa en PartyName
-        nombre = self.root.find('.//cac:AccountingSupplierParty/cac:Party/cac:PartyName/cbc:Name', NAMESPACES)
-        if nombre is not None and nombre.text:
-            return nombre.text.strip()
+        nombre = self._texto_vendedor(_XP_PARTY_NAME)
+        if nombre:
+            return nombre.strip()
 
         # Buscar iterando sin namespace
+        return self._buscar_vendedor_sin_ns().get('RegistrationName', "")
+
+    def _buscar_vendedor_sin_ns(self) -> Dict[str, str]:
+        """
+        Busca CompanyID y RegistrationName del vendedor ignorando namespaces
+
+        Un solo recorrido del documento sirve a los dos campos: para cada
+        elemento *AccountingSupplierParty (en orden de documento) toma el
+        primer CompanyID / RegistrationName con texto que aún no se tenga.
+        El resultado se guarda para la segunda consulta.
+
+        Returns:
+            Diccionario con las claves encontradas ('CompanyID', 'RegistrationName')
+        """
+        if self._vendedor_sin_ns is not None:
+            return self._vendedor_sin_ns
+
+        encontrados = {}
         for elem in self.root.iter():
-            if elem.tag.endswith('AccountingSupplierParty'):
-                for party_elem in elem.iter():
-                    if party_elem.tag.endswith('RegistrationName'):
-                        if party_elem.text:
-                            return party_elem.text.strip()
+            if not elem.tag.endswith('AccountingSupplierParty'):
+                continue
+            for party_elem in elem.iter():
+                if not party_elem.text:
+                    continue
+                tag = party_elem.tag
+                for sufijo in ('CompanyID', 'RegistrationName'):
+                    if sufijo not in encontrados and tag.endswith(sufijo):
+                        encontrados[sufijo] = party_elem.text.strip()
+            if len(encontrados) == 2:
+                break
 
-        return ""
+        self._vendedor_sin_ns = encontrados
+        return encontrados
 
     def _extraer_municipio(self) -> str:
         """Extrae el municipio del comprador"""
-        municipio = self.root.find('.//cac:AccountingCustomerParty/cac:Party/cac:PhysicalLocation/cac:Address/cbc:CityName', NAMESPACES)
-        return municipio.text.strip() if municipio is not None and municipio.text else ""
+        return (self._texto_comprador(_XP_PARTY_CIUDAD) or "").strip()
 
-    def _extraer_linea_producto(self, line_element, numero_factura: str, fecha_factura: str,
-                                 fecha_pago: str, nit_vendedor: str, nombre_vendedor: str,
-                                 nit_comprador: str, nombre_comprador: str, municipio: str,
-                                 moneda: str) -> Optional[Dict]:
+    def _extraer_linea_producto(self, line_element, encabezado: Dict) -> Optional[Dict]:
         """
         Extrae los datos de una línea de producto con validaciones estrictas
         
         Args:
             line_element: Elemento XML InvoiceLine
-            Resto: Datos generales de la factura
+            encabezado: Datos generales de la factura y valores fijos, comunes a
+                todas las líneas
 
         Returns:
             Diccionario con datos de la línea en formato REGGIS o None si no pasa validaciones
@@ -430,69 +667,56 @@ class FacturaExtractorLactalisVentas:
             ValidacionFacturaError: Si no cumple las reglas de negocio
         """
         try:
+            (nombre_element, codigo_element, cantidad_element,
+             precio_element, total_sin_iva_element) = self._campos_linea(line_element)
+
+            if nombre_element is None or codigo_element is None or cantidad_element is None:
+                # Buscar iterando sin XPath complejo: un solo recorrido de la
+                # línea sirve a los tres campos
+                desc_sin_ns, codigo_sin_ns, cantidad_sin_ns = self._buscar_linea_sin_ns(line_element)
+                if nombre_element is None:
+                    nombre_element = desc_sin_ns
+                if codigo_element is None:
+                    codigo_element = codigo_sin_ns
+                if cantidad_element is None:
+                    cantidad_element = cantidad_sin_ns
+
             # Extraer nombre de producto
-            nombre_element = line_element.find('.//cac:Item/cbc:Description', NAMESPACES)
-            if nombre_element is None:
-                # Buscar iterando sin XPath complejo
-                for item in line_element.iter():
-                    if item.tag.endswith('Item'):
-                        for child in item:
-                            if child.tag.endswith('Description'):
-                                nombre_element = child
-                                break
             nombre_producto = nombre_element.text.strip() if nombre_element is not None and nombre_element.text else ""
 
             # Extraer código
-            codigo_element = line_element.find('.//cac:Item/cac:SellersItemIdentification/cbc:ID', NAMESPACES)
-            if codigo_element is None:
-                # Buscar iterando sin XPath complejo
-                for item in line_element.iter():
-                    if item.tag.endswith('SellersItemIdentification'):
-                        for child in item:
-                            if child.tag.endswith('ID'):
-                                codigo_element = child
-                                break
             codigo = codigo_element.text.strip() if codigo_element is not None and codigo_element.text else ""
 
             # Cantidad
-            cantidad_element = line_element.find('.//cbc:InvoicedQuantity', NAMESPACES)
-            if cantidad_element is None:
-                # Buscar iterando
-                for elem in line_element.iter():
-                    if elem.tag.endswith('InvoicedQuantity'):
-                        cantidad_element = elem
-                        break
             
             cantidad = self._parse_decimal(cantidad_element.text if cantidad_element is not None else "0")
             unidad_medida_code = cantidad_element.get('unitCode', '') if cantidad_element is not None else ''
 
             # VALIDACIÓN: Cantidad debe ser > 0
-            if cantidad <= Decimal('0'):
+            if cantidad <= 0:
                 raise ValidacionFacturaError(f"Cantidad inválida: {cantidad} (debe ser > 0)")
 
             # Precio unitario
-            precio_element = line_element.find('.//cac:Price/cbc:PriceAmount', NAMESPACES)
             precio_unitario = self._parse_decimal(precio_element.text if precio_element is not None else "0")
 
             # VALIDACIÓN: Precio unitario debe ser > 0
-            if precio_unitario <= Decimal('0'):
+            if precio_unitario <= 0:
                 raise ValidacionFacturaError(f"Precio unitario inválido: {precio_unitario} (debe ser > 0)")
 
             # Totales
-            total_sin_iva_element = line_element.find('.//cbc:LineExtensionAmount', NAMESPACES)
             total_sin_iva = self._parse_decimal(total_sin_iva_element.text if total_sin_iva_element is not None else "0")
 
             # VALIDACIÓN: Total debe ser > 0
-            if total_sin_iva <= Decimal('0'):
+            if total_sin_iva <= 0:
                 raise ValidacionFacturaError(f"Total sin IVA inválido: {total_sin_iva} (debe ser > 0)")
 
             # IVA
             iva_percent = self._extraer_iva_linea(line_element)
-            total_iva = total_sin_iva * (iva_percent / Decimal('100'))
+            total_iva = total_sin_iva * iva_percent / 100.0
             total_con_iva = total_sin_iva + total_iva
 
-            # Unidad de medida original (mapear a estándar REGGIS)
-            unidad_original = UNIT_MAP.get(unidad_medida_code, unidad_medida_code)
+            # Unidad de medida original (mapear a estándar REGGIS, en mayúsculas)
+            unidad_original = _UNIDAD_BMC_GET(unidad_medida_code) or unidad_medida_code.upper()
 
             cantidad_original = cantidad
             cantidad_convertida, unidad_destino, factor, ok, error = self._convertir_cantidad_bmc(
@@ -511,40 +735,25 @@ class FacturaExtractorLactalisVentas:
             unidad_medida = unidad_destino
 
             # Formatear números al estándar colombiano (coma como separador decimal)
-            cantidad_fmt = self._formatear_numero(cantidad)
-            precio_unitario_fmt = self._formatear_numero(precio_unitario)
-            total_sin_iva_fmt = self._formatear_numero(total_sin_iva)
-            total_iva_fmt = self._formatear_numero(total_iva)
-            total_con_iva_fmt = self._formatear_numero(total_con_iva)
-            cantidad_original_fmt = self._formatear_numero(cantidad_original)
-
-            # Construir línea en formato REGGIS
-            linea_reggis = {
-                'numero_factura': numero_factura,
-                'nombre_producto': nombre_producto,
-                'codigo_subyacente': codigo,
-                'unidad_medida': unidad_medida,
-                'cantidad': cantidad_fmt,
-                'precio_unitario': precio_unitario_fmt,
-                'fecha_factura': fecha_factura,
-                'fecha_pago': fecha_pago,
-                'nit_comprador': nit_comprador,
-                'nombre_comprador': nombre_comprador,
-                'nit_vendedor': nit_vendedor,  # Dinámico: Lactalis o Proleche
-                'nombre_vendedor': nombre_vendedor,  # Dinámico: Lactalis o Proleche
-                'principal': LACTALIS_VENTAS_CONFIG['principal'],  # FIJO: "V"
-                'municipio': municipio,
-                'iva': str(int(iva_percent)),
-                'descripcion': nombre_producto,
-                'activa_factura': LACTALIS_VENTAS_CONFIG['activa_factura'],  # FIJO: "1"
-                'activa_bodega': LACTALIS_VENTAS_CONFIG['activa_bodega'],  # FIJO: "1"
-                'incentivo': '',
-                'cantidad_original': cantidad_original_fmt,
-                'moneda': moneda,
-                'total_sin_iva': total_sin_iva_fmt,
-                'total_iva': total_iva_fmt,
-                'total_con_iva': total_con_iva_fmt
-            }
+            (cantidad_fmt, precio_unitario_fmt, total_sin_iva_fmt, total_iva_fmt,
+             total_con_iva_fmt, cantidad_original_fmt) = _formatear_montos_linea(
+                cantidad, precio_unitario, total_sin_iva, total_iva, total_con_iva, cantidad_original
+            )
+
+            # Construir línea en formato REGGIS: copia del encabezado (copia en C,
+            # conserva el orden de columnas) + valores de la línea
+            linea_reggis = encabezado.copy()
+            linea_reggis['nombre_producto'] = nombre_producto
+            linea_reggis['codigo_subyacente'] = codigo
+            linea_reggis['unidad_medida'] = unidad_medida
+            linea_reggis['cantidad'] = cantidad_fmt
+            linea_reggis['precio_unitario'] = precio_unitario_fmt
+            linea_reggis['iva'] = str(int(iva_percent))
+            linea_reggis['descripcion'] = nombre_producto
+            linea_reggis['cantidad_original'] = cantidad_original_fmt
+            linea_reggis['total_sin_iva'] = total_sin_iva_fmt
+            linea_reggis['total_iva'] = total_iva_fmt
+            linea_reggis['total_con_iva'] = total_con_iva_fmt
 
             return linea_reggis
 
@@ -552,16 +761,72 @@ class FacturaExtractorLactalisVentas:
             # Re-lanzar errores de validación
             raise
         except Exception as e:
-            logger.error(f"Error extrayendo línea de producto: {str(e)}", exc_info=True)
+            # La traza completa solo con DEBUG: formatearla por cada línea fallida es costoso
+            logger.error(
+                "Error extrayendo línea de producto: %s", e,
+                exc_info=logger.isEnabledFor(logging.DEBUG)
+            )
             return None
 
-    def _extraer_iva_linea(self, line_element) -> Decimal:
+    @staticmethod
+    def _campos_linea(line_element) -> Tuple:
+        """
+        Ubica descripción, código, cantidad, precio y total sin IVA de una línea
+
+        Returns:
+            Tupla con el primer elemento de cada campo (orden de documento)
+            o None si no existe
+        """
+        if _XP_CAMPOS_LINEA is not None:
+            campos = {}
+            for elemento in _XP_CAMPOS_LINEA(line_element):
+                if elemento.tag not in campos:
+                    campos[elemento.tag] = elemento
+            return tuple(campos.get(tag) for tag in _TAGS_CAMPOS_LINEA)
+
+        return (
+            _XP_DESCRIPCION(line_element),
+            _XP_CODIGO(line_element),
+            _XP_CANTIDAD(line_element),
+            _XP_PRECIO(line_element),
+            _XP_TOTAL_SIN_IVA(line_element),
+        )
+
+    @staticmethod
+    def _buscar_linea_sin_ns(line_element) -> Tuple:
+        """
+        Busca descripción, código y cantidad de una línea ignorando namespaces
+
+        Returns:
+            Tupla (Description de *Item, ID de *SellersItemIdentification,
+            primer *InvoicedQuantity); None en los que no se encuentren.
+            Como en la búsqueda por campo, para Item y
+            SellersItemIdentification gana el último que tenga el hijo.
+        """
+        descripcion = codigo = cantidad = None
+        for elem in line_element.iter():
+            tag = elem.tag
+            if tag.endswith('Item'):
+                for child in elem:
+                    if child.tag.endswith('Description'):
+                        descripcion = child
+                        break
+            elif tag.endswith('SellersItemIdentification'):
+                for child in elem:
+                    if child.tag.endswith('ID'):
+                        codigo = child
+                        break
+            elif cantidad is None and tag.endswith('InvoicedQuantity'):
+                cantidad = elem
+        return descripcion, codigo, cantidad
+
+    def _extraer_iva_linea(self, line_element) -> float:
         """Extrae el porcentaje de IVA de una línea"""
         # Priorizar IVA (TaxScheme ID=01 o Name=IVA) dentro de TaxSubtotal de la linea
-        for tax_subtotal in line_element.findall('.//cac:TaxTotal/cac:TaxSubtotal', NAMESPACES):
-            scheme_id = tax_subtotal.find('.//cac:TaxScheme/cbc:ID', NAMESPACES)
-            scheme_name = tax_subtotal.find('.//cac:TaxScheme/cbc:Name', NAMESPACES)
-            percent = tax_subtotal.find('.//cac:TaxCategory/cbc:Percent', NAMESPACES)
+        for tax_subtotal in _XP_TAX_SUBTOTALES(line_element):
+            scheme_id = _XP_SCHEME_ID(tax_subtotal)
+            scheme_name = _XP_SCHEME_NAME(tax_subtotal)
+            percent = _XP_PORCENTAJE(tax_subtotal)
 
             scheme_id_text = scheme_id.text.strip() if scheme_id is not None and scheme_id.text else ""
             scheme_name_text = scheme_name.text.strip().upper() if scheme_name is not None and scheme_name.text else ""
@@ -571,20 +836,20 @@ class FacturaExtractorLactalisVentas:
                     return self._parse_decimal(percent.text)
 
         # Si no hay IVA explicito, tomar el primer Percent > 0 en TaxSubtotal
-        for tax_subtotal in line_element.findall('.//cac:TaxTotal/cac:TaxSubtotal', NAMESPACES):
-            percent = tax_subtotal.find('.//cac:TaxCategory/cbc:Percent', NAMESPACES)
+        for tax_subtotal in _XP_TAX_SUBTOTALES(line_element):
+            percent = _XP_PORCENTAJE(tax_subtotal)
             if percent is not None and percent.text:
                 valor = self._parse_decimal(percent.text)
-                if valor > Decimal('0'):
+                if valor > 0:
                     return valor
 
         # Alternativa: buscar en AllowanceCharge
-        iva_element = line_element.find('.//cac:AllowanceCharge/cac:TaxCategory/cbc:Percent', NAMESPACES)
+        iva_element = _XP_IVA_ALLOWANCE(line_element)
         if iva_element is not None and iva_element.text:
             return self._parse_decimal(iva_element.text)
 
         # Alternativa: buscar cualquier TaxCategory/Percent dentro de la línea
-        iva_element = line_element.find('.//cac:TaxCategory/cbc:Percent', NAMESPACES)
+        iva_element = _XP_IVA_CATEGORIA(line_element)
         if iva_element is not None and iva_element.text:
             return self._parse_decimal(iva_element.text)
 
@@ -592,17 +857,17 @@ class FacturaExtractorLactalisVentas:
         for elem in line_element.iter():
             if elem.tag.endswith('Percent') and elem.text:
                 valor = self._parse_decimal(elem.text)
-                if valor > Decimal('0'):
+                if valor > 0:
                     return valor
 
         # Default: 19% (IVA común en Colombia)
-        return Decimal('19')
+        return 19.0
 
-    def _parse_decimal_texto(self, value: str) -> Optional[Decimal]:
+    def _parse_decimal_texto(self, value: str) -> Optional[float]:
         """Parsea un numero desde texto, retorna None si no es valido."""
         try:
-            return Decimal(str(value).replace(',', '.'))
-        except (InvalidOperation, ValueError, AttributeError):
+            return float(str(value).translate(_COMA_A_PUNTO))
+        except ValueError:
             return None
 
     def _detectar_unidades_pack(self, nombre: str) -> int:
@@ -626,7 +891,7 @@ class FacturaExtractorLactalisVentas:
 
         return 1
 
-    def _extraer_volumen_y_pack(self, nombre: str, unidad_original: str) -> Tuple[Optional[Decimal], Optional[str], int]:
+    def _extraer_volumen_y_pack(self, nombre: str, unidad_original: str) -> Tuple[Optional[float], Optional[str], int]:
         """Extrae volumen/peso y unidades de pack desde el nombre."""
         patrones_combinados = [
             ('Lt', r'(\d+(?:[.,]\d+)?)\s*ML\s*X\s*(\d+)', False),
@@ -654,12 +919,12 @@ class FacturaExtractorLactalisVentas:
 
                 if unidad == 'Lt':
                     if 'ML' in patron:
-                        volumen = volumen_raw / Decimal('1000')
+                        volumen = volumen_raw / 1000
                     else:
                         volumen = volumen_raw
                 else:
                     if 'G' in patron and 'K' not in patron:
-                        volumen = volumen_raw / Decimal('1000')
+                        volumen = volumen_raw / 1000
                     else:
                         volumen = volumen_raw
 
@@ -689,9 +954,9 @@ class FacturaExtractorLactalisVentas:
                 continue
 
             if unidad == 'Lt':
-                volumen = valor / Decimal('1000') if 'ML' in patron else valor
+                volumen = valor / 1000 if 'ML' in patron else valor
             else:
-                volumen = valor / Decimal('1000') if 'G' in patron and 'K' not in patron else valor
+                volumen = valor / 1000 if 'G' in patron and 'K' not in patron else valor
 
             return volumen, unidad, unidades_pack
 
@@ -700,14 +965,14 @@ class FacturaExtractorLactalisVentas:
             if match:
                 valor = self._parse_decimal_texto(match.group(1))
                 if valor is not None:
-                    volumen = valor / Decimal('1000') if valor > 100 else valor
+                    volumen = valor / 1000 if valor > 100 else valor
                     return volumen, 'Lt', unidades_pack
 
             match = re.search(r'\bX\s*(\d+(?:[.,]\d+)?)\b', nombre)
             if match:
                 valor = self._parse_decimal_texto(match.group(1))
                 if valor is not None:
-                    volumen = valor / Decimal('1000') if valor > 100 else valor
+                    volumen = valor / 1000 if valor > 100 else valor
                     return volumen, 'Lt', unidades_pack
 
         return None, None, unidades_pack
@@ -722,49 +987,43 @@ class FacturaExtractorLactalisVentas:
             return 'Kg'
         return 'Lt'
 
-    def _convertir_cantidad_bmc(self, cantidad_original: Decimal, unidad_original: str, nombre_producto: str) -> Tuple[Decimal, str, Decimal, bool, str]:
-        """Convierte la cantidad a Kg o Lt segun el nombre del producto."""
+    def _convertir_cantidad_bmc(self, cantidad_original: float, unidad_original: str, nombre_producto: str) -> Tuple[float, str, float, bool, str]:
+        """
+        Convierte la cantidad a Kg o Lt segun el nombre del producto.
+
+        unidad_original llega ya mapeada y en mayúsculas (ver _UNIDAD_BMC_GET).
+        """
         nombre = (nombre_producto or '').upper()
-        unidad_orig = (unidad_original or '').upper()
+        unidad_orig = unidad_original or ''
 
         volumen, unidad_volumen, unidades_pack = self._extraer_volumen_y_pack(nombre, unidad_orig)
         if volumen is None or unidad_volumen is None:
             unidad_destino = self._detectar_unidad_destino(nombre, unidad_orig)
-            return cantidad_original, unidad_destino, Decimal('1'), False, 'No se pudo determinar volumen/peso'
+            return cantidad_original, unidad_destino, 1.0, False, 'No se pudo determinar volumen/peso'
 
-        factor = volumen * Decimal(unidades_pack)
+        factor = volumen * unidades_pack
         cantidad_convertida = cantidad_original * factor
         unidad_destino = unidad_volumen
 
         return cantidad_convertida, unidad_destino, factor, True, ''
 
-    def _parse_decimal(self, value: str) -> Decimal:
+    def _parse_decimal(self, value: str) -> float:
         """
-        Parsea un string a Decimal de forma segura
-        
-        Args:
-            value: String con número
+        Parsea un string a float de forma segura
 
-        Returns:
-            Decimal
-        """
-        try:
-            cleaned = value.strip().replace(',', '.')
-            return Decimal(cleaned)
-        except (InvalidOperation, ValueError, AttributeError):
-            return Decimal('0')
+        Se usa float en lugar de Decimal: los montos traen pocos decimales y
+        solo se formatean a 5, muy por debajo de la precisión de un double.
 
-    def _formatear_numero(self, numero: Decimal, decimales: int = 5) -> str:
-        """
-        Formatea un número Decimal al formato colombiano (coma como separador decimal)
-        
         Args:
-            numero: Número a formatear
-            decimales: Número de decimales
+            value: String con número
 
         Returns:
-            String con número formateado
+            float
         """
-        formato = f"{{:.{decimales}f}}"
-        numero_str = formato.format(numero)
-        return numero_str.replace('.', ',')
+        if not value:
+            return 0.0
+        try:
+            # float() ya ignora los espacios alrededor; translate cambia la coma en una pasada
+            return float(value.translate(_COMA_A_PUNTO))
+        except (ValueError, AttributeError):
+            return 0.0
@@ -2,30 +2,75 @@
 Extractor de datos de facturas para SEABOARD
 """
 
-import xml.etree.ElementTree as ET
 import logging
 from typing import Dict, List
-from datetime import datetime
+from datetime import date, datetime
 import re
 
 from config.constants import NAMESPACES, CURRENCY_CODE_MAP
+from utils.xml_ubl import compilar, compilar_primero, compilar_texto, parsear_xml
 
 logger = logging.getLogger(__name__)
 
+# Separadores en inglés -> colombianos: ',' de miles por '.', '.' decimal por ','
+_INTERCAMBIO_SEPARADORES = str.maketrans(',.', '.,')
+
+
+# Rutas del documento (relativas a la raíz cac:Invoice), compiladas una sola
+# vez. Son pasos hijo explícitos según el esquema UBL 2.1: './/' recorre todo
+# el subárbol (extensiones DIAN, firma, líneas) antes de encontrar el dato.
+_PROVEEDOR = './cac:AccountingSupplierParty/cac:Party/'
+_CLIENTE = './cac:AccountingCustomerParty/cac:Party/'
+
+_XP_NUMERO_FACTURA = compilar_texto('./cbc:ID')
+_XP_FECHA_EMISION = compilar_texto('./cbc:IssueDate')
+_XP_FECHA_VENCIMIENTO = compilar_texto('./cbc:DueDate')
+_XP_NIT_VENDEDOR = compilar_texto(
+    _PROVEEDOR + 'cac:PartyTaxScheme/cbc:CompanyID',
+    _PROVEEDOR + 'cac:PartyLegalEntity/cbc:CompanyID'
+)
+_XP_NOMBRE_VENDEDOR = compilar_texto(
+    _PROVEEDOR + 'cac:PartyTaxScheme/cbc:RegistrationName',
+    _PROVEEDOR + 'cac:PartyLegalEntity/cbc:RegistrationName'
+)
+_XP_CIUDAD_VENDEDOR = compilar_texto(_PROVEEDOR + 'cac:PhysicalLocation/cac:Address/cbc:CityName')
+_XP_NIT_COMPRADOR = compilar_texto(
+    _CLIENTE + 'cac:PartyTaxScheme/cbc:CompanyID',
+    _CLIENTE + 'cac:PartyLegalEntity/cbc:CompanyID'
+)
+_XP_NOMBRE_COMPRADOR = compilar_texto(
+    _CLIENTE + 'cac:PartyTaxScheme/cbc:RegistrationName',
+    _CLIENTE + 'cac:PartyLegalEntity/cbc:RegistrationName'
+)
+_XP_MONEDA = compilar_texto('./cbc:DocumentCurrencyCode')
+_XP_TRM = compilar_texto('./cac:PaymentExchangeRate/cbc:CalculationRate')
+_XP_PORCENTAJE_IVA = compilar_texto(
+    './cac:TaxTotal/cac:TaxSubtotal/cac:TaxCategory/cbc:Percent',
+    './cac:InvoiceLine/cac:TaxTotal/cac:TaxSubtotal/cac:TaxCategory/cbc:Percent'
+)
+
+_XP_INVOICE_LINES = compilar('./cac:InvoiceLine')
+
+# Rutas relativas a cac:InvoiceLine
+_XP_LINEA_DESCRIPCION = compilar_primero('./cac:Item/cbc:Description')
+_XP_LINEA_CODIGO = compilar_primero('./cac:Item/cac:SellersItemIdentification/cbc:ID')
+_XP_LINEA_CANTIDAD = compilar_primero('./cbc:InvoicedQuantity')
+_XP_LINEA_PRECIO = compilar_primero('./cac:Price/cbc:PriceAmount')
+
 
 class FacturaExtractorSeaboard:
     """Extractor de datos de facturas para SEABOARD"""
 
     def __init__(self, xml_content: str):
-        self.root = ET.fromstring(xml_content)
+        self.root = parsear_xml(xml_content)
         self.ns = NAMESPACES
 
-    def _get_text(self, xpath: str, default: str = "") -> str:
-        """Extrae texto de un elemento XML"""
-        element = self.root.find(xpath, self.ns)
-        return element.text.strip() if element is not None and element.text else default
+    def _get_text(self, xpath, default: str = "") -> str:
+        """Extrae texto de un elemento XML (xpath: ruta compilada con compilar_texto)"""
+        texto = xpath(self.root)
+        return texto.strip() if texto else default
 
-    def _get_decimal(self, xpath: str, default: float = 0.0) -> float:
+    def _get_decimal(self, xpath, default: float = 0.0) -> float:
         """Extrae un valor decimal de un elemento XML"""
         text = self._get_text(xpath)
         if not text:
@@ -37,18 +82,8 @@ class FacturaExtractorSeaboard:
 
     def _formato_decimal(self, valor: float, decimales: int = 2) -> str:
         """Formatea un número decimal al formato colombiano (punto como separador de miles, coma como decimal)"""
-        valor_str = f"{valor:.{decimales}f}"
-        partes = valor_str.split('.')
-        parte_entera = partes[0]
-        parte_decimal = partes[1] if len(partes) > 1 else '00'
-
-        parte_entera_formateada = ''
-        for i, digito in enumerate(reversed(parte_entera)):
-            if i > 0 and i % 3 == 0:
-                parte_entera_formateada = '.' + parte_entera_formateada
-            parte_entera_formateada = digito + parte_entera_formateada
-
-        return f"{parte_entera_formateada},{parte_decimal}"
+        # format agrupa los miles en C ('1,234.50'); translate intercambia ambos separadores
+        return f"{valor:,.{decimales}f}".translate(_INTERCAMBIO_SEPARADORES)
 
     def _formatear_fecha(self, fecha: str) -> str:
         """Convierte fechas ISO a formato DIA/MES/ANO."""
@@ -56,6 +91,15 @@ class FacturaExtractorSeaboard:
             return ""
 
         fecha = fecha.strip()
+
+        # Caso habitual en UBL (AAAA-MM-DD): fromisoformat evita strptime, que
+        # compila y recorre el formato en Python en cada llamada
+        if len(fecha) == 10 and fecha[4] == '-' and fecha[7] == '-':
+            try:
+                return date.fromisoformat(fecha).strftime("%d/%m/%Y")
+            except ValueError:
+                pass
+
         formatos = ("%Y-%m-%d", "%d/%m/%Y", "%Y/%m/%d")
 
         for formato in formatos:
@@ -98,41 +142,70 @@ class FacturaExtractorSeaboard:
 
     def extraer_datos(self) -> List[Dict]:
         """Extrae datos en formato REGGIS para SEABOARD"""
-        numero_factura = self._get_text('.//cbc:ID')
-        fecha_emision = self._formatear_fecha(self._get_text('.//cbc:IssueDate'))
-        fecha_vencimiento = self._formatear_fecha(self._get_text('.//cbc:DueDate'))
+        numero_factura = self._get_text(_XP_NUMERO_FACTURA)
+        fecha_emision = self._formatear_fecha(self._get_text(_XP_FECHA_EMISION))
+        fecha_vencimiento = self._formatear_fecha(self._get_text(_XP_FECHA_VENCIMIENTO))
 
-        nit_vendedor = self._get_text('.//cac:AccountingSupplierParty//cbc:CompanyID')
-        nombre_vendedor = self._get_text('.//cac:AccountingSupplierParty//cbc:RegistrationName')
-        ciudad_vendedor = self._get_text('.//cac:AccountingSupplierParty//cac:PhysicalLocation//cac:Address//cbc:CityName')
+        nit_vendedor = self._get_text(_XP_NIT_VENDEDOR)
+        nombre_vendedor = self._get_text(_XP_NOMBRE_VENDEDOR)
+        ciudad_vendedor = self._get_text(_XP_CIUDAD_VENDEDOR)
 
-        nit_comprador = self._get_text('.//cac:AccountingCustomerParty//cbc:CompanyID')
-        nombre_comprador = self._get_text('.//cac:AccountingCustomerParty//cbc:RegistrationName')
+        nit_comprador = self._get_text(_XP_NIT_COMPRADOR)
+        nombre_comprador = self._get_text(_XP_NOMBRE_COMPRADOR)
 
-        moneda_documento = self._get_text('.//cbc:DocumentCurrencyCode', 'COP')
-        trm = self._get_decimal('.//cac:PaymentExchangeRate//cbc:CalculationRate', 1.0)
+        moneda_documento = self._get_text(_XP_MONEDA, 'COP')
+        trm = self._get_decimal(_XP_TRM, 1.0)
         codigo_moneda = CURRENCY_CODE_MAP.get(moneda_documento, '1')
 
-        porcentaje_iva = self._get_decimal('.//cac:TaxCategory//cbc:Percent', 5.0)
+        porcentaje_iva = self._get_decimal(_XP_PORCENTAJE_IVA, 5.0)
+
+        # Campos comunes a todas las líneas, en el orden de columnas REGGIS: se
+        # arman una vez por factura; los propios de cada línea quedan vacíos
+        encabezado = {
+            'numero_factura': numero_factura,
+            'nombre_producto': '',
+            'codigo_subyacente': '',
+            'unidad_medida': '',
+            'cantidad': '',
+            'precio_unitario': '',
+            'fecha_factura': fecha_emision,
+            'fecha_pago': fecha_vencimiento,
+            'nit_comprador': nit_comprador,
+            'nombre_comprador': nombre_comprador,
+            'nit_vendedor': nit_vendedor,
+            'nombre_vendedor': nombre_vendedor,
+            'principal': 'V',
+            'municipio': ciudad_vendedor,
+            'iva': str(int(porcentaje_iva)),
+            'descripcion': '',
+            'activa_factura': 'SI',
+            'activa_bodega': '',
+            'incentivo': '',
+            'cantidad_original': '',
+            'moneda': codigo_moneda,
+            'total_sin_iva': '',
+            'total_iva': '',
+            'total_con_iva': ''
+        }
 
         lineas_procesadas = []
-        items = self.root.findall('.//cac:InvoiceLine', self.ns)
+        items = _XP_INVOICE_LINES(self.root)
 
         for idx, item in enumerate(items, 1):
             try:
-                descripcion = item.find('.//cbc:Description', self.ns)
+                descripcion = _XP_LINEA_DESCRIPCION(item)
                 nombre_producto = descripcion.text if descripcion is not None else ''
                 nombre_producto = self._limpiar_descripcion_producto(nombre_producto)
 
-                codigo = item.find('.//cac:SellersItemIdentification//cbc:ID', self.ns)
+                codigo = _XP_LINEA_CODIGO(item)
                 codigo_producto = codigo.text if codigo is not None else ''
 
-                cantidad_elem = item.find('.//cbc:InvoicedQuantity', self.ns)
+                cantidad_elem = _XP_LINEA_CANTIDAD(item)
                 cantidad_original = float(cantidad_elem.text) if cantidad_elem is not None else 0.0
                 unit_code = cantidad_elem.get('unitCode', '') if cantidad_elem is not None else ''
                 unidad_medida = 'toneladas'
 
-                precio_elem = item.find('.//cac:Price//cbc:PriceAmount', self.ns)
+                precio_elem = _XP_LINEA_PRECIO(item)
                 precio_unitario_xml = float(precio_elem.text) if precio_elem is not None else 0.0
 
                 unidad_medida, cantidad_procesada, precio_procesado = self._normalizar_unidad_y_valores(
@@ -150,32 +223,19 @@ class FacturaExtractorSeaboard:
                 iva_linea = total_sin_iva_linea * (porcentaje_iva / 100)
                 total_con_iva_linea = total_sin_iva_linea + iva_linea
 
-                linea = {
-                    'numero_factura': numero_factura,
-                    'nombre_producto': nombre_producto,
-                    'codigo_subyacente': codigo_producto,
-                    'unidad_medida': unidad_medida,
-                    'cantidad': self._formato_decimal(cantidad_procesada, decimales=5),
-                    'precio_unitario': self._formato_decimal(precio_cop, decimales=6),
-                    'fecha_factura': fecha_emision,
-                    'fecha_pago': fecha_vencimiento,
-                    'nit_comprador': nit_comprador,
-                    'nombre_comprador': nombre_comprador,
-                    'nit_vendedor': nit_vendedor,
-                    'nombre_vendedor': nombre_vendedor,
-                    'principal': 'V',
-                    'municipio': ciudad_vendedor,
-                    'iva': str(int(porcentaje_iva)),
-                    'descripcion': nombre_producto,
-                    'activa_factura': 'SI',
-                    'activa_bodega': '',
-                    'incentivo': '',
-                    'cantidad_original': self._formato_decimal(cantidad_original, decimales=5),
-                    'moneda': codigo_moneda,
-                    'total_sin_iva': total_sin_iva_linea,
-                    'total_iva': iva_linea,
-                    'total_con_iva': total_con_iva_linea
-                }
+                # Copia del encabezado (copia en C, conserva el orden de
+                # columnas) + valores de la línea
+                linea = encabezado.copy()
+                linea['nombre_producto'] = nombre_producto
+                linea['codigo_subyacente'] = codigo_producto
+                linea['unidad_medida'] = unidad_medida
+                linea['cantidad'] = self._formato_decimal(cantidad_procesada, decimales=5)
+                linea['precio_unitario'] = self._formato_decimal(precio_cop, decimales=6)
+                linea['descripcion'] = nombre_producto
+                linea['cantidad_original'] = self._formato_decimal(cantidad_original, decimales=5)
+                linea['total_sin_iva'] = total_sin_iva_linea
+                linea['total_iva'] = iva_linea
+                linea['total_con_iva'] = total_con_iva_linea
 
                 lineas_procesadas.append(linea)
 
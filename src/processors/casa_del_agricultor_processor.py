@@ -2,21 +2,134 @@
 Procesador específico para CASA DEL AGRICULTOR
 """
 
-import xml.etree.ElementTree as ET
 import openpyxl
-from openpyxl.styles import Font, PatternFill, Alignment
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.styles import Font, PatternFill, Alignment, NamedStyle
+from openpyxl.styles.fonts import DEFAULT_FONT
 import logging
 import zipfile
 import re
+from copy import copy
 from pathlib import Path
 from datetime import datetime
-from typing import Dict, List, Optional
+from typing import Dict, List, Optional, Tuple, Union
 
 from config.constants import CURRENCY_CODE_MAP, UNIT_MAP
+from utils.procesos import ejecutar_tareas
+from utils.xml_ubl import eventos_xml
 
 logger = logging.getLogger(__name__)
 
 
+# Campos del encabezado que se toman de la primera aparición en el documento
+_ETIQUETAS_ENCABEZADO = frozenset(('ID', 'IssueDate', 'PaymentDueDate', 'DocumentCurrencyCode'))
+
+
+# Cantidades en gramos dentro de la descripción del producto ("GRAMO(S)" o
+# "GRS"): una sola alternación, la descripción se recorre una vez
+_GRAMOS = re.compile(r'(\d+)\s*(GRAMOS?|GRS)', re.IGNORECASE)
+
+# Formato de las tres cantidades de una fila REGGIS en una sola llamada: 5
+# decimales, separadas por NUL (no aparece en un número) para dividirlas después
+_FORMATO_CANTIDADES_FILA = '\x00'.join(['{:.5f}'] * 3).format
+
+# Tabla etiqueta en notación Clark -> nombre local. Una factura usa unas pocas
+# decenas de etiquetas distintas: cada una se parte una sola vez por proceso.
+_NOMBRES_LOCALES: Dict[str, str] = {}
+
+
+def _nombre_local(tag: str) -> str:
+    """Nombre de la etiqueta sin namespace ('{urn...}ID' -> 'ID')"""
+    nombre = _NOMBRES_LOCALES.get(tag)
+    if nombre is None:
+        nombre = _NOMBRES_LOCALES[tag] = tag.rsplit('}', 1)[-1]
+    return nombre
+
+
+# Rutas dentro de cac:AccountingSupplierParty / cac:AccountingCustomerParty,
+# con pasos hijo explícitos en el orden del esquema UBL 2.1 (un './/' recorre
+# toda la parte: direcciones, contactos, esquemas tributarios)
+_RUTAS_NOMBRE_PARTE = (
+    '{*}Party/{*}PartyTaxScheme/{*}RegistrationName',
+    '{*}Party/{*}PartyLegalEntity/{*}RegistrationName',
+)
+_RUTAS_NIT_PARTE = (
+    '{*}Party/{*}PartyTaxScheme/{*}CompanyID',
+    '{*}Party/{*}PartyLegalEntity/{*}CompanyID',
+)
+_RUTAS_CIUDAD_PARTE = (
+    '{*}Party/{*}PhysicalLocation/{*}Address/{*}CityName',
+    '{*}Party/{*}PartyTaxScheme/{*}RegistrationAddress/{*}CityName',
+)
+
+
+def _primer_texto(elemento, rutas) -> str:
+    """Texto del primer elemento encontrado probando las rutas en orden ('' si ninguna)"""
+    for ruta in rutas:
+        encontrado = elemento.find(ruta)
+        if encontrado is not None:
+            return encontrado.text or ''
+    return ''
+
+
+def _factura_adjunta(xml_content: Union[bytes, str]) -> Optional[str]:
+    """
+    Retorna el XML de la factura embebida si el contenido es un AttachedDocument
+
+    La raíz se conoce con el primer evento: si no es AttachedDocument no se
+    sigue leyendo. Si lo es, se toma el texto (CDATA ya decodificado por el
+    parser) del primer cac:ExternalReference/cbc:Description no vacío y se
+    deja de leer (la ApplicationResponse que suele venir después no se parsea).
+
+    Returns:
+        XML de la factura o None si el contenido no es un AttachedDocument
+        con factura embebida
+
+    Raises:
+        ET.ParseError: Si el contenido no es XML válido
+    """
+    eventos = eventos_xml(xml_content, ('start', 'end'))
+    _evento, raiz = next(eventos)
+    if _nombre_local(raiz.tag) != 'AttachedDocument':
+        return None
+
+    for evento, elemento in eventos:
+        if evento != 'end' or _nombre_local(elemento.tag) != 'ExternalReference':
+            continue
+        descripcion = elemento.find('{*}Description')
+        if descripcion is not None and descripcion.text:
+            texto = descripcion.text.strip()
+            if texto:
+                return texto
+    return None
+
+
+def _procesar_zip(ruta: str) -> Tuple[Optional[List[Dict]], Optional[str]]:
+    """
+    Extrae, parsea y convierte las líneas de un ZIP (nivel de módulo para el pool)
+
+    El error de lectura del ZIP se retorna en lugar de registrarse aquí, para
+    que el proceso principal lo escriba en el log de la sesión.
+
+    Args:
+        ruta: Ruta del archivo ZIP
+
+    Returns:
+        Tupla (lineas, error): lineas es None si el ZIP no trae XML o no se
+        pudo leer; error es el mensaje en este último caso
+    """
+    zip_file = Path(ruta)
+    procesador = ProcesadorCasaDelAgricultor(zip_file.parent, None)
+    try:
+        xml_content = procesador._leer_xml_de_zip(zip_file)
+    except Exception as e:
+        return None, f"Error al extraer XML de ZIP: {str(e)}"
+    if not xml_content:
+        return None, None
+    lines = procesador.parse_invoice_xml(xml_content)
+    return [procesador.apply_conversion_rules(line) for line in lines], None
+
+
 class ProcesadorCasaDelAgricultor:
     """Procesador específico para CASA DEL AGRICULTOR"""
 
@@ -25,105 +138,73 @@ class ProcesadorCasaDelAgricultor:
         self.carpeta_salida = carpeta_salida
         self.processed_lines = []
 
-    def extract_xml_from_zip(self, zip_path: Path) -> Optional[str]:
-        """Extrae el contenido XML de un archivo ZIP"""
+    def extract_xml_from_zip(self, zip_path: Path) -> Optional[bytes]:
+        """
+        Extrae el contenido XML de un archivo ZIP
+
+        Se retornan los bytes sin decodificar: el parser los lee directamente
+        según la declaración de encoding del XML.
+        """
         try:
-            with zipfile.ZipFile(zip_path, 'r') as zip_ref:
-                xml_files = [f for f in zip_ref.namelist() if f.endswith('.xml')]
-                if xml_files:
-                    xml_content = zip_ref.read(xml_files[0])
-                    return xml_content.decode('utf-8')
+            return self._leer_xml_de_zip(zip_path)
         except Exception as e:
             logger.error(f"Error al extraer XML de ZIP: {str(e)}")
         return None
 
-    def parse_invoice_xml(self, xml_content: str) -> List[Dict]:
+    @staticmethod
+    def _leer_xml_de_zip(zip_path: Path) -> Optional[bytes]:
+        """Bytes de la primera entrada XML del ZIP (None si no hay); propaga los errores"""
+        with zipfile.ZipFile(zip_path, 'r') as zip_ref:
+            # Primera entrada XML del directorio central (ya leído al abrir)
+            xml_info = next((info for info in zip_ref.infolist() if info.filename.endswith('.xml')), None)
+            if xml_info is not None:
+                return zip_ref.read(xml_info)
+        return None
+
+    def parse_invoice_xml(self, xml_content: Union[bytes, str]) -> List[Dict]:
         """Parsea el XML de la factura y extrae los datos"""
         try:
-            cdata_match = re.search(r'<!\[CDATA\[(.*?)\]\]>', xml_content, re.DOTALL)
-            if cdata_match:
-                invoice_xml = cdata_match.group(1)
-            else:
-                invoice_xml = xml_content
-
-            invoice_xml = re.sub(r'\sxmlns[^=]*="[^"]*"', '', invoice_xml)
-            invoice_xml = re.sub(r'<([a-zA-Z]+):([a-zA-Z]+)', r'<\2', invoice_xml)
-            invoice_xml = re.sub(r'</([a-zA-Z]+):([a-zA-Z]+)', r'</\2', invoice_xml)
-
-            root = ET.fromstring(invoice_xml)
+            # AttachedDocument: la factura viene en ExternalReference/Description
+            invoice_xml = _factura_adjunta(xml_content) or xml_content
 
+            # Un solo recorrido incremental. Las etiquetas se comparan por nombre
+            # local (sin namespace), como antes de quitar los prefijos con regex;
+            # cada InvoiceLine se procesa al cerrarse y se libera.
             lines = []
-
-            supplier_elem = root.find('.//AccountingSupplierParty')
-            if supplier_elem:
-                supplier_name = supplier_elem.findtext('.//RegistrationName') or ''
-                supplier_nit = supplier_elem.findtext('.//CompanyID') or ''
-                supplier_city = supplier_elem.findtext('.//CityName') or ''
-            else:
-                supplier_name = supplier_nit = supplier_city = ''
-
-            customer_elem = root.find('.//AccountingCustomerParty')
-            if customer_elem:
-                customer_name = customer_elem.findtext('.//RegistrationName') or ''
-                customer_nit = customer_elem.findtext('.//CompanyID') or ''
-            else:
-                customer_name = customer_nit = ''
-
-            invoice_number = root.findtext('.//ID') or ''
-            invoice_date = root.findtext('.//IssueDate') or ''
-            payment_date = root.findtext('.//PaymentDueDate') or ''
-
-            currency_elem = root.find('.//DocumentCurrencyCode')
-            currency_code = currency_elem.text if currency_elem is not None else 'COP'
+            primeros = {}
+            supplier_name = supplier_nit = supplier_city = ''
+            customer_name = customer_nit = ''
+            supplier_visto = customer_visto = False
+
+            for _evento, elemento in eventos_xml(invoice_xml):
+                nombre = _nombre_local(elemento.tag)
+
+                if nombre == 'InvoiceLine':
+                    lines.append(self._extraer_linea(elemento))
+                    elemento.clear()
+                elif nombre in _ETIQUETAS_ENCABEZADO:
+                    if nombre not in primeros:
+                        primeros[nombre] = elemento.text
+                elif nombre == 'AccountingSupplierParty' and not supplier_visto:
+                    supplier_visto = True
+                    supplier_name = _primer_texto(elemento, _RUTAS_NOMBRE_PARTE)
+                    supplier_nit = _primer_texto(elemento, _RUTAS_NIT_PARTE)
+                    supplier_city = _primer_texto(elemento, _RUTAS_CIUDAD_PARTE)
+                elif nombre == 'AccountingCustomerParty' and not customer_visto:
+                    customer_visto = True
+                    customer_name = _primer_texto(elemento, _RUTAS_NOMBRE_PARTE)
+                    customer_nit = _primer_texto(elemento, _RUTAS_NIT_PARTE)
+
+            invoice_number = primeros.get('ID') or ''
+            invoice_date = primeros.get('IssueDate') or ''
+            payment_date = primeros.get('PaymentDueDate') or ''
+
+            currency_code = primeros.get('DocumentCurrencyCode', 'COP')
             currency_id = CURRENCY_CODE_MAP.get(currency_code, '1')
 
-            for line in root.findall('.//InvoiceLine'):
-                line_id = line.findtext('.//ID') or ''
-
-                qty_elem = line.find('.//InvoicedQuantity')
-                if qty_elem is not None:
-                    quantity = float(qty_elem.text or 0)
-                    unit_code = qty_elem.get('unitCode') or ''
-                else:
-                    quantity = 0
-                    unit_code = ''
-
-                desc_elem = line.find('.//Description')
-                description = desc_elem.text if desc_elem is not None else ''
-
-                code_elem = line.find('.//StandardItemIdentification/ID')
-                if code_elem is None:
-                    code_elem = line.find('.//Item/ID')
-                code = code_elem.text if code_elem is not None else ''
-
-                price_elem = line.find('.//PriceAmount')
-                price = float(price_elem.text or 0) if price_elem is not None else 0
-
-                total_elem = line.find('.//LineExtensionAmount')
-                line_total = float(total_elem.text or 0) if total_elem is not None else 0
-
-                iva_percent = 0
-                iva_amount = 0
-                tax_total = line.find('.//TaxTotal')
-                if tax_total is not None:
-                    percent_elem = tax_total.find('.//Percent')
-                    if percent_elem is not None:
-                        iva_percent = float(percent_elem.text or 0)
-
-                    iva_elem = tax_total.find('.//TaxAmount')
-                    if iva_elem is not None:
-                        iva_amount = float(iva_elem.text or 0)
-
-                total_with_iva = line_total + iva_amount
-
-                lines.append({
-                    'line_id': line_id,
-                    'code': code,
-                    'description': description,
-                    'quantity': quantity,
-                    'unit': unit_code,
-                    'price': price,
-                    'line_total': line_total,
+            # Datos del encabezado, comunes a todas las líneas
+            for line in lines:
+                line.update({
                     'invoice_number': invoice_number,
                     'invoice_date': invoice_date,
                     'payment_date': payment_date,
@@ -133,9 +214,6 @@ class ProcesadorCasaDelAgricultor:
                     'customer_name': customer_name,
                     'customer_nit': customer_nit,
                     'currency_id': currency_id,
-                    'iva_percent': iva_percent,
-                    'iva_amount': iva_amount,
-                    'total_with_iva': total_with_iva
                 })
 
             return lines
@@ -144,35 +222,106 @@ class ProcesadorCasaDelAgricultor:
             logger.error(f"Error al parsear XML: {str(e)}")
             return []
 
+    @staticmethod
+    def _extraer_linea(line) -> Dict:
+        """
+        Extrae los datos propios de una InvoiceLine ya cerrada
+
+        Las claves del encabezado quedan vacías hasta completar el documento;
+        parse_invoice_xml las llena al final.
+        """
+        line_id = line.findtext('{*}ID') or ''
+
+        qty_elem = line.find('{*}InvoicedQuantity')
+        if qty_elem is not None:
+            quantity = float(qty_elem.text or 0)
+            unit_code = qty_elem.get('unitCode') or ''
+        else:
+            quantity = 0
+            unit_code = ''
+
+        desc_elem = line.find('{*}Item/{*}Description')
+        description = desc_elem.text if desc_elem is not None else ''
+
+        code_elem = line.find('{*}Item/{*}StandardItemIdentification/{*}ID')
+        if code_elem is None:
+            code_elem = line.find('{*}Item/{*}ID')
+        code = code_elem.text if code_elem is not None else ''
+
+        # Primer PriceAmount de la línea, en cualquier nivel: en muestras gratis
+        # (DIAN) es el de PricingReference/AlternativeConditionPrice, que va
+        # antes de cac:Price
+        price_elem = line.find('.//{*}PriceAmount')
+        price = float(price_elem.text or 0) if price_elem is not None else 0
+
+        total_elem = line.find('{*}LineExtensionAmount')
+        line_total = float(total_elem.text or 0) if total_elem is not None else 0
+
+        iva_percent = 0
+        iva_amount = 0
+        tax_total = line.find('{*}TaxTotal')
+        if tax_total is not None:
+            percent_elem = tax_total.find('{*}TaxSubtotal/{*}TaxCategory/{*}Percent')
+            if percent_elem is not None:
+                iva_percent = float(percent_elem.text or 0)
+
+            iva_elem = tax_total.find('{*}TaxAmount')
+            if iva_elem is not None:
+                iva_amount = float(iva_elem.text or 0)
+
+        total_with_iva = line_total + iva_amount
+
+        return {
+            'line_id': line_id,
+            'code': code,
+            'description': description,
+            'quantity': quantity,
+            'unit': unit_code,
+            'price': price,
+            'line_total': line_total,
+            'invoice_number': '',
+            'invoice_date': '',
+            'payment_date': '',
+            'supplier_name': '',
+            'supplier_nit': '',
+            'supplier_city': '',
+            'customer_name': '',
+            'customer_nit': '',
+            'currency_id': '',
+            'iva_percent': iva_percent,
+            'iva_amount': iva_amount,
+            'total_with_iva': total_with_iva
+        }
+
     def apply_conversion_rules(self, line: Dict) -> Dict:
         """Aplica las reglas de conversión de unidades"""
         original_qty = line['quantity']
         original_unit = line['unit']
+        description = line['description']
         converted_qty = original_qty
         converted_unit = original_unit
         conversion_note = ""
 
+        # Las reglas son excluyentes: se aplica la primera que corresponda, y la
+        # búsqueda en la descripción solo se hace si hace falta
+        gram_match = None
+        if original_unit != 'LBR':
+            gram_match = _GRAMOS.search(description)
+
         # Conversión de libras a kilogramos
         if original_unit == 'LBR':
             converted_qty = original_qty / 2
             converted_unit = 'KG'
             conversion_note = f"Convertido de {original_qty} LBR a {converted_qty:.5f} KG"
 
-        # Conversión de GRAMOS en descripción (busca "GRAMOS" o "GRAMO")
-        gram_match = re.search(r'(\d+)\s*GRAMOS?', line['description'], re.IGNORECASE)
-        if gram_match:
+        # Conversión de gramos en descripción (busca "GRAMOS", "GRAMO" o "GRS")
+        elif gram_match:
             grams = float(gram_match.group(1))
             converted_qty = (grams * original_qty) / 1000
             converted_unit = 'KG'
-            conversion_note = f"Convertido: ({grams} gr × {original_qty}) ÷ 1000 = {converted_qty:.5f} KG"
-
-        # Conversión de GRS en descripción (busca "GRS" o "grs")
-        grs_match = re.search(r'(\d+)\s*GRS', line['description'], re.IGNORECASE)
-        if grs_match:
-            grams = float(grs_match.group(1))
-            converted_qty = (grams * original_qty) / 1000
-            converted_unit = 'KG'
-            conversion_note = f"Convertido: ({grams} grs × {original_qty}) ÷ 1000 = {converted_qty:.5f} KG"
+            # La nota conserva la abreviatura según cómo venga en la descripción
+            abreviatura = 'grs' if gram_match.group(2).upper() == 'GRS' else 'gr'
+            conversion_note = f"Convertido: ({grams} {abreviatura} × {original_qty}) ÷ 1000 = {converted_qty:.5f} KG"
 
         # Mapeo de unidades estándar
         converted_unit = UNIT_MAP.get(converted_unit, converted_unit)
@@ -186,9 +335,10 @@ class ProcesadorCasaDelAgricultor:
 
     def create_reggis_excel(self, output_path: Path):
         """Crea el archivo Excel con formato REGGIS"""
-        wb = openpyxl.Workbook()
-        ws = wb.active
-        ws.title = "Facturas Procesadas"
+        # Modo write-only: las filas se escriben en streaming al archivo, sin
+        # mantener en memoria un objeto Cell con estilo propio por celda
+        wb = openpyxl.Workbook(write_only=True)
+        ws = wb.create_sheet("Facturas Procesadas")
 
         headers = [
             'N° Factura', 'Nombre Producto', 'Codigo Subyacente',
@@ -199,16 +349,39 @@ class ProcesadorCasaDelAgricultor:
             'Cantidad Original', 'Moneda', 'Total Sin IVA', 'Total IVA', 'Total Con IVA'
         ]
 
-        for col, header in enumerate(headers, start=1):
-            cell = ws.cell(row=1, column=col, value=header)
-            cell.font = Font(bold=True, color="FFFFFF")
-            cell.fill = PatternFill(start_color="366092", end_color="366092", fill_type="solid")
-            cell.alignment = Alignment(horizontal='center', vertical='center')
+        # En write-only los anchos deben fijarse antes de escribir la primera fila
+        column_widths = [15, 40, 15, 20, 15, 15, 12, 12, 15, 30, 15, 30, 12, 20, 8, 50, 12, 12, 10, 18, 10, 15, 12, 15]
+        for col, width in enumerate(column_widths, start=1):
+            ws.column_dimensions[openpyxl.utils.get_column_letter(col)].width = width
 
-        for idx, line in enumerate(self.processed_lines, start=2):
-            cantidad_convertida = f"{line['converted_quantity']:.5f}".replace('.', ',')
-            cantidad_original = f"{line['quantity']:.5f}".replace('.', ',')
-            precio_unitario = f"{line['price']:.5f}".replace('.', ',')
+        # Estilos con nombre, registrados una vez en el libro: cada celda solo
+        # referencia el estilo en lugar de resolver fuente, relleno y alineación
+        header_style = NamedStyle(
+            name='reggis_encabezado',
+            font=Font(bold=True, color="FFFFFF"),
+            fill=PatternFill(start_color="366092", end_color="366092", fill_type="solid"),
+            alignment=Alignment(horizontal='center', vertical='center')
+        )
+        body_style = NamedStyle(
+            name='reggis_cuerpo',
+            font=copy(DEFAULT_FONT),  # misma fuente que el estilo Normal
+            alignment=Alignment(vertical='center')
+        )
+        wb.add_named_style(header_style)
+        wb.add_named_style(body_style)
+
+        header_cells = []
+        for header in headers:
+            cell = WriteOnlyCell(ws, value=header)
+            cell.style = 'reggis_encabezado'
+            header_cells.append(cell)
+        ws.append(header_cells)
+
+        for line in self.processed_lines:
+            # Un solo formateo y un solo reemplazo de separador decimal por fila
+            cantidad_convertida, cantidad_original, precio_unitario = _FORMATO_CANTIDADES_FILA(
+                line['converted_quantity'], line['quantity'], line['price']
+            ).replace('.', ',').split('\x00')
 
             row_data = [
                 line['invoice_number'], line['description'], line['code'],
@@ -221,13 +394,12 @@ class ProcesadorCasaDelAgricultor:
                 round(line['total_with_iva'], 2)
             ]
 
-            for col, value in enumerate(row_data, start=1):
-                cell = ws.cell(row=idx, column=col, value=value)
-                cell.alignment = Alignment(vertical='center')
-
-        column_widths = [15, 40, 15, 20, 15, 15, 12, 12, 15, 30, 15, 30, 12, 20, 8, 50, 12, 12, 10, 18, 10, 15, 12, 15]
-        for col, width in enumerate(column_widths, start=1):
-            ws.column_dimensions[openpyxl.utils.get_column_letter(col)].width = width
+            row_cells = []
+            for value in row_data:
+                cell = WriteOnlyCell(ws, value=value)
+                cell.style = 'reggis_cuerpo'
+                row_cells.append(cell)
+            ws.append(row_cells)
 
         wb.save(output_path)
 
@@ -240,24 +412,31 @@ class ProcesadorCasaDelAgricultor:
 
         logger.info(f"CASA DEL AGRICULTOR: Encontrados {len(zip_files)} archivos ZIP")
 
-        for zip_file in zip_files:
-            logger.info(f"Procesando: {zip_file.name}")
+        resultados = ejecutar_tareas(_procesar_zip, [str(zip_file) for zip_file in zip_files])
+
+        # Nivel consultado una vez: si INFO está desactivado no se recorre cada
+        # línea buscando notas de conversión que no se van a registrar
+        registrar_notas = logger.isEnabledFor(logging.INFO)
 
-            xml_content = self.extract_xml_from_zip(zip_file)
-            if not xml_content:
+        for zip_file, (lines, error) in zip(zip_files, resultados):
+            logger.info("Procesando: %s", zip_file.name)
+
+            if error is not None:
+                logger.error(f"{error} ({zip_file.name})")
+
+            if lines is None:
                 continue
 
-            lines = self.parse_invoice_xml(xml_content)
             if not lines:
                 logger.warning(f"No se extrajeron líneas de {zip_file.name}")
                 continue
 
-            for line in lines:
-                processed_line = self.apply_conversion_rules(line)
-                self.processed_lines.append(processed_line)
+            self.processed_lines.extend(lines)
 
-                if processed_line['conversion_note']:
-                    logger.info(f"  {processed_line['conversion_note']}")
+            if registrar_notas:
+                for processed_line in lines:
+                    if processed_line['conversion_note']:
+                        logger.info("  %s", processed_line['conversion_note'])
 
         if not self.processed_lines:
             raise Exception("No se procesaron líneas. Verifique los archivos ZIP.")
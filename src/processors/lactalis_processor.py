@@ -6,16 +6,41 @@ Lee archivos ZIP y XML, extrae datos y genera Excel en formato REGGIS
 import zipfile
 import logging
 import openpyxl
+from operator import itemgetter
 from pathlib import Path
-from typing import List, Dict, Optional
+from typing import List, Dict, Optional, Tuple, Union
 from openpyxl.styles import Font, PatternFill, Alignment
 
-from config.constants import REGGIS_HEADERS, NAMESPACES, get_data_output_path
-from extractors.lactalis_extractor import FacturaExtractorLactalis
+from config.constants import REGGIS_HEADERS, REGGIS_CAMPOS, get_data_output_path
+from extractors.lactalis_extractor import FacturaExtractorLactalis, extraer_factura_adjunta
+from utils.archivos import listar_archivos
+from utils.excel_reggis import abrir_reggis_write_only
+from utils.procesos import ejecutar_tareas
 
 logger = logging.getLogger(__name__)
 
 
+def _procesar_archivo(tarea: Tuple[str, str]) -> Tuple[Optional[List[Dict]], Optional[str]]:
+    """
+    Procesa un ZIP o XML (función de nivel de módulo para el pool de procesos)
+
+    Args:
+        tarea: Tupla (tipo, ruta) con tipo 'zip' o 'xml'
+
+    Returns:
+        Tupla (lineas, error): lineas si se procesó, o el mensaje de error
+    """
+    tipo, ruta = tarea
+    archivo = Path(ruta)
+    procesador = ProcesadorLactalis(archivo.parent, None)
+    try:
+        if tipo == 'zip':
+            return procesador.procesar_zip(archivo), None
+        return procesador.procesar_xml(archivo), None
+    except Exception as e:
+        return None, str(e)
+
+
 class ProcesadorLactalis:
     """
     Procesador específico para LACTALIS COMPRAS
@@ -50,8 +75,7 @@ class ProcesadorLactalis:
         logger.info(f"Iniciando procesamiento de LACTALIS COMPRAS desde: {self.carpeta_archivos}")
 
         # Buscar archivos ZIP y XML
-        archivos_zip = list(self.carpeta_archivos.glob("*.zip"))
-        archivos_xml = list(self.carpeta_archivos.glob("*.xml"))
+        archivos_zip, archivos_xml = listar_archivos(self.carpeta_archivos)
 
         total_archivos = len(archivos_zip) + len(archivos_xml)
         logger.info(f"Se encontraron {len(archivos_zip)} archivo(s) ZIP y {len(archivos_xml)} archivo(s) XML")
@@ -59,32 +83,22 @@ class ProcesadorLactalis:
         if total_archivos == 0:
             raise ValueError("No se encontraron archivos ZIP ni XML en la carpeta")
 
-        # Procesar todos los archivos
+        # Procesar todos los archivos: primero los ZIPs y luego los XMLs sueltos
         todas_lineas = []
         archivos_procesados = 0
         archivos_error = 0
 
-        # Procesar ZIPs
-        for zip_file in archivos_zip:
-            try:
-                lineas = self.procesar_zip(zip_file)
+        tareas = [('zip', str(f)) for f in archivos_zip] + [('xml', str(f)) for f in archivos_xml]
+        for (tipo, ruta), (lineas, error) in zip(tareas, ejecutar_tareas(_procesar_archivo, tareas)):
+            nombre = Path(ruta).name
+            etiqueta = tipo.upper()
+            if error is None:
                 todas_lineas.extend(lineas)
                 archivos_procesados += 1
-                logger.info(f"[OK] Procesado ZIP: {zip_file.name} - {len(lineas)} lineas")
-            except Exception as e:
-                archivos_error += 1
-                logger.error(f"[ERROR] Procesando ZIP {zip_file.name}: {str(e)}")
-
-        # Procesar XMLs sueltos
-        for xml_file in archivos_xml:
-            try:
-                lineas = self.procesar_xml(xml_file)
-                todas_lineas.extend(lineas)
-                archivos_procesados += 1
-                logger.info(f"[OK] Procesado XML: {xml_file.name} - {len(lineas)} lineas")
-            except Exception as e:
+                logger.info(f"[OK] Procesado {etiqueta}: {nombre} - {len(lineas)} lineas")
+            else:
                 archivos_error += 1
-                logger.error(f"[ERROR] Procesando XML {xml_file.name}: {str(e)}")
+                logger.error(f"[ERROR] Procesando {etiqueta} {nombre}: {error}")
 
         logger.info(
             f"Procesamiento completado: {archivos_procesados} exitosos, "
@@ -120,8 +134,9 @@ class ProcesadorLactalis:
             Lista de líneas extraídas del XML
         """
         try:
-            # Leer contenido del XML
-            with open(xml_path, 'r', encoding='utf-8', errors='ignore') as f:
+            # Leer los bytes del XML: el parser toma el encoding de la
+            # declaración, sin decodificar a str y volver a codificar
+            with open(xml_path, 'rb') as f:
                 xml_content = f.read()
 
             # Verificar si es un AttachedDocument y extraer la factura
@@ -129,11 +144,11 @@ class ProcesadorLactalis:
 
             if invoice_xml:
                 # Es un AttachedDocument, procesar el XML interno
-                logger.debug(f"{xml_path.name}: Es un AttachedDocument, extrayendo factura interna")
+                logger.debug("%s: Es un AttachedDocument, extrayendo factura interna", xml_path.name)
                 extractor = FacturaExtractorLactalis(invoice_xml, xml_path.name)
             else:
                 # Es un XML de factura directo
-                logger.debug(f"{xml_path.name}: Es una factura directa")
+                logger.debug("%s: Es una factura directa", xml_path.name)
                 extractor = FacturaExtractorLactalis(xml_content, xml_path.name)
 
             lineas = extractor.extraer_datos()
@@ -143,31 +158,23 @@ class ProcesadorLactalis:
             logger.error(f"Error procesando XML {xml_path.name}: {str(e)}", exc_info=True)
             raise
 
-    def extraer_invoice_de_attached_document(self, xml_content: str) -> Optional[str]:
+    def extraer_invoice_de_attached_document(self, xml_content: Union[str, bytes]) -> Optional[str]:
         """
         Extrae el XML de la factura desde un documento adjunto (AttachedDocument)
 
         Args:
-            xml_content: Contenido XML completo
+            xml_content: Contenido XML completo (str o bytes)
 
         Returns:
             XML de la factura si es un AttachedDocument, None si no lo es
         """
         try:
-            import xml.etree.ElementTree as ET
-            root = ET.fromstring(xml_content)
-
             # Buscar en ExternalReference/Description (formato SEABOARD/LACTALIS)
-            description = root.find('.//cac:ExternalReference/cbc:Description', NAMESPACES)
-
-            if description is not None and description.text:
-                return description.text.strip()
-
-            # No es un AttachedDocument
-            return None
+            # con la XPath precompilada y el mismo parser del extractor
+            return extraer_factura_adjunta(xml_content)
 
         except Exception as e:
-            logger.debug(f"No es un AttachedDocument: {str(e)}")
+            logger.debug("No es un AttachedDocument: %s", e)
             return None
 
     def procesar_zip(self, zip_path: Path) -> List[Dict]:
@@ -184,35 +191,37 @@ class ProcesadorLactalis:
 
         try:
             with zipfile.ZipFile(zip_path, 'r') as zip_ref:
-                # Listar archivos en el ZIP
-                archivos_en_zip = zip_ref.namelist()
-                logger.debug(f"Archivos en {zip_path.name}: {archivos_en_zip}")
+                # Listar archivos en el ZIP (solo si se va a registrar)
+                if logger.isEnabledFor(logging.DEBUG):
+                    logger.debug("Archivos en %s: %s", zip_path.name, zip_ref.namelist())
 
-                # Buscar archivo XML (puede haber PDF también)
-                xml_files = [f for f in archivos_en_zip if f.lower().endswith('.xml')]
+                # Buscar archivo XML (puede haber PDF también) en las entradas
+                # del directorio central, ya leídas al abrir el ZIP
+                xml_files = [info for info in zip_ref.infolist() if info.filename.lower().endswith('.xml')]
 
                 if not xml_files:
                     logger.warning(f"No se encontro archivo XML en {zip_path.name}")
                     return []
 
                 # Procesar el primer XML encontrado
-                xml_filename = xml_files[0]
-                logger.debug(f"Extrayendo XML: {xml_filename}")
+                xml_info = xml_files[0]
+                xml_filename = xml_info.filename
+                logger.debug("Extrayendo XML: %s", xml_filename)
 
-                # Leer contenido del XML directamente del ZIP
-                with zip_ref.open(xml_filename) as xml_file:
-                    xml_content = xml_file.read().decode('utf-8', errors='ignore')
+                # Leer los bytes del XML directamente del ZIP (sin decodificar);
+                # con el ZipInfo no se vuelve a buscar la entrada por nombre
+                xml_content = zip_ref.read(xml_info)
 
                 # Verificar si es un AttachedDocument y extraer la factura
                 invoice_xml = self.extraer_invoice_de_attached_document(xml_content)
 
                 if invoice_xml:
                     # Es un AttachedDocument, procesar el XML interno
-                    logger.debug(f"{zip_path.name}: Es un AttachedDocument, extrayendo factura interna")
+                    logger.debug("%s: Es un AttachedDocument, extrayendo factura interna", zip_path.name)
                     extractor = FacturaExtractorLactalis(invoice_xml, f"{zip_path.name}/{xml_filename}")
                 else:
                     # Es un XML de factura directo
-                    logger.debug(f"{zip_path.name}: Es una factura directa")
+                    logger.debug("%s: Es una factura directa", zip_path.name)
                     extractor = FacturaExtractorLactalis(xml_content, f"{zip_path.name}/{xml_filename}")
 
                 lineas = extractor.extraer_datos()
@@ -249,39 +258,15 @@ class ProcesadorLactalis:
         Returns:
             Path al archivo Excel generado
         """
-        # Cargar plantilla
-        wb = openpyxl.load_workbook(self.plantilla_excel)
-        ws = wb.active
-
-        # Determinar fila inicial
-        fila_inicial = ws.max_row + 1 if ws.max_row > 1 else 2
-
-        # Escribir cada línea
-        for idx, linea in enumerate(lineas, start=fila_inicial):
-            ws.cell(row=idx, column=1, value=linea['numero_factura'])
-            ws.cell(row=idx, column=2, value=linea['nombre_producto'])
-            ws.cell(row=idx, column=3, value=linea['codigo_subyacente'])
-            ws.cell(row=idx, column=4, value=linea['unidad_medida'])
-            ws.cell(row=idx, column=5, value=linea['cantidad'])
-            ws.cell(row=idx, column=6, value=linea['precio_unitario'])
-            ws.cell(row=idx, column=7, value=linea['fecha_factura'])
-            ws.cell(row=idx, column=8, value=linea['fecha_pago'])
-            ws.cell(row=idx, column=9, value=linea['nit_comprador'])
-            ws.cell(row=idx, column=10, value=linea['nombre_comprador'])
-            ws.cell(row=idx, column=11, value=linea['nit_vendedor'])
-            ws.cell(row=idx, column=12, value=linea['nombre_vendedor'])
-            ws.cell(row=idx, column=13, value=linea['principal'])
-            ws.cell(row=idx, column=14, value=linea['municipio'])
-            ws.cell(row=idx, column=15, value=linea['iva'])
-            ws.cell(row=idx, column=16, value=linea['descripcion'])
-            ws.cell(row=idx, column=17, value=linea['activa_factura'])
-            ws.cell(row=idx, column=18, value=linea['activa_bodega'])
-            ws.cell(row=idx, column=19, value=linea['incentivo'])
-            ws.cell(row=idx, column=20, value=linea['cantidad_original'])
-            ws.cell(row=idx, column=21, value=linea['moneda'])
-            ws.cell(row=idx, column=22, value=linea['total_sin_iva'])
-            ws.cell(row=idx, column=23, value=linea['total_iva'])
-            ws.cell(row=idx, column=24, value=linea['total_con_iva'])
+        # Libro write-only con el encabezado de la plantilla: las filas se
+        # escriben en streaming, sin un objeto Cell por celda en memoria
+        wb, ws = abrir_reggis_write_only(self.plantilla_excel)
+
+        # Escribir cada línea como una fila completa: itemgetter arma la tupla
+        # en el orden de REGGIS_HEADERS y ws.append la agrega tras la última fila
+        fila_reggis = itemgetter(*REGGIS_CAMPOS)
+        for linea in lineas:
+            ws.append(fila_reggis(linea))
 
         # Generar nombre de archivo de salida
         archivo_salida = self.carpeta_salida / f"LACTALIS_COMPRAS_{self.carpeta_archivos.name}.xlsx"
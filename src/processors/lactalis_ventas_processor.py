@@ -6,17 +6,19 @@ Prioriza estabilidad sobre velocidad con límites conservadores
 
 import zipfile
 import logging
-import openpyxl
 import gc  # Para liberación explícita de memoria
 import re
 import unicodedata
+from operator import itemgetter
 from pathlib import Path
-from typing import List, Dict, Tuple
-from openpyxl.styles import Font, PatternFill, Alignment
+from typing import List, Dict, Tuple, Optional, Set
 from datetime import datetime
 
-from src.config.constants import REGGIS_HEADERS, LACTALIS_VENTAS_CONFIG, get_data_output_path
+from src.config.constants import REGGIS_CAMPOS, LACTALIS_VENTAS_CONFIG, get_data_output_path
 from extractors.lactalis_ventas_extractor import FacturaExtractorLactalisVentas, ValidacionFacturaError
+from utils.archivos import listar_archivos
+from utils.excel_reggis import abrir_reggis_write_only
+from utils.procesos import ejecutar_tareas
 
 try:
     from src.database.lactalis_database import LactalisDatabase
@@ -25,6 +27,40 @@ except ImportError:
 
 logger = logging.getLogger(__name__)
 
+# Contadores por archivo que los procesos hijos devuelven para sumar
+_CONTADORES_ARCHIVO = ('facturas_validas', 'notas_credito', 'notas_debito',
+                       'otros_documentos', 'archivos_error')
+
+
+def _procesar_archivo(tarea: Tuple[str, str]) -> Tuple[List[Dict], Dict[str, int], Optional[str]]:
+    """
+    Procesa un ZIP o XML (función de nivel de módulo para el pool de procesos)
+
+    Usa un procesador sin base de datos: solo extrae. La validación contra
+    la BD se hace en el proceso principal.
+
+    Args:
+        tarea: Tupla (tipo, ruta) con tipo 'zip' o 'xml'
+
+    Returns:
+        Tupla (lineas, conteos, error): líneas extraídas, contadores de
+        estadísticas del archivo y el mensaje de error si falló
+    """
+    tipo, ruta = tarea
+    archivo = Path(ruta)
+    procesador = ProcesadorLactalisVentas(archivo.parent, None)
+    try:
+        if tipo == 'zip':
+            lineas = procesador.procesar_zip(archivo)
+        else:
+            lineas = procesador.procesar_xml(archivo)
+        error = None
+    except Exception as e:
+        lineas = []
+        error = f"{type(e).__name__}: {str(e)}"
+    conteos = {clave: procesador.stats[clave] for clave in _CONTADORES_ARCHIVO}
+    return lineas, conteos, error
+
 
 class ProcesadorLactalisVentas:
     """
@@ -159,8 +195,7 @@ class ProcesadorLactalisVentas:
         )
 
         # Buscar archivos ZIP y XML
-        archivos_zip = list(self.carpeta_archivos.glob("*.zip"))
-        archivos_xml = list(self.carpeta_archivos.glob("*.xml"))
+        archivos_zip, archivos_xml = listar_archivos(self.carpeta_archivos)
 
         total_archivos = len(archivos_zip) + len(archivos_xml)
         self.stats['total_archivos'] = total_archivos
@@ -180,71 +215,64 @@ class ProcesadorLactalisVentas:
 
         logger.info(f"Procesando en lotes de {batch_size} archivos (prioridad: estabilidad)")
         logger.info(f"Escritura a Excel cada {memory_batch_size} líneas para liberar memoria")
-        
-        # Procesar ZIPs con MÁXIMA PROTECCIÓN
-        for idx, zip_file in enumerate(archivos_zip, 1):
-            try:
-                self._reportar_progreso(
-                    archivos_procesados,
-                    total_archivos,
-                    f"Procesando ZIP {idx}/{len(archivos_zip)}: {zip_file.name}"
-                )
-                
-                lineas = self.procesar_zip(zip_file)
-                lineas_validas = self._filtrar_lineas_validas(lineas)
-                todas_lineas.extend(lineas_validas)
-                archivos_procesados += 1
 
-                if lineas:
-                    logger.info(f"[OK] {zip_file.name} - {len(lineas)} líneas")
-                else:
-                    logger.debug(f"[SKIP] {zip_file.name} - Sin líneas válidas")
+        # Primero los ZIPs y luego los XMLs sueltos. La extracción corre en un
+        # pool de procesos; la validación contra la BD, las estadísticas y el
+        # progreso se llevan aquí, en el orden original de los archivos.
+        tareas = [('zip', str(f)) for f in archivos_zip] + [('xml', str(f)) for f in archivos_xml]
+        totales_por_tipo = {'zip': len(archivos_zip), 'xml': len(archivos_xml)}
+        indices_por_tipo = {'zip': 0, 'xml': 0}
+
+        # Lotes por envío a cada proceso acotados por el tamaño de lote configurado
+        resultados = ejecutar_tareas(
+            _procesar_archivo, tareas,
+            chunksize_maximo=LACTALIS_VENTAS_CONFIG.get('batch_size', 500) // 8
+        )
+        for (tipo, ruta), (lineas, conteos, error) in zip(tareas, resultados):
+            nombre = Path(ruta).name
+            etiqueta = tipo.upper()
+            indices_por_tipo[tipo] += 1
 
-                # Liberar memoria cada cierto número de archivos
-                if archivos_procesados % batch_size == 0:
-                    logger.debug(f"Liberando memoria después de {archivos_procesados} archivos...")
-                    gc.collect()  # Forzar garbage collection
-                    
-            except KeyboardInterrupt:
-                logger.warning("Procesamiento cancelado por el usuario")
-                raise
-            except Exception as e:
-                # ERROR CRÍTICO - NO CERRAR, solo registrar y continuar
-                logger.error(f"[ERROR CRÍTICO] {zip_file.name}: {type(e).__name__}: {str(e)}")
-                self.stats['archivos_error'] += 1
-                archivos_procesados += 1
-                # CONTINUAR con el siguiente archivo
+            # Sumar los contadores del archivo (los calculó el proceso hijo)
+            for clave, valor in conteos.items():
+                self.stats[clave] += valor
 
-        # Procesar XMLs sueltos con MÁXIMA PROTECCIÓN
-        for idx, xml_file in enumerate(archivos_xml, 1):
             try:
                 self._reportar_progreso(
                     archivos_procesados,
                     total_archivos,
-                    f"Procesando XML {idx}/{len(archivos_xml)}: {xml_file.name}"
+                    f"Procesando {etiqueta} {indices_por_tipo[tipo]}/{totales_por_tipo[tipo]}: {nombre}"
                 )
-                
-                lineas = self.procesar_xml(xml_file)
+
+                if error is not None:
+                    # ERROR CRÍTICO en el proceso hijo - registrar y continuar
+                    logger.error(f"[ERROR CRÍTICO] {nombre}: {error}")
+                    self.stats['archivos_error'] += 1
+                    archivos_procesados += 1
+                    continue
+
                 lineas_validas = self._filtrar_lineas_validas(lineas)
                 todas_lineas.extend(lineas_validas)
                 archivos_procesados += 1
 
                 if lineas:
-                    logger.info(f"[OK] {xml_file.name} - {len(lineas)} líneas")
+                    logger.info(f"[OK] {nombre} - {len(lineas)} líneas")
                 else:
-                    logger.debug(f"[SKIP] {xml_file.name} - Sin líneas válidas")
+                    logger.debug(f"[SKIP] {nombre} - Sin líneas válidas")
 
                 # Liberar memoria cada cierto número de archivos
                 if archivos_procesados % batch_size == 0:
                     logger.debug(f"Liberando memoria después de {archivos_procesados} archivos...")
                     gc.collect()  # Forzar garbage collection
-                    
+
             except KeyboardInterrupt:
                 logger.warning("Procesamiento cancelado por el usuario")
+                # Cerrar el iterador ya: cancela los archivos aún en cola del pool
+                resultados.close()
                 raise
             except Exception as e:
                 # ERROR CRÍTICO - NO CERRAR, solo registrar y continuar
-                logger.error(f"[ERROR CRÍTICO] {xml_file.name}: {type(e).__name__}: {str(e)}")
+                logger.error(f"[ERROR CRÍTICO] {nombre}: {type(e).__name__}: {str(e)}")
                 self.stats['archivos_error'] += 1
                 archivos_procesados += 1
                 # CONTINUAR con el siguiente archivo
@@ -431,8 +459,8 @@ class ProcesadorLactalisVentas:
             
             try:
                 # **PASO 2: Buscar XMLs dentro del ZIP**
-                archivos_en_zip = zip_ref.namelist()
-                xml_files = [f for f in archivos_en_zip if f.lower().endswith('.xml')]
+                # Entradas del directorio central, ya leídas al abrir el ZIP
+                xml_files = [info for info in zip_ref.infolist() if info.filename.lower().endswith('.xml')]
 
                 if not xml_files:
                     logger.warning(f"{zip_path.name}: No se encontró archivo XML")
@@ -440,12 +468,13 @@ class ProcesadorLactalisVentas:
                     return []
 
                 # **PASO 3: Extraer y leer XML con múltiples encodings**
-                xml_filename = xml_files[0]
+                xml_info = xml_files[0]
+                xml_filename = xml_info.filename
                 xml_content = None
                 
                 try:
-                    with zip_ref.open(xml_filename) as xml_file:
-                        raw_content = xml_file.read()
+                    # Con el ZipInfo no se vuelve a buscar la entrada por nombre
+                    raw_content = zip_ref.read(xml_info)
                     
                     # Intentar múltiples encodings
                     encodings_to_try = ['utf-8', 'latin-1', 'cp1252', 'iso-8859-1']
@@ -538,12 +567,14 @@ class ProcesadorLactalisVentas:
         """
         return get_data_output_path()
 
-    def _validar_linea_con_bd(self, linea: Dict) -> Tuple[bool, str]:
+    def _validar_linea_con_bd(self, linea: Dict, clientes_validos: Optional[Set[str]] = None) -> Tuple[bool, str]:
         """
         Valida una línea contra la base de datos
 
         Args:
             linea: Diccionario con datos de la línea
+            clientes_validos: NITs ya validados en lote (opcional). Si es None
+                se consulta la BD para esta línea
 
         Returns:
             Tupla (es_valida, mensaje_error)
@@ -581,7 +612,12 @@ class ProcesadorLactalisVentas:
         if self.validar_clientes:
             nit_comprador = linea.get('nit_comprador', '')
 
-            if not self.database.validar_cliente(nit_comprador):
+            if clientes_validos is not None:
+                cliente_existe = str(nit_comprador).strip() in clientes_validos
+            else:
+                cliente_existe = self.database.validar_cliente(nit_comprador)
+
+            if not cliente_existe:
                 mensaje = f"Cliente no existe en BD: NIT={nit_comprador}"
                 logger.info(f"RECHAZADO - {mensaje}")
                 self.stats['clientes_invalidos'] += 1
@@ -611,11 +647,18 @@ class ProcesadorLactalisVentas:
         logger.info(f"Validar materiales: {self.validar_materiales}")
         logger.info(f"Validar clientes: {self.validar_clientes}")
 
+        # Validar los NIT de todas las líneas en una sola consulta
+        clientes_validos = None
+        if self.validar_clientes:
+            clientes_validos = self.database.validar_clientes_lote(
+                {linea.get('nit_comprador', '') for linea in lineas}
+            )
+
         lineas_validas = []
         lineas_rechazadas_detalle = 0
 
         for idx, linea in enumerate(lineas, 1):
-            es_valida, mensaje = self._validar_linea_con_bd(linea)
+            es_valida, mensaje = self._validar_linea_con_bd(linea, clientes_validos)
             if es_valida:
                 lineas_validas.append(linea)
             else:
@@ -645,44 +688,20 @@ class ProcesadorLactalisVentas:
         """
         logger.info(f"Iniciando escritura de {len(lineas)} líneas a Excel...")
 
-        # Cargar plantilla en modo de solo escritura para mejor rendimiento
-        wb = openpyxl.load_workbook(self.plantilla_excel)
-        ws = wb.active
-
-        # Determinar fila inicial
-        fila_inicial = ws.max_row + 1 if ws.max_row > 1 else 2
+        # Libro write-only con el encabezado de la plantilla: cada fila se
+        # escribe en streaming tras las de la plantilla, sin un objeto Cell por
+        # celda en memoria
+        wb, ws = abrir_reggis_write_only(self.plantilla_excel)
 
         # Escribir cada línea con progreso
         total_lineas = len(lineas)
         report_interval = max(100, total_lineas // 20)  # Reportar cada 5%
 
+        # itemgetter arma la tupla de la fila en el orden de REGGIS_HEADERS
+        fila_reggis = itemgetter(*REGGIS_CAMPOS)
+
         for linea_num, linea in enumerate(lineas, start=0):
-            fila_excel = fila_inicial + linea_num
-
-            ws.cell(row=fila_excel, column=1, value=linea['numero_factura'])
-            ws.cell(row=fila_excel, column=2, value=linea['nombre_producto'])
-            ws.cell(row=fila_excel, column=3, value=linea['codigo_subyacente'])
-            ws.cell(row=fila_excel, column=4, value=linea['unidad_medida'])
-            ws.cell(row=fila_excel, column=5, value=linea['cantidad'])
-            ws.cell(row=fila_excel, column=6, value=linea['precio_unitario'])
-            ws.cell(row=fila_excel, column=7, value=linea['fecha_factura'])
-            ws.cell(row=fila_excel, column=8, value=linea['fecha_pago'])
-            ws.cell(row=fila_excel, column=9, value=linea['nit_comprador'])
-            ws.cell(row=fila_excel, column=10, value=linea['nombre_comprador'])
-            ws.cell(row=fila_excel, column=11, value=linea['nit_vendedor'])
-            ws.cell(row=fila_excel, column=12, value=linea['nombre_vendedor'])
-            ws.cell(row=fila_excel, column=13, value=linea['principal'])
-            ws.cell(row=fila_excel, column=14, value=linea['municipio'])
-            ws.cell(row=fila_excel, column=15, value=linea['iva'])
-            ws.cell(row=fila_excel, column=16, value=linea['descripcion'])
-            ws.cell(row=fila_excel, column=17, value=linea['activa_factura'])
-            ws.cell(row=fila_excel, column=18, value=linea['activa_bodega'])
-            ws.cell(row=fila_excel, column=19, value=linea['incentivo'])
-            ws.cell(row=fila_excel, column=20, value=linea['cantidad_original'])
-            ws.cell(row=fila_excel, column=21, value=linea['moneda'])
-            ws.cell(row=fila_excel, column=22, value=linea['total_sin_iva'])
-            ws.cell(row=fila_excel, column=23, value=linea['total_iva'])
-            ws.cell(row=fila_excel, column=24, value=linea['total_con_iva'])
+            ws.append(fila_reggis(linea))
 
             # Reportar progreso cada cierto número de líneas
             if (linea_num + 1) % report_interval == 0:
@@ -2,18 +2,41 @@
 Procesador específico para SEABOARD
 """
 
-import xml.etree.ElementTree as ET
-import openpyxl
 import logging
+from operator import itemgetter
 from pathlib import Path
-from typing import Dict, List, Optional
+from typing import Dict, List, Optional, Tuple
 
-from config.constants import NAMESPACES, get_data_output_path
+from config.constants import REGGIS_CAMPOS, get_data_output_path
+from extractors.lactalis_extractor import extraer_factura_adjunta
 from extractors.seaboard_extractor import FacturaExtractorSeaboard
+from utils.excel_reggis import abrir_reggis_write_only
+from utils.procesos import ejecutar_tareas
 
 logger = logging.getLogger(__name__)
 
 
+def _procesar_archivo(ruta: str) -> Tuple[List[Dict], Optional[str]]:
+    """
+    Extrae las líneas de un AttachedDocument (nivel de módulo para el pool de procesos)
+
+    Args:
+        ruta: Ruta del archivo XML
+
+    Returns:
+        Tupla (lineas, error): error es el mensaje si el archivo no se pudo procesar
+    """
+    xml_file = Path(ruta)
+    procesador = ProcesadorSeaboard(xml_file.parent, None)
+    try:
+        invoice_xml = procesador.extraer_invoice_de_attached_document(xml_file)
+        if not invoice_xml:
+            return [], None
+        return FacturaExtractorSeaboard(invoice_xml).extraer_datos(), None
+    except Exception as e:
+        return [], str(e)
+
+
 class ProcesadorSeaboard:
     """Procesador específico para SEABOARD"""
 
@@ -23,15 +46,16 @@ class ProcesadorSeaboard:
         self.carpeta_salida = None
 
     def extraer_invoice_de_attached_document(self, xml_path: Path) -> Optional[str]:
-        """Extrae el XML de la factura desde un documento adjunto"""
-        try:
-            tree = ET.parse(xml_path)
-            root = tree.getroot()
-            description = root.find('.//cac:ExternalReference/cbc:Description', NAMESPACES)
+        """
+        Extrae el XML de la factura desde un documento adjunto
 
-            if description is not None and description.text:
-                return description.text.strip()
-            return None
+        Usa el mismo recorrido incremental que Lactalis compras: toma la
+        Description del primer cac:ExternalReference que la tenga y no parsea
+        la ApplicationResponse que suele venir después.
+        """
+        try:
+            with open(xml_path, 'rb') as archivo:
+                return extraer_factura_adjunta(archivo.read())
         except Exception as e:
             logger.error(f"Error al extraer factura de {xml_path.name}: {str(e)}")
             return None
@@ -43,17 +67,12 @@ class ProcesadorSeaboard:
 
         logger.info(f"SEABOARD: Se encontraron {len(archivos_xml)} archivos XML")
 
-        for xml_file in archivos_xml:
-            try:
-                invoice_xml = self.extraer_invoice_de_attached_document(xml_file)
-
-                if invoice_xml:
-                    extractor = FacturaExtractorSeaboard(invoice_xml)
-                    lineas = extractor.extraer_datos()
-                    lineas_reggis.extend(lineas)
-
-            except Exception as e:
-                logger.error(f"Error procesando {xml_file.name}: {str(e)}")
+        resultados = ejecutar_tareas(_procesar_archivo, [str(xml_file) for xml_file in archivos_xml])
+        for xml_file, (lineas, error) in zip(archivos_xml, resultados):
+            if error is None:
+                lineas_reggis.extend(lineas)
+            else:
+                logger.error(f"Error procesando {xml_file.name}: {error}")
 
         return lineas_reggis
 
@@ -64,36 +83,15 @@ class ProcesadorSeaboard:
 
     def escribir_reggis(self, lineas: List[Dict]) -> Path:
         """Escribe las líneas procesadas en el archivo Excel"""
-        wb = openpyxl.load_workbook(self.plantilla_excel)
-        ws = wb.active
-
-        fila_inicial = ws.max_row + 1 if ws.max_row > 1 else 2
-
-        for idx, linea in enumerate(lineas, start=fila_inicial):
-            ws.cell(row=idx, column=1, value=linea['numero_factura'])
-            ws.cell(row=idx, column=2, value=linea['nombre_producto'])
-            ws.cell(row=idx, column=3, value=linea['codigo_subyacente'])
-            ws.cell(row=idx, column=4, value=linea['unidad_medida'])
-            ws.cell(row=idx, column=5, value=linea['cantidad'])
-            ws.cell(row=idx, column=6, value=linea['precio_unitario'])
-            ws.cell(row=idx, column=7, value=linea['fecha_factura'])
-            ws.cell(row=idx, column=8, value=linea['fecha_pago'])
-            ws.cell(row=idx, column=9, value=linea['nit_comprador'])
-            ws.cell(row=idx, column=10, value=linea['nombre_comprador'])
-            ws.cell(row=idx, column=11, value=linea['nit_vendedor'])
-            ws.cell(row=idx, column=12, value=linea['nombre_vendedor'])
-            ws.cell(row=idx, column=13, value=linea['principal'])
-            ws.cell(row=idx, column=14, value=linea['municipio'])
-            ws.cell(row=idx, column=15, value=linea['iva'])
-            ws.cell(row=idx, column=16, value=linea['descripcion'])
-            ws.cell(row=idx, column=17, value=linea['activa_factura'])
-            ws.cell(row=idx, column=18, value=linea['activa_bodega'])
-            ws.cell(row=idx, column=19, value=linea['incentivo'])
-            ws.cell(row=idx, column=20, value=linea['cantidad_original'])
-            ws.cell(row=idx, column=21, value=linea['moneda'])
-            ws.cell(row=idx, column=22, value=linea['total_sin_iva'])
-            ws.cell(row=idx, column=23, value=linea['total_iva'])
-            ws.cell(row=idx, column=24, value=linea['total_con_iva'])
+        # Libro write-only con el encabezado de la plantilla: las filas se
+        # escriben en streaming, sin un objeto Cell por celda en memoria
+        wb, ws = abrir_reggis_write_only(self.plantilla_excel)
+
+        # Cada línea como fila completa: itemgetter arma la tupla en el orden de
+        # REGGIS_HEADERS
+        fila_reggis = itemgetter(*REGGIS_CAMPOS)
+        for linea in lineas:
+            ws.append(fila_reggis(linea))
 
         salida = self.carpeta_salida / "REGGIS_Procesado_SEABOARD.xlsx"
         wb.save(salida)
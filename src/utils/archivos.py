@@ -0,0 +1,34 @@
+"""
+Búsqueda de los archivos de entrada (ZIP y XML) en una carpeta
+"""
+
+import os
+from pathlib import Path
+from typing import List, Tuple
+
+
+def listar_archivos(carpeta: Path) -> Tuple[List[Path], List[Path]]:
+    """
+    Lista los ZIP y XML de la carpeta en una sola pasada
+
+    os.scandir entrega el tipo de cada entrada junto con el nombre, sin un
+    stat extra por archivo (notable en carpetas de red o de SharePoint). La
+    extensión se compara sin distinguir mayúsculas, como glob en Windows.
+
+    Returns:
+        Tupla (archivos_zip, archivos_xml)
+    """
+    archivos_zip = []
+    archivos_xml = []
+    with os.scandir(carpeta) as entradas:
+        for entrada in entradas:
+            nombre = entrada.name.lower()
+            if nombre.endswith('.zip'):
+                destino = archivos_zip
+            elif nombre.endswith('.xml'):
+                destino = archivos_xml
+            else:
+                continue
+            if entrada.is_file():
+                destino.append(Path(entrada.path))
+    return archivos_zip, archivos_xml
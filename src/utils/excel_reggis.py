@@ -0,0 +1,94 @@
+"""
+Escritura de archivos REGGIS en modo write-only a partir de la plantilla
+"""
+
+import os
+from copy import copy
+from functools import lru_cache
+from pathlib import Path
+
+import openpyxl
+from openpyxl.cell import WriteOnlyCell
+
+
+@lru_cache(maxsize=4)
+def _leer_plantilla(ruta: str, _mtime_ns: int, _tamano: int):
+    """
+    Lee una sola vez lo que se copia de la plantilla al libro de salida
+
+    La fecha de modificación y el tamaño forman parte de la llave de la caché:
+    si la plantilla cambia en disco se vuelve a leer.
+
+    Returns:
+        Tupla (titulo, anchos, panel_inmovilizado, filas). anchos contiene
+        (letra, ancho, min, max) por columna con ancho propio; filas contiene
+        por celda (valor, estilos) con estilos None si la celda no tiene estilo.
+    """
+    plantilla_ws = openpyxl.load_workbook(ruta).active
+
+    anchos = tuple(
+        (letra, dimension.width, dimension.min, dimension.max)
+        for letra, dimension in plantilla_ws.column_dimensions.items()
+        if dimension.customWidth
+    )
+
+    filas = []
+    for fila in plantilla_ws.iter_rows():
+        celdas = []
+        for celda in fila:
+            estilos = None
+            if celda.has_style:
+                estilos = (
+                    copy(celda.font), copy(celda.fill), copy(celda.border),
+                    copy(celda.alignment), celda.number_format, copy(celda.protection)
+                )
+            celdas.append((celda.value, estilos))
+        filas.append(tuple(celdas))
+
+    return plantilla_ws.title, anchos, plantilla_ws.freeze_panes, tuple(filas)
+
+
+def abrir_reggis_write_only(plantilla: Path):
+    """
+    Crea un libro write-only con la hoja y las filas iniciales de la plantilla
+
+    De la hoja activa de la plantilla se toman el título, los anchos de
+    columna, el panel inmovilizado y sus filas (el encabezado) con estilos.
+    La plantilla se lee una vez por proceso mientras no cambie en disco; el
+    libro retornado escribe cada fila en streaming al guardar, sin mantener un
+    objeto Cell por celda en memoria.
+
+    Args:
+        plantilla: Path a la plantilla Excel base
+
+    Returns:
+        Tupla (libro, hoja). Las filas de datos se agregan con hoja.append(...)
+        a continuación de las de la plantilla.
+    """
+    estado = os.stat(plantilla)
+    titulo, anchos, panel_inmovilizado, filas = _leer_plantilla(
+        str(plantilla), estado.st_mtime_ns, estado.st_size
+    )
+
+    wb = openpyxl.Workbook(write_only=True)
+    ws = wb.create_sheet(titulo)
+
+    # En write-only las dimensiones deben fijarse antes de escribir la primera fila
+    for letra, ancho, minimo, maximo in anchos:
+        destino = ws.column_dimensions[letra]
+        destino.width = ancho
+        destino.min = minimo
+        destino.max = maximo
+    ws.freeze_panes = panel_inmovilizado
+
+    for fila in filas:
+        celdas = []
+        for valor, estilos in fila:
+            nueva = WriteOnlyCell(ws, value=valor)
+            if estilos is not None:
+                (nueva.font, nueva.fill, nueva.border,
+                 nueva.alignment, nueva.number_format, nueva.protection) = estilos
+            celdas.append(nueva)
+        ws.append(celdas)
+
+    return wb, ws
@@ -0,0 +1,88 @@
+"""
+Ejecución de tareas independientes en un pool de procesos
+"""
+
+import logging
+import logging.handlers
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable, Iterator, Optional, Sequence, TypeVar
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar('T')
+R = TypeVar('R')
+
+# Por debajo de este número de tareas no compensa arrancar procesos
+MIN_TAREAS_PARALELO = 8
+
+
+def _inicializar_logging_worker(cola, nivel: int):
+    """
+    Envía el logging del proceso hijo a la cola del proceso principal
+
+    Se ejecuta al arrancar cada proceso del pool. Los handlers heredados
+    (con fork) se reemplazan: así los mensajes de los hijos llegan al log de
+    la sesión una sola vez, con los handlers y el formato del proceso principal.
+    """
+    raiz = logging.getLogger()
+    for handler in raiz.handlers[:]:
+        raiz.removeHandler(handler)
+    raiz.addHandler(logging.handlers.QueueHandler(cola))
+    raiz.setLevel(nivel)
+
+
+def ejecutar_tareas(funcion: Callable[[T], R], tareas: Sequence[T],
+                    chunksize_maximo: Optional[int] = None) -> Iterator[R]:
+    """
+    Aplica funcion a cada tarea, en un pool de procesos si son suficientes
+
+    Cada tarea es independiente y el parseo es trabajo de CPU, así que se
+    reparte entre procesos (evita el GIL). Los resultados se entregan a
+    medida que llegan y en el mismo orden de las tareas. El logging de los
+    procesos hijos se reenvía por una cola a los handlers del proceso
+    principal. Si el pool falla, las tareas pendientes se procesan en serie;
+    si quien consume deja de iterar, las tareas en espera se cancelan.
+
+    Args:
+        funcion: Función de nivel de módulo (debe poder enviarse a otro proceso)
+        tareas: Argumento de cada llamada
+        chunksize_maximo: Límite opcional de tareas por envío a un proceso
+
+    Returns:
+        Iterador con el resultado de cada tarea
+    """
+    hechas = 0
+    workers = os.cpu_count() or 1
+    if workers > 1 and len(tareas) >= MIN_TAREAS_PARALELO:
+        # Lotes por envío para amortizar la comunicación entre procesos
+        chunksize = max(1, len(tareas) // (workers * 4))
+        if chunksize_maximo:
+            chunksize = max(1, min(chunksize, chunksize_maximo))
+
+        raiz = logging.getLogger()
+        cola = multiprocessing.Queue()
+        listener = logging.handlers.QueueListener(cola, *raiz.handlers, respect_handler_level=True)
+        listener.start()
+        pool = None
+        try:
+            pool = ProcessPoolExecutor(
+                max_workers=workers,
+                initializer=_inicializar_logging_worker,
+                initargs=(cola, raiz.getEffectiveLevel()),
+            )
+            for resultado in pool.map(funcion, tareas, chunksize=chunksize):
+                hechas += 1
+                yield resultado
+            return
+        except Exception as e:
+            logger.warning(f"No se pudo procesar en paralelo, se procesa en serie: {str(e)}")
+        finally:
+            if pool is not None:
+                pool.shutdown(wait=True, cancel_futures=True)
+            listener.stop()
+            cola.close()
+
+    for tarea in tareas[hechas:]:
+        yield funcion(tarea)
@@ -0,0 +1,200 @@
+"""
+Parseo de los XML UBL de las facturas y rutas XPath precompiladas, común a
+extractores y procesadores
+
+lxml (libxml2) es opcional: si no está instalado se usa ElementTree. Los
+módulos que parsean XML toman ET y LXML_DISPONIBLE de aquí.
+"""
+
+import re
+from typing import Dict, Iterator, Optional, Tuple, Union
+
+from config.constants import NAMESPACES
+
+try:
+    from lxml import etree as ET
+    LXML_DISPONIBLE = True
+except ImportError:
+    import xml.etree.ElementTree as ET
+    LXML_DISPONIBLE = False
+
+# Opciones de todos los parsers de lxml: sin límite de tamaño de nodo (los
+# adjuntos en base64 lo superan), sin resolver entidades, y sin comentarios
+# ni instrucciones de procesamiento, como ElementTree: iter() solo recorre
+# elementos y .tag siempre es un str
+_OPCIONES_LXML = {
+    'huge_tree': True,
+    'resolve_entities': False,
+    'remove_comments': True,
+    'remove_pis': True,
+}
+
+# Tamaño de los bloques con que se alimenta el parser incremental
+_BLOQUE_LECTURA = 64 * 1024
+
+# Prefijo de namespace dentro de una ruta ('cac:', 'cbc:'...)
+_PREFIJO = re.compile(r'\b(%s):' % '|'.join(NAMESPACES))
+
+
+def _datos_y_opciones(xml_content: Union[str, bytes]) -> Tuple[Union[str, bytes], Dict]:
+    """
+    Contenido a entregar al parser y opciones del parser
+
+    Los bytes (tal como vienen del archivo o del ZIP) se entregan sin
+    decodificar: el parser aplica la declaración de encoding del documento.
+    lxml no acepta un str con declaración de encoding: se pasa como bytes
+    UTF-8 forzando el encoding del parser. Con ElementTree no hay opciones.
+    """
+    if not LXML_DISPONIBLE:
+        return xml_content, {}
+    if isinstance(xml_content, bytes):
+        return xml_content, _OPCIONES_LXML
+    return xml_content.encode('utf-8'), dict(_OPCIONES_LXML, encoding='utf-8')
+
+
+def _parsear(xml_content: Union[str, bytes]):
+    datos, opciones = _datos_y_opciones(xml_content)
+    if opciones:
+        return ET.fromstring(datos, parser=ET.XMLParser(**opciones))
+    return ET.fromstring(datos)
+
+
+def parsear_xml(xml_content: Union[str, bytes]):
+    """
+    Parsea un documento XML completo
+
+    Args:
+        xml_content: Contenido XML como string, o los bytes tal como vienen
+            del archivo o del ZIP
+
+    Returns:
+        Elemento raíz del documento
+
+    Raises:
+        ET.ParseError: Si el contenido no es XML válido
+    """
+    if isinstance(xml_content, bytes):
+        try:
+            return _parsear(xml_content)
+        except ET.ParseError:
+            # Bytes que no son UTF-8 válido: se reintenta como al leer el
+            # archivo como texto, decodificando e ignorando los bytes inválidos
+            xml_content = xml_content.decode('utf-8', errors='ignore')
+    return _parsear(xml_content)
+
+
+def eventos_xml(xml_content: Union[str, bytes], eventos=('end',),
+                tag: Optional[str] = None) -> Iterator[Tuple[str, object]]:
+    """
+    Recorre el XML con un parser incremental, entregando (evento, elemento)
+
+    El contenido se entrega al parser por bloques: si quien consume deja de
+    iterar, el resto del documento no se parsea.
+
+    Args:
+        xml_content: Contenido XML como string o bytes (ver parsear_xml)
+        eventos: Eventos del parser ('start', 'end')
+        tag: Etiqueta en notación Clark. Con lxml el filtro se aplica en
+            libxml2; con ElementTree se entregan todos los elementos y quien
+            consume debe comparar la etiqueta.
+
+    Raises:
+        ET.ParseError: Si el contenido no es XML válido
+    """
+    datos, opciones = _datos_y_opciones(xml_content)
+    if tag is not None and opciones:
+        opciones = dict(opciones, tag=tag)
+    parser = ET.XMLPullParser(events=eventos, **opciones)
+
+    for inicio in range(0, len(datos), _BLOQUE_LECTURA):
+        parser.feed(datos[inicio:inicio + _BLOQUE_LECTURA])
+        yield from parser.read_events()
+
+    parser.close()
+    yield from parser.read_events()
+
+
+def _en_notacion_clark(ruta: str) -> str:
+    """
+    Reemplaza los prefijos de la ruta ('cac:', 'cbc:'...) por su URI entre llaves
+
+    ElementPath guarda sus rutas compiladas en una caché cuya clave incluye el
+    diccionario de namespaces ordenado; con la ruta ya en notación Clark se
+    llama find/findall sin namespaces y esa clave sale gratis.
+    """
+    return _PREFIJO.sub(lambda m: '{%s}' % NAMESPACES[m.group(1)], ruta)
+
+
+def compilar(ruta: str, ruta_etree: Optional[str] = None):
+    """
+    Compila una ruta XPath una sola vez
+
+    Con lxml retorna un etree.XPath; con ElementTree retorna una función que
+    delega en findall (ElementTree mantiene su propia caché de rutas).
+    ruta_etree permite una sintaxis alternativa cuando la ruta XPath no es
+    compatible con ElementPath (ej. local-name()).
+
+    Returns:
+        Función elemento -> lista de elementos encontrados
+    """
+    if LXML_DISPONIBLE:
+        return ET.XPath(ruta, namespaces=NAMESPACES)
+    ruta_clark = _en_notacion_clark(ruta_etree or ruta)
+    return lambda elemento: elemento.findall(ruta_clark)
+
+
+def compilar_primero(*rutas: str):
+    """
+    Compila una o varias rutas XPath de las que solo interesa el primer resultado
+
+    Retorna una función elemento -> primer elemento encontrado (o None), con
+    la misma semántica que elemento.find(ruta, NAMESPACES). Si se pasan varias
+    rutas se prueban en orden y gana la primera que encuentre algo.
+    """
+    if LXML_DISPONIBLE:
+        xpaths = [ET.XPath('(%s)[1]' % ruta, namespaces=NAMESPACES) for ruta in rutas]
+
+        def buscar(elemento):
+            for xpath in xpaths:
+                resultado = xpath(elemento)
+                if resultado:
+                    return resultado[0]
+            return None
+
+        return buscar
+
+    rutas_clark = [_en_notacion_clark(ruta) for ruta in rutas]
+    if len(rutas_clark) == 1:
+        ruta_clark = rutas_clark[0]
+        return lambda elemento: elemento.find(ruta_clark)
+
+    def buscar(elemento):
+        for ruta_clark in rutas_clark:
+            resultado = elemento.find(ruta_clark)
+            if resultado is not None:
+                return resultado
+        return None
+
+    return buscar
+
+
+def compilar_texto(*rutas: str):
+    """
+    Compila una o varias rutas XPath de las que solo interesa el texto del primer resultado
+
+    Retorna una función elemento -> texto con la semántica de
+    elemento.findtext(ruta, None, NAMESPACES): None si no hay coincidencia y
+    '' si el elemento existe sin texto. Con ElementTree y una sola ruta es un
+    único findtext.
+    """
+    if not LXML_DISPONIBLE and len(rutas) == 1:
+        ruta_clark = _en_notacion_clark(rutas[0])
+        return lambda elemento: elemento.findtext(ruta_clark)
+
+    buscar = compilar_primero(*rutas)
+
+    def texto(elemento):
+        resultado = buscar(elemento)
+        return None if resultado is None else (resultado.text or '')
+
+    return texto
@@ -0,0 +1,10 @@
+"""
+Configuración común de pytest: rutas de importación del proyecto
+"""
+
+from pathlib import Path
+
+from reggis_filas import configurar_rutas
+
+# Los módulos se importan como 'processors.x' y 'src.config.x', igual que en app.py
+configurar_rutas(Path(__file__).resolve().parent.parent)
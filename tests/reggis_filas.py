@@ -0,0 +1,114 @@
+"""
+Filas REGGIS que produce cada procesador con los XML de tests/fixtures
+
+Lo usa test_regresion_reggis.py y sirve también como script para obtener
+las filas con el código de otra revisión (por ejemplo la anterior a un
+cambio) y compararlas:
+
+    git worktree add /tmp/antes <commit>
+    python tests/reggis_filas.py /tmp/antes > tests/fixtures/reggis_esperado.json
+
+Solo usa los puntos de entrada públicos de los procesadores, que no han
+cambiado de firma, para que funcione con cualquier revisión.
+"""
+
+import json
+import shutil
+import sys
+import tempfile
+import zipfile
+from pathlib import Path
+from typing import Dict, List
+
+import openpyxl
+
+FIXTURES = Path(__file__).resolve().parent / 'fixtures'
+
+# Archivos de cada procesador: AttachedDocument y factura directa
+ARCHIVOS = {
+    'lactalis_compras': ('compras_factura.xml', 'compras_adjunto.xml'),
+    'lactalis_ventas': ('ventas_factura.xml', 'ventas_adjunto.xml', 'ventas_nota_credito.xml'),
+    'seaboard': ('seaboard_factura.xml', 'seaboard_adjunto.xml'),
+    'casa_del_agricultor': ('casa_factura.xml', 'casa_adjunto.xml'),
+}
+
+
+def configurar_rutas(raiz: Path):
+    """Antepone al sys.path la raíz del repositorio y su carpeta src"""
+    for ruta in (raiz, raiz / 'src'):
+        if str(ruta) not in sys.path:
+            sys.path.insert(0, str(ruta))
+
+
+def _filas_lactalis_compras(archivo: Path, _temporal: Path) -> List[Dict]:
+    from processors.lactalis_processor import ProcesadorLactalis
+    return ProcesadorLactalis(archivo.parent, None).procesar_xml(archivo)
+
+
+def _filas_lactalis_ventas(archivo: Path, _temporal: Path) -> List[Dict]:
+    from processors.lactalis_ventas_processor import ProcesadorLactalisVentas
+    return ProcesadorLactalisVentas(archivo.parent, None).procesar_xml(archivo)
+
+
+def _filas_seaboard(archivo: Path, temporal: Path) -> List[Dict]:
+    # El procesador lee todos los XML de una carpeta: una por archivo
+    from processors.seaboard_processor import ProcesadorSeaboard
+    carpeta = temporal / archivo.stem
+    carpeta.mkdir()
+    shutil.copy(archivo, carpeta)
+    return ProcesadorSeaboard(carpeta, None).procesar_archivos_xml()
+
+
+def _filas_casa_del_agricultor(archivo: Path, temporal: Path) -> List[Dict]:
+    # Casa del Agricultor recibe ZIPs y escribe su propio Excel: se lee de vuelta
+    from processors.casa_del_agricultor_processor import ProcesadorCasaDelAgricultor
+    carpeta_zip = temporal / archivo.stem
+    carpeta_salida = temporal / f'{archivo.stem}_salida'
+    carpeta_zip.mkdir()
+    carpeta_salida.mkdir()
+    with zipfile.ZipFile(carpeta_zip / f'{archivo.stem}.zip', 'w') as zip_ref:
+        zip_ref.write(archivo, archivo.name)
+
+    ProcesadorCasaDelAgricultor(carpeta_zip, carpeta_salida).procesar()
+
+    salida = next(carpeta_salida.glob('*.xlsx'))
+    wb = openpyxl.load_workbook(salida, read_only=True)
+    filas = list(wb.active.iter_rows(values_only=True))
+    wb.close()
+    encabezados = filas[0]
+    return [dict(zip(encabezados, fila)) for fila in filas[1:]]
+
+
+_EXTRACTORES = {
+    'lactalis_compras': _filas_lactalis_compras,
+    'lactalis_ventas': _filas_lactalis_ventas,
+    'seaboard': _filas_seaboard,
+    'casa_del_agricultor': _filas_casa_del_agricultor,
+}
+
+
+def filas_reggis() -> Dict[str, Dict[str, List[Dict]]]:
+    """
+    Procesa cada fixture con su procesador
+
+    Returns:
+        Diccionario procesador -> archivo -> filas (dict por fila)
+    """
+    resultado = {}
+    with tempfile.TemporaryDirectory() as carpeta:
+        temporal = Path(carpeta)
+        for procesador, archivos in ARCHIVOS.items():
+            extraer = _EXTRACTORES[procesador]
+            resultado[procesador] = {
+                nombre: extraer(FIXTURES / nombre, temporal) for nombre in archivos
+            }
+    # Ida y vuelta por JSON: mismos tipos que las filas esperadas guardadas
+    return json.loads(json.dumps(resultado))
+
+
+if __name__ == '__main__':
+    if len(sys.argv) != 2:
+        sys.exit(f"Uso: python {sys.argv[0]} <raiz del repositorio>")
+    configurar_rutas(Path(sys.argv[1]).resolve())
+    json.dump(filas_reggis(), sys.stdout, ensure_ascii=False, indent=2, sort_keys=True)
+    sys.stdout.write('\n')
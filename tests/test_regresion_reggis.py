@@ -0,0 +1,70 @@
+"""
+Regresión de las filas REGGIS de cada procesador
+
+fixtures/reggis_esperado.json tiene las filas que producía el código antes
+de las optimizaciones (commit 860be91), generadas con:
+
+    python tests/reggis_filas.py <checkout de 860be91>
+
+Las filas actuales deben ser iguales salvo los cambios de salida
+intencionales, listados en CAMBIOS_INTENCIONALES.
+
+Los fixtures cubren: AttachedDocument y factura directa en cada procesador,
+ExternalReference sin Description antes de la factura embebida, precio en
+PricingReference, línea LBR con gramos en la descripción, IDs y NIT con
+ceros a la izquierda y espacios, y partes sin las rutas habituales
+(solo PartyLegalEntity, PartyName o PartyIdentification, CityName vacío).
+"""
+
+import json
+
+import pytest
+
+from reggis_filas import ARCHIVOS, FIXTURES, filas_reggis
+
+# (procesador, archivo, fila, campo) -> valor actual
+CAMBIOS_INTENCIONALES = {
+    # chunk8-6: las reglas de conversión son excluyentes. Una línea LBR se
+    # convierte de libras aunque la descripción mencione gramos (antes la
+    # regla de gramos sobrescribía a la de libras).
+    ('casa_del_agricultor', 'casa_factura.xml', 1, 'Descripción'):
+        'Convertido de 40.0 LBR a 20.00000 KG',
+    # chunk8-18: GRAMOS y GRS en una sola alternación, gana la primera
+    # cantidad de la descripción ("10 GRAMOS ... 250 GRS"); antes ganaba GRS.
+    ('casa_del_agricultor', 'casa_factura.xml', 3, 'Cantidad'): '0,03000',
+    ('casa_del_agricultor', 'casa_factura.xml', 3, 'Descripción'):
+        'Convertido: (10.0 gr × 3.0) ÷ 1000 = 0.03000 KG',
+    # chunk7-4: aritmética en float. 1234.567845 queda en binario apenas por
+    # encima del 5 del sexto decimal y redondea hacia arriba (Decimal
+    # redondeaba al par).
+    ('lactalis_ventas', 'ventas_factura.xml', 2, 'precio_unitario'): '1234,56785',
+}
+
+
+@pytest.fixture(scope='module')
+def filas_actuales():
+    return filas_reggis()
+
+
+@pytest.fixture(scope='module')
+def filas_esperadas():
+    with open(FIXTURES / 'reggis_esperado.json', encoding='utf-8') as archivo:
+        esperadas = json.load(archivo)
+    for (procesador, nombre, fila, campo), valor in CAMBIOS_INTENCIONALES.items():
+        esperadas[procesador][nombre][fila][campo] = valor
+    return esperadas
+
+
+@pytest.mark.parametrize('procesador,nombre', [
+    (procesador, nombre) for procesador, archivos in ARCHIVOS.items() for nombre in archivos
+])
+def test_filas_reggis_sin_cambios(filas_actuales, filas_esperadas, procesador, nombre):
+    assert filas_actuales[procesador][nombre] == filas_esperadas[procesador][nombre]
+
+
+def test_cambios_intencionales_vigentes():
+    """Cada cambio listado apunta a un campo que existía antes"""
+    with open(FIXTURES / 'reggis_esperado.json', encoding='utf-8') as archivo:
+        antes = json.load(archivo)
+    for (procesador, nombre, fila, campo), valor in CAMBIOS_INTENCIONALES.items():
+        assert antes[procesador][nombre][fila][campo] != valor
@@ -37,6 +37,13 @@ NAMESPACES = {
     'sts': 'dian:gov:co:facturaelectronica:Structures-2-1',
 }
 
+# Mapeo de unidades estándar a las unidades REGGIS
+UNIT_MAP = {
+    'KG': 'Kg', 'KGM': 'Kg', 'LBR': 'Kg',
+    'LTR': 'Lt', 'LT': 'Lt',
+    'NIU': 'Un', 'EA': 'Un', 'EV': 'Un', 'JR': 'Un', 'UN': 'Un'
+}
+
 
 class SelectorCliente:
     """Ventana inicial para seleccionar el cliente"""
@@ -583,13 +590,7 @@ class ProcesadorCasaDelAgricultor:
             conversion_note = f"Convertido: ({grams} grs × {original_qty}) ÷ 1000 = {converted_qty:.5f} KG"
         
         # Mapeo de unidades estándar
-        unit_map = {
-            'KG': 'Kg', 'KGM': 'Kg', 'LBR': 'Kg',
-            'LTR': 'Lt', 'LT': 'Lt',
-            'NIU': 'Un', 'EA': 'Un', 'EV': 'Un', 'JR': 'Un', 'UN': 'Un'
-        }
-        
-        converted_unit = unit_map.get(converted_unit, converted_unit)
+        converted_unit = UNIT_MAP.get(converted_unit, converted_unit)
         
         return {
             **line,